@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""本地文档索引基准：在数千个生成的文档和日志文件上测量首次索引吞吐、重启后加载耗时、
+部分文件修改后的增量索引（只嵌入内容变化的块）以及检索延迟
+
+嵌入由模拟 Ollama 计算（字符二元组哈希向量），吞吐反映分块、批量请求和 SQLite 写入的开销，
+不含真实嵌入模型的推理时间；每次嵌入请求的固定延迟可用 --embed-delay 设置
+用法: python benchmarks/bench_documents.py [--files 3000] [--changed 0.05] [--queries 200]
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+from common import measure, print_table, format_bytes
+from fake_ollama import FakeOllama
+
+from core.utils import validate_config
+from core.ollama_client import OllamaPool
+from core.documents import DocumentIndex
+
+TOPICS = ['安装', '配置', '网络', '数据库', '缓存', '日志', '权限', '备份', '升级', '性能',
+          '模型', '截图', '语音', '插件', '快捷键', '代理', '证书', '磁盘', '内存', '显卡']
+LEVELS = ['INFO', 'INFO', 'INFO', 'WARNING', 'ERROR']
+
+
+def make_markdown(i: int, rng: random.Random) -> str:
+    sections = []
+    for s in range(rng.randint(3, 8)):
+        topic = rng.choice(TOPICS)
+        body = '\n'.join(f"第 {i}-{s}-{p} 段：关于{topic}的说明，{topic}相关的参数 {rng.randint(1, 999)} 需要按实际环境调整。"
+                         for p in range(rng.randint(2, 6)))
+        sections.append(f"## {topic} {s}\n\n{body}\n")
+    return f"# 文档 {i}\n\n" + '\n'.join(sections)
+
+
+def make_log(i: int, rng: random.Random) -> str:
+    lines = []
+    for n in range(rng.randint(40, 120)):
+        topic = rng.choice(TOPICS)
+        lines.append(f"2026-10-{rng.randint(1, 28):02d} 12:{n % 60:02d}:{rng.randint(0, 59):02d} "
+                     f"[{rng.choice(LEVELS)}] {topic}模块 #{i}: 处理请求 {rng.randint(1000, 9999)} 耗时 {rng.randint(1, 500)} ms")
+    return '\n'.join(lines) + '\n'
+
+
+def generate(directory: str, count: int, rng: random.Random):
+    total = 0
+    for i in range(count):
+        sub = os.path.join(directory, f'dir{i % 20:02d}')
+        os.makedirs(sub, exist_ok=True)
+        if i % 3 == 0:
+            path, text = os.path.join(sub, f'app{i}.log'), make_log(i, rng)
+        else:
+            path, text = os.path.join(sub, f'doc{i}.md'), make_markdown(i, rng)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        total += len(text.encode('utf-8'))
+    return total
+
+
+def modify(directory: str, ratio: float, rng: random.Random) -> int:
+    """在部分文件中间插入一行，日志文件末尾追加几行"""
+    paths = sorted(os.path.join(root, name) for root, _, files in os.walk(directory) for name in files)
+    changed = rng.sample(paths, max(1, int(len(paths) * ratio)))
+    for path in changed:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        if path.endswith('.log'):
+            lines[-1:] = [f"2026-10-29 08:00:{n:02d} [ERROR] 新增的错误记录 {n}" for n in range(5)] + ['']
+        else:
+            middle = len(lines) // 2
+            lines.insert(middle, '补充说明：此处新增了一行内容。')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        # 保证修改时间变化
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+    return len(changed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=3000)
+    parser.add_argument('--changed', type=float, default=0.05, help='增量测试中修改的文件比例')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--embed-delay', type=float, default=0.0, help='模拟每次嵌入请求的固定耗时（秒）')
+    parser.add_argument('--port', type=int, default=11570)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    instance = FakeOllama(args.port, ['nomic-embed-text'], parallel=4, token_delay=args.embed_delay).start()
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = os.path.join(directory, 'corpus')
+            size = generate(corpus, args.files, rng)
+            config = validate_config({'ollama': {'base_url': f'http://127.0.0.1:{args.port}'},
+                                      'documents': {'enabled': True, 'dirs': [corpus],
+                                                    'db_path': os.path.join(directory, 'documents.db')}})
+            index = DocumentIndex(config, OllamaPool(config))
+
+            before = instance.requests
+            start = time.perf_counter()
+            index.sync()
+            elapsed = time.perf_counter() - start
+            stats = index.stats()
+            rows.append(['首次索引', stats['files'], stats['chunks'], instance.requests - before, stats['chunks_embedded'],
+                         elapsed * 1000, f"{args.files / elapsed:.0f} 文件/s"])
+
+            start = time.perf_counter()
+            index.sync()
+            rows.append(['无变化重新扫描', stats['files'], 0, 0, 0, (time.perf_counter() - start) * 1000, '-'])
+
+            # 修改部分文件后增量索引
+            changed = modify(corpus, args.changed, rng)
+            embedded, before = index.stats()['chunks_embedded'], instance.requests
+            reused = index.stats()['chunks_reused']
+            start = time.perf_counter()
+            index.sync()
+            elapsed = time.perf_counter() - start
+            stats = index.stats()
+            new_chunks = stats['chunks_embedded'] - embedded
+            kept = stats['chunks_reused'] - reused
+            rows.append([f'修改 {changed} 个文件后', changed, new_chunks + kept, instance.requests - before, new_chunks,
+                         elapsed * 1000, f"复用 {kept} 块（{kept / max(new_chunks + kept, 1):.0%}）"])
+
+            # 重启后从 SQLite 加载全部向量
+            reopened = DocumentIndex(config, OllamaPool(config))
+            start = time.perf_counter()
+            reopened._reload(force=True)
+            rows.append(['重启后加载', len(reopened._docs), reopened.stats()['chunks'], 0, 0,
+                         (time.perf_counter() - start) * 1000, format_bytes(os.path.getsize(index.db_path))])
+
+            print(f"\n{args.files} 个文件（{format_bytes(size)}），分块 {index.chunk_chars} 字符，"
+                  f"每次嵌入 {index.batch_size} 块\n")
+            print_table(['阶段', '文件数', '块数', '嵌入请求', '嵌入块数', '耗时(ms)', '备注'], rows)
+
+            # 检索：从随机块中取一句作为问题，统计原块是否出现在前 5 个结果中
+            samples = []
+            conn = index._conn()
+            for path, text in conn.execute('SELECT path, text FROM chunks ORDER BY RANDOM() LIMIT ?', (args.queries,)):
+                lines = [line for line in text.split('\n') if len(line) > 20]
+                if lines:
+                    samples.append((path, rng.choice(lines)))
+            index.search(samples[0][1])  # 首次检索时合并向量矩阵
+            latencies, hits = [], 0
+            for path, query in samples:
+                start = time.perf_counter()
+                results = index.search(query, 5)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += any(result['path'] == path for result in results)
+            matrix, _ = index._search_matrix()
+            vector = matrix[0]
+            scan = measure(lambda: matrix @ vector, repeat=50)
+            stats = index.stats()
+    finally:
+        instance.stop()
+
+    print(f"\n检索 {len(samples)} 次（top-5，含通过 HTTP 计算问题嵌入）\n")
+    print_table(['块数', '检索中位数(ms)', 'p95(ms)', '其中矩阵运算(ms)', '问题嵌入平均(ms)', '原块命中率'],
+                [[matrix.shape[0], statistics.median(latencies),
+                  sorted(latencies)[int(len(latencies) * 0.95) - 1], scan['median'],
+                  stats['avg_query_embed_ms'], f"{hits / len(samples):.0%}"]])
+
+
+if __name__ == '__main__':
+    main()
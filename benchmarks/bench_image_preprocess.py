@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""图片预处理基准：对比原始内联处理与 core.image_pipeline.preprocess_image
+
+用法: python benchmarks/bench_image_preprocess.py [--repeat 5]
+"""
+
+import argparse
+from io import BytesIO
+
+from common import measure, print_table, format_bytes
+
+from PIL import Image
+
+from core.image_pipeline import preprocess_image
+
+SIZES = [
+    (800, 600),
+    (1920, 1080),
+    (3840, 2160),
+    (5472, 3648),  # 约 2000 万像素的手机照片
+]
+
+
+def make_image(width: int, height: int, fmt: str) -> bytes:
+    """生成带噪声的测试图片，避免纯色图片压缩过于理想"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffered = BytesIO()
+    image.save(buffered, format=fmt, quality=90)
+    return buffered.getvalue()
+
+
+def baseline(data: bytes) -> bytes:
+    """原 VisionProcessor.analyze_image 中的内联处理"""
+    image = Image.open(BytesIO(data))
+    image.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+    buffered = BytesIO()
+    image.convert('RGB').save(buffered, format="JPEG", quality=85)
+    return buffered.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = []
+    for fmt in ['JPEG', 'PNG']:
+        for width, height in SIZES:
+            data = make_image(width, height, fmt)
+            base = measure(lambda: baseline(data), repeat=args.repeat)
+            fast = measure(lambda: preprocess_image(data), repeat=args.repeat)
+            result = preprocess_image(data)
+            rows.append([
+                fmt, f"{width}x{height}", format_bytes(len(data)),
+                base['median'], fast['median'], base['median'] / fast['median'],
+                f"{result['width']}x{result['height']}", format_bytes(len(result['data'])),
+                'no' if not result['reencoded'] else 'yes'
+            ])
+
+    print_table(['格式', '尺寸', '输入', '原方案ms', '新方案ms', '加速比', '输出尺寸', '输出', '重编码'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""日志开销基准：模拟流式输出中逐块记录日志，对比同步 FileHandler 与队列异步写入
+调用方线程上的单次耗时，以及包含大字段（如 base64 截图参数）的日志
+
+用法: python benchmarks/bench_logging.py [--chunks 5000] [--threads 4] [--payload 200000]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import statistics
+
+from common import print_table
+
+from core.logging_setup import configure_logging, TEXT_FORMAT, shutdown_logging
+
+logger = logging.getLogger('bench.stream')
+
+
+def setup_sync(log_dir: str):
+    """原有方式：FileHandler + StreamHandler，在调用方线程中写盘"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    formatter = logging.Formatter(TEXT_FORMAT)
+    for handler in (logging.FileHandler(os.path.join(log_dir, 'sync.log'), encoding='utf-8'), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def setup_queue(log_dir: str, fmt: str):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    configure_logging({'logging': {'dir': log_dir, 'filename': f'queue_{fmt}.log', 'format': fmt}})
+
+
+def teardown():
+    """停止监听线程（写完队列中的日志）并移除处理器，返回耗时（毫秒）"""
+    start = time.perf_counter()
+    shutdown_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    return (time.perf_counter() - start) * 1000
+
+
+def stream_worker(chunks: int, samples: list):
+    """模拟一次流式回复：每个输出块记录一条日志"""
+    text = '模型输出的一个片段，包含中文和 English tokens ' * 3
+    for i in range(chunks):
+        start = time.perf_counter()
+        logger.info('chunk %d: %s', i, text)
+        samples.append((time.perf_counter() - start) * 1_000_000)
+
+
+def run_stream(chunks: int, threads: int):
+    samples = []
+    workers = [threading.Thread(target=stream_worker, args=(chunks, samples)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = (time.perf_counter() - start) * 1000
+    return samples, elapsed
+
+
+def run_payload(payload: int, repeat: int = 50):
+    """工具调用参数中带大字段（截图 base64）时的单次日志耗时"""
+    arguments = {'image': 'A' * payload}
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        logger.info(f"[Agent] 调用函数: analyze_screenshot, 参数: {arguments}")
+        samples.append((time.perf_counter() - start) * 1_000_000)
+    return samples
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunks', type=int, default=5000, help='每个线程记录的日志条数')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--payload', type=int, default=200000, help='大字段日志的字符数')
+    args = parser.parse_args()
+
+    # 控制台输出丢弃，只保留写文件和格式化的开销
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as log_dir:
+            modes = [('同步 FileHandler', lambda: setup_sync(log_dir)),
+                     ('队列 text', lambda: setup_queue(log_dir, 'text')),
+                     ('队列 json', lambda: setup_queue(log_dir, 'json'))]
+            for name, setup in modes:
+                setup()
+                samples, elapsed = run_stream(args.chunks, args.threads)
+                payload_samples = run_payload(args.payload)
+                flush_ms = teardown()
+                sizes = sum(os.path.getsize(os.path.join(log_dir, f)) for f in os.listdir(log_dir))
+                rows.append([name, statistics.median(samples), percentile(samples, 0.99), elapsed,
+                             flush_ms, statistics.median(payload_samples), sizes / 1024 / 1024])
+                for f in os.listdir(log_dir):
+                    os.remove(os.path.join(log_dir, f))
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+
+    print(f"\n{args.threads} 个线程 x {args.chunks} 条日志，大字段 {args.payload} 字符\n")
+    print_table(['方式', '单条中位数(us)', '单条 p99(us)', '总耗时(ms)', '停止时写完(ms)',
+                 '大字段单条(us)', '日志大小(MB)'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""对话记忆基准：内存映射向量存储的追加和 top-K 检索耗时（对比逐条计算余弦相似度），
+以及长对话中用检索片段代替完整历史后发送给模型的提示词 token 数
+
+用法: python benchmarks/bench_memory.py [--dim 768] [--sizes 1000 10000 100000] [--turns 200]
+"""
+
+import os
+import math
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+
+from common import print_table, format_bytes
+from fake_ollama import FakeOllama
+
+from core.utils import validate_config
+from core.ollama_client import OllamaPool
+from core.memory import UserMemory, ConversationMemory
+
+
+def naive_search(memory: UserMemory, query, top_k: int):
+    """逐条计算余弦相似度（未使用矩阵运算）"""
+    scores = []
+    for i in range(memory.count):
+        row = memory._matrix[i].tolist()
+        scores.append((sum(a * b for a, b in zip(row, query)), i))
+    return sorted(scores, reverse=True)[:top_k]
+
+
+def bench_store(sizes, dim: int, batch: int = 256):
+    rng = np.random.default_rng(1)
+    rows = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            memory = UserMemory(directory)
+            start = time.perf_counter()
+            for offset in range(0, size, batch):
+                n = min(batch, size - offset)
+                vectors = rng.standard_normal((n, dim)).astype(np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                memory.append(vectors, [{'seq': offset + i, 'text': ''} for i in range(n)], 'bench')
+            append_ms = (time.perf_counter() - start) * 1000
+
+            # 重新打开（模拟重启后首次检索时加载索引和内存映射）
+            reopened = UserMemory(directory)
+            query = rng.standard_normal(dim).astype(np.float32)
+            query /= np.linalg.norm(query)
+            start = time.perf_counter()
+            reopened.search(query, 4, size, -1.0)
+            cold_ms = (time.perf_counter() - start) * 1000
+            samples = []
+            for _ in range(20):
+                start = time.perf_counter()
+                reopened.search(query, 4, size, -1.0)
+                samples.append((time.perf_counter() - start) * 1000)
+            naive_ms = None
+            if size <= 10000:
+                start = time.perf_counter()
+                naive_search(reopened, query.tolist(), 4)
+                naive_ms = (time.perf_counter() - start) * 1000
+            file_size = os.path.getsize(reopened.vectors_path)
+        rows.append([size, append_ms, cold_ms, statistics.median(samples),
+                     naive_ms if naive_ms is not None else '-', format_bytes(file_size)])
+    return rows
+
+
+TOPICS = ['猫', '工作', '水果', '旅行', '电脑', '日语', '健身', '电影', '做饭', '股票']
+
+
+def synthetic_turn(i: int, rng: random.Random):
+    topic = TOPICS[i % len(TOPICS)]
+    question = f"第 {i} 轮：关于{topic}，" + '我想补充一些细节，' * rng.randint(2, 6)
+    answer = f"好的，关于{topic}的第 {i} 条记录：" + '这是一段比较长的回复内容，包含解释和建议。' * rng.randint(5, 15)
+    return question, answer
+
+
+def bench_prompt(turns: int, port: int):
+    instance = FakeOllama(port, ['qwen3:8b'], token_delay=0.001).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            config = validate_config({'ollama': {'base_url': f'http://127.0.0.1:{port}'},
+                                      'memory': {'enabled': True, 'dir': directory, 'min_score': 0.0}})
+            memory = ConversationMemory(config, OllamaPool(config))
+            rng = random.Random(1)
+            history, batch, rows = [], [], []
+            checkpoints = {t for t in (10, 50, 100, 200, 500) if t <= turns} | {turns}
+            for i in range(1, turns + 1):
+                question, answer = synthetic_turn(i, rng)
+                history.append({'role': 'user', 'content': question})
+                if i in checkpoints:
+                    # 先写入此前各轮的嵌入（与后台批量写入相同），再对本轮提问检索
+                    if batch:
+                        memory._embed_batch(batch)
+                        batch = []
+                    _, info = memory.build_prompt('bench', history)
+                    if info.get('used'):
+                        rows.append([i, len(history), info['prompt_tokens'] + info['tokens_saved'],
+                                     info['prompt_tokens'], info['tokens_saved'], info['retrieval_ms'], info['embed_ms']])
+                    else:
+                        rows.append([i, len(history), math.nan, math.nan, 0, 0, 0])
+                history.append({'role': 'assistant', 'content': answer})
+                batch.append(('bench', len(history) - 2, f"用户: {question}\n助手: {answer}"))
+    finally:
+        instance.stop()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dim', type=int, default=768, help='向量维度（nomic-embed-text 为 768）')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--port', type=int, default=11560)
+    args = parser.parse_args()
+
+    print(f"\n向量存储（{args.dim} 维 float32，检索 top-4）\n")
+    print_table(['向量数', '追加总耗时(ms)', '重新打开后首次检索(ms)', '检索中位数(ms)', '逐条计算(ms)', '文件大小'],
+                bench_store(args.sizes, args.dim))
+
+    print(f"\n{args.turns} 轮长对话（模拟嵌入模型），保留最近 8 条消息 + 最多 4 个相关片段\n")
+    print_table(['轮次', '历史消息数', '完整历史 token', '发送 token', '节省 token', '检索(ms)', '问题嵌入(ms)'],
+                bench_prompt(args.turns, args.port))
+
+
+if __name__ == '__main__':
+    main()
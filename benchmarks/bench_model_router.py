@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""模型路由基准：用模拟 Ollama（三个速度不同的模型）对比固定使用默认模型与自动路由时各类问题的延迟，
+并给出分类耗时和路由器学习到的生成速度
+
+模拟模型按各类问题的预计回复长度生成，每个 token 的耗时和延迟目标按 --scale 等比缩小，以便快速运行；
+表中延迟已换算回缩放前
+用法: python benchmarks/bench_model_router.py [--rounds 2] [--clients 2] [--scale 20]
+"""
+
+import json
+import time
+import argparse
+import threading
+import statistics
+from collections import defaultdict
+
+from common import measure, print_table
+from fake_ollama import FakeOllama
+
+from core.utils import validate_config
+from core.ollama_client import OllamaPool
+from core.model_router import ModelRouter, EXPECTED_TOKENS, AUTO, classify
+
+# 各模型每个 token 的耗时（秒，缩放前），大致对应消费级显卡上的速度
+TOKEN_DELAYS = {'qwen3:8b': 0.03, 'qwen3:4b': 0.012, 'qwen2.5-coder:7b': 0.025}
+
+WORKLOAD = [
+    '你好', '谢谢！', 'hello', '今天星期几？', '北京是哪个省的？', '1 公里等于多少米',
+    '帮我写一个 python 函数计算斐波那契数列', 'def parse(s):\n    return s.split(",")\n这段代码有什么问题',
+    '详细解释一下量子纠缠的原理，并比较它和经典关联的区别',
+    '帮我设计一个家庭网络的方案，包括路由器选型、网段划分和访客网络的步骤',
+]
+
+
+def run(port: int, mode: str, rounds: int, clients: int, scale: int, target_ms: float):
+    config = validate_config({'ollama': {'base_url': f'http://127.0.0.1:{port}', 'refresh_interval': 1},
+                              'router': {'enabled': mode != 'fixed', 'latency_target_ms': target_ms / scale}})
+    pool = OllamaPool(config)
+    pool.refresh()
+    pool.start()
+    router = ModelRouter(config, pool)
+    latencies = defaultdict(list)
+    models = defaultdict(int)
+    lock = threading.Lock()
+
+    def client(offset: int):
+        for i in range(rounds * len(WORKLOAD)):
+            prompt = WORKLOAD[(i + offset) % len(WORKLOAD)]
+            messages = [{'role': 'user', 'content': prompt}]
+            kind = classify(prompt)
+            start = time.perf_counter()
+            model, _ = router.route(messages, AUTO)
+            response = pool.post('/api/chat', model=model, stream=True, timeout=60,
+                                 json={'model': model, 'messages': messages, 'stream': True,
+                                       'options': {'num_predict': EXPECTED_TOKENS[kind]}})
+            try:
+                for line in response.iter_lines():
+                    data = json.loads(line) if line else {}
+                    if data.get('done'):
+                        pool.record_stats(model, data)
+            finally:
+                response.close()
+            with lock:
+                latencies[kind].append((time.perf_counter() - start) * 1000 * scale)
+                models[(kind, model)] += 1
+
+    threads = [threading.Thread(target=client, args=(i * 3,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    pool.stop()
+    return latencies, models, elapsed, router.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=2, help='每个客户端重复工作负载的次数')
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--scale', type=int, default=20, help='token 耗时的缩小倍数')
+    parser.add_argument('--port', type=int, default=11540)
+    args = parser.parse_args()
+
+    # 分类耗时
+    timing = measure(lambda: [classify(text, True) for text in WORKLOAD], repeat=200)
+    print(f"\n分类耗时: 中位数 {timing['median'] * 1000 / len(WORKLOAD):.1f} us/条")
+
+    delays = {model: delay / args.scale for model, delay in TOKEN_DELAYS.items()}
+    # 模型冷加载缩放前为 15 秒；预计耗时（缩放前）: 复杂问题在 qwen3:8b 上约 21 秒，在 qwen3:4b 上约 8.4 秒
+    scenarios = [('固定 qwen3:8b', 'fixed', 30000), ('自动路由，目标 30s', 'auto', 30000),
+                 ('自动路由，目标 15s', 'auto', 15000)]
+    rows, route_rows = [], []
+    kinds = ['greeting', 'simple', 'code', 'complex']
+    for name, mode, target in scenarios:
+        instance = FakeOllama(args.port, list(TOKEN_DELAYS), parallel=args.clients, tokens=1000,
+                              load_delay=15.0 / args.scale, max_loaded=len(TOKEN_DELAYS), token_delays=delays).start()
+        try:
+            latencies, models, elapsed, stats = run(args.port, mode, args.rounds, args.clients, args.scale, target)
+        finally:
+            instance.stop()
+        rows.append([name] + [statistics.median(latencies[kind]) if latencies[kind] else 0 for kind in kinds]
+                    + [elapsed * 1000 * args.scale])
+        route_rows.append([name, ', '.join(f'{kind}->{model} x{count}' for (kind, model), count in sorted(models.items()))])
+        last_stats = stats
+
+    print(f"\n{args.clients} 个客户端 x {args.rounds} 轮 x {len(WORKLOAD)} 条消息，各类问题的延迟中位数(ms)\n")
+    print_table(['场景'] + kinds + ['总耗时(ms)'], rows)
+    print("\n路由结果:\n")
+    for name, routes in route_rows:
+        print(f"  {name}: {routes}")
+
+    print("\n路由器学习到的生成速度（最后一个场景）:\n")
+    print("（速度和冷加载耗时为缩放后的值，模拟的冷加载缩放前为 15 秒）\n")
+    print_table(['模型', '实际 tokens/s', '学习 tokens/s', '冷加载(ms)', '样本'],
+                [[model, 1 / delays[model], s['tokens_per_second'] or 0, s['load_ms'] or 0, s['samples']]
+                 for model, s in last_stats['models'].items()])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Ollama 后端池基准：用多个模拟 Ollama 实例对比单后端与多后端的吞吐、延迟和模型冷加载次数，
+并在运行中停掉一个实例验证故障切换
+
+用法: python benchmarks/bench_ollama_pool.py [--backends 3] [--clients 6] [--requests 8]
+"""
+
+import time
+import random
+import argparse
+import threading
+import statistics
+
+from common import print_table
+from fake_ollama import FakeOllama
+
+import requests
+
+from core.utils import validate_config
+from core.ollama_client import OllamaPool
+
+MODELS = ['qwen3:8b', 'qwen3-vl:8b']
+
+
+def chat_once(pool: OllamaPool, model: str) -> float:
+    """发送一次流式对话并读完响应，返回耗时（毫秒）"""
+    start = time.perf_counter()
+    response = pool.post('/api/chat', model=model, stream=True, timeout=30,
+                         json={'model': model, 'stream': True, 'messages': [{'role': 'user', 'content': 'hi'}]})
+    try:
+        if response.status_code != 200:
+            raise RuntimeError(f'HTTP {response.status_code}')
+        for _ in response.iter_lines():
+            pass
+    finally:
+        response.close()
+    return (time.perf_counter() - start) * 1000
+
+
+def run(ports, clients: int, per_client: int, fail_port: int = None, seed: int = 1):
+    config = validate_config({'ollama': {'base_url': f'http://127.0.0.1:{ports[0]}',
+                                         'base_urls': [f'http://127.0.0.1:{p}' for p in ports],
+                                         'connect_timeout': 1, 'circuit_cooldown': 60,
+                                         'refresh_interval': 1}})
+    pool = OllamaPool(config)
+    pool.refresh()
+    pool.start()
+    latencies, errors = [], []
+    lock = threading.Lock()
+    rng = random.Random(seed)
+    # 每个客户端固定使用一个模型，与实际中各会话使用不同模型类似
+    assignments = [MODELS[i % len(MODELS)] for i in range(clients)]
+    rng.shuffle(assignments)
+
+    def client(model):
+        for _ in range(per_client):
+            try:
+                elapsed = chat_once(pool, model)
+                with lock:
+                    latencies.append(elapsed)
+            except (requests.RequestException, RuntimeError) as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=client, args=(model,)) for model in assignments]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    if fail_port is not None:
+        time.sleep(0.5)
+        instances[fail_port].stop()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    pool.stop()
+    return {
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else 0,
+        'p95': sorted(latencies)[int(len(latencies) * 0.95) - 1] if latencies else 0,
+        'errors': len(errors),
+        'stats': pool.stats()
+    }
+
+
+instances = {}
+
+
+def start_instances(ports, args):
+    for port in ports:
+        instances[port] = FakeOllama(port, MODELS, parallel=1, token_delay=args.token_delay,
+                                     tokens=args.tokens, load_delay=args.load_delay, max_loaded=1).start()
+
+
+def stop_instances():
+    for instance in instances.values():
+        instance.stop()
+    instances.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=6)
+    parser.add_argument('--requests', type=int, default=8, help='每个客户端的请求数')
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    parser.add_argument('--tokens', type=int, default=20)
+    parser.add_argument('--load-delay', type=float, default=0.5, help='模拟模型冷加载耗时（秒）')
+    parser.add_argument('--base-port', type=int, default=11520)
+    args = parser.parse_args()
+
+    ports = list(range(args.base_port, args.base_port + args.backends))
+    rows = []
+    scenarios = [('单后端', ports[:1], None), (f'{args.backends} 个后端', ports, None),
+                 (f'{args.backends} 个后端，运行中停掉 1 个', ports, ports[-1])]
+    for name, used, fail_port in scenarios:
+        start_instances(ports, args)
+        try:
+            result = run(used, args.clients, args.requests, fail_port)
+            loads = sum(instance.loads for instance in instances.values())
+        finally:
+            stop_instances()
+        rows.append([name, result['elapsed'] * 1000, result['throughput'], result['p50'], result['p95'],
+                     loads, result['errors']])
+        last_stats = result['stats']
+
+    print(f"\n{args.clients} 个客户端 x {args.requests} 次流式对话，模型 {', '.join(MODELS)}，"
+          f"每个实例并发 1、同时加载 1 个模型（冷加载 {args.load_delay}s）\n")
+    print_table(['场景', '总耗时(ms)', '请求/秒', 'p50(ms)', 'p95(ms)', '冷加载次数', '失败'], rows)
+
+    print("\n故障切换场景各后端状态:\n")
+    print_table(['后端', '状态', '请求', '失败', '已加载'],
+                [[s['url'], s['state'], s['requests'], s['failures'], ', '.join(s['loaded'])] for s in last_stats])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""API 响应体积基准：对比原始 JSON、gzip、brotli 以及 /api/chat 增量返回的传输大小
+
+用法: python benchmarks/bench_payload_size.py [--repeat 5] [--turns 20]
+"""
+
+import json
+import base64
+import argparse
+
+from common import measure, print_table, format_bytes
+
+from PIL import Image, ImageDraw
+
+from core.utils import validate_config
+from core.compression import ResponseCompressor
+from core.assets import brotli
+from core.image_pipeline import encode_screenshot
+from core.session_store import lean_message
+
+
+def make_screen(width: int = 1920, height: int = 1080) -> Image.Image:
+    image = Image.new('RGB', (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, width, 40], fill=(40, 44, 52))
+    for y in range(60, height - 20, 22):
+        draw.text((40, y), "def analyze_image(self, image_file, prompt): return result  # 示例" * 3, fill=(30, 30, 30))
+    return image
+
+
+def chat_history(turns: int, screenshot_b64: str):
+    """模拟 Agent 对话：每 5 轮有一次截图工具调用，工具结果中带 base64 截图"""
+    messages = []
+    for turn in range(turns):
+        messages.append({'role': 'user', 'content': f'第 {turn} 个问题：帮我看看屏幕上有什么，并总结一下当前打开的窗口。'})
+        if turn % 5 == 0:
+            messages.append({'role': 'assistant', 'content': '',
+                             'tool_calls': [{'function': {'name': 'take_screenshot', 'arguments': {}}}]})
+            messages.append({'role': 'tool', 'content': json.dumps(
+                {'success': True, 'screenshot': screenshot_b64, 'message': '截图成功'}, ensure_ascii=False)})
+        messages.append({'role': 'assistant', 'content': '屏幕上打开了代码编辑器和终端，编辑器中显示的是图片分析相关的 Python 代码。' * 3})
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=20)
+    args = parser.parse_args()
+
+    config = validate_config({'ollama': {}})
+    compressor = ResponseCompressor(config)
+    screenshot = encode_screenshot(make_screen(), 'jpeg', 85, 0, False)
+    screenshot_b64 = base64.b64encode(screenshot['data']).decode('ascii')
+    history = chat_history(args.turns, screenshot_b64)
+    # 最后一次带截图工具调用的一轮：用户消息、工具调用、工具结果、回复
+    tool_index = max(i for i, m in enumerate(history) if m['role'] == 'tool')
+    tool_turn = history[tool_index - 2:tool_index + 2]
+
+    payloads = {
+        '/config.json': config,
+        'screenshot (base64 JSON)': {'screenshot': f'data:image/jpeg;base64,{screenshot_b64}',
+                                     'width': screenshot['width'], 'height': screenshot['height']},
+        'chat: history[-10:]': {'response': history[-1]['content'], 'history': history[-10:]},
+        # 增量模式：一次普通问答只返回本轮的 2 条消息
+        'chat: cursor 增量': {'response': history[-1]['content'], 'messages': history[-2:], 'cursor': 120},
+        # 增量模式：本轮包含截图工具调用，工具结果被截断
+        'chat: cursor 增量 (工具)': {'response': history[-1]['content'],
+                                   'messages': [lean_message(m, 500) for m in tool_turn], 'cursor': 120},
+    }
+
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+    rows = []
+    for name, payload in payloads.items():
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        row = [name, format_bytes(len(data))]
+        for encoding in encodings:
+            compressed = compressor.compress(data, encoding)
+            timing = measure(lambda: compressor.compress(data, encoding), repeat=args.repeat)
+            row += [format_bytes(len(compressed)), timing['median']]
+        rows.append(row)
+
+    headers = ['响应', '原始']
+    for encoding in encodings:
+        headers += [encoding, f'{encoding}(ms)']
+    print(f"\n对话轮数: {args.turns}, 截图: {screenshot['width']}x{screenshot['height']} JPEG {format_bytes(len(screenshot['data']))}\n")
+    print_table(headers, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""截图编码基准：对比原 PNG + base64 方案与各编码格式的耗时和传输大小
+
+用法: python benchmarks/bench_screenshot_encoding.py [--repeat 5] [--quality 85]
+"""
+
+import argparse
+import base64
+from io import BytesIO
+
+from common import measure, print_table, format_bytes
+
+from PIL import Image, ImageDraw
+
+from core.image_pipeline import encode_screenshot
+
+RESOLUTIONS = [
+    (1366, 768),
+    (1920, 1080),
+    (2560, 1440),
+    (3840, 2160),
+]
+
+# (格式, 最长边, 灰度)
+VARIANTS = [
+    ('jpeg', 0, False),
+    ('webp', 0, False),
+    ('png', 0, False),
+    ('jpeg', 1600, False),
+    ('jpeg', 1600, True),
+]
+
+
+def make_screen(width: int, height: int) -> Image.Image:
+    """生成类似桌面截图的测试图：纯色面板、文字行和一块照片区域"""
+    image = Image.new('RGB', (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, width, 40], fill=(40, 44, 52))
+    draw.rectangle([0, 40, width // 5, height], fill=(230, 232, 236))
+    for y in range(60, height - 20, 22):
+        draw.text((width // 5 + 20, y), "def analyze_image(self, image_file, prompt): return result  # 示例" * 2,
+                  fill=(30, 30, 30))
+    photo = Image.effect_noise((width // 4, height // 4), 60).convert('RGB')
+    image.paste(photo, (width - width // 4 - 20, 60))
+    return image
+
+
+def baseline(image: Image.Image) -> int:
+    """原 SystemController.take_screenshot：PNG 编码后 base64 放入 JSON"""
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", quality=85)
+    return len(base64.b64encode(buffered.getvalue()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quality', type=int, default=85)
+    args = parser.parse_args()
+
+    rows = []
+    for width, height in RESOLUTIONS:
+        image = make_screen(width, height)
+        base = measure(lambda: baseline(image), repeat=args.repeat)
+        base_size = baseline(image)
+        rows.append([f"{width}x{height}", 'png+base64(原)', f"{width}x{height}",
+                     base['median'], format_bytes(base_size), 1.0])
+
+        for fmt, max_dimension, grayscale in VARIANTS:
+            def run():
+                return encode_screenshot(image, fmt, args.quality, max_dimension, grayscale)
+            stats = measure(run, repeat=args.repeat)
+            result = run()
+            label = fmt + (f"@{max_dimension}" if max_dimension else '') + ('/灰度' if grayscale else '')
+            rows.append([
+                '', label, f"{result['width']}x{result['height']}",
+                stats['median'], format_bytes(len(result['data'])), base_size / len(result['data'])
+            ])
+
+    print_table(['分辨率', '方案', '输出尺寸', '编码ms', '传输大小', '缩小倍数'], rows)
+
+
+if __name__ == '__main__':
+    main()
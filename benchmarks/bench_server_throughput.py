@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""服务端吞吐量基准：对比 Werkzeug 开发服务器与 gunicorn 多工作进程模式
+
+在项目根目录分别启动两种服务，用多个客户端进程并发请求，统计每秒请求数和延迟。
+截图接口（合成或真实屏幕 + JPEG 编码）代表 CPU 密集请求，/config.json 代表轻量请求。
+
+用法: python benchmarks/bench_server_throughput.py [--duration 10] [--clients 4] [--concurrency 8] [--workers 4]
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from common import PROJECT_ROOT, print_table
+
+import requests
+
+ENDPOINTS = {
+    'config': '/config.json',
+    'screenshot': '/api/system/screenshot?format=jpeg&max_dimension=1280',
+    'system_info': '/api/system/info',
+}
+
+
+def start_server(mode: str, port: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, LOCALAI_BIND=f'127.0.0.1:{port}')
+    if mode == 'dev':
+        command = [sys.executable, '-c',
+                   'import webui; webui.socketio.run(webui.app, host="127.0.0.1", '
+                   f'port={port}, allow_unsafe_werkzeug=True)']
+    else:
+        env['LOCALAI_WORKERS'] = str(workers)
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'webui:app']
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/config.json', timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} 服务启动超时')
+
+
+def client(args):
+    """单个客户端进程：多个线程循环请求，返回各请求耗时（毫秒）和失败数"""
+    url, duration, concurrency = args
+    deadline = time.perf_counter() + duration
+
+    def loop():
+        session = requests.Session()
+        samples, errors = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = session.get(url, timeout=30)
+                if response.ok:
+                    samples.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+            except requests.RequestException:
+                errors += 1
+        return samples, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: loop(), range(concurrency)))
+    return [s for samples, _ in results for s in samples], sum(e for _, e in results)
+
+
+def run_load(url: str, duration: float, clients: int, concurrency: int):
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(client, [(url, duration, concurrency)] * clients)
+    samples = sorted(s for result, _ in results for s in result)
+    errors = sum(e for _, e in results)
+    if not samples:
+        return 0.0, 0.0, 0.0, errors
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return len(samples) / duration, statistics.median(samples), p95, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=4, help='客户端进程数')
+    parser.add_argument('--concurrency', type=int, default=8, help='每个客户端进程的并发连接数')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn 工作进程数')
+    parser.add_argument('--port', type=int, default=7990)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    args = parser.parse_args()
+
+    rows = []
+    modes = [('dev', 1), ('gunicorn', args.workers)]
+    for mode, workers in modes:
+        process = start_server(mode, args.port, workers)
+        try:
+            for name in args.endpoints.split(','):
+                url = f'http://127.0.0.1:{args.port}{ENDPOINTS[name]}'
+                # 预热
+                run_load(url, 1, 1, 1)
+                rps, p50, p95, errors = run_load(url, args.duration, args.clients, args.concurrency)
+                rows.append([name, mode, workers, rps, p50, p95, errors])
+        finally:
+            process.terminate()
+            process.wait(10)
+
+    print(f"\n客户端: {args.clients} 进程 x {args.concurrency} 并发, 每项 {args.duration:.0f} 秒, CPU 核数: {os.cpu_count()}\n")
+    print_table(['接口', '模式', '进程数', '请求/秒', 'p50(ms)', 'p95(ms)', '失败'], rows)
+
+
+if __name__ == '__main__':
+    main()
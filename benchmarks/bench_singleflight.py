@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""请求合并基准：多个客户端在短时间内发出相同的流式对话和图片分析请求（多个标签页、双击、重连），
+对比逐个调用与合并后的模拟 Ollama 请求数、总耗时和后加入者的首个片段延迟
+
+用法: python benchmarks/bench_singleflight.py [--clients 8] [--spread 0.3]
+"""
+
+import io
+import time
+import random
+import argparse
+import threading
+import statistics
+
+from common import print_table
+from fake_ollama import FakeOllama
+
+from PIL import Image
+
+from core.utils import validate_config
+from core.ollama_client import OllamaPool
+from core.chat_manager import ChatManager
+from core.vision_processor import VisionProcessor
+
+
+def run_clients(clients: int, spread: float, fn, seed: int = 1):
+    """各客户端在 [0, spread) 秒内随机时刻发起调用，返回 (首个结果延迟列表, 总耗时)"""
+    rng = random.Random(seed)
+    delays = sorted(rng.uniform(0, spread) for _ in range(clients))
+    first = []
+    lock = threading.Lock()
+
+    def client(delay):
+        time.sleep(delay)
+        start = time.perf_counter()
+        latency = fn()
+        with lock:
+            first.append(latency if latency is not None else (time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client, args=(delay,)) for delay in delays]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return first, (time.perf_counter() - start) * 1000
+
+
+def stream_first_chunk(stream) -> float:
+    """读完流式响应，返回首个片段的延迟（毫秒）"""
+    start = time.perf_counter()
+    first = None
+    for _ in stream:
+        if first is None:
+            first = (time.perf_counter() - start) * 1000
+    return first or 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--spread', type=float, default=0.3, help='客户端发起请求的时间范围（秒）')
+    parser.add_argument('--port', type=int, default=11550)
+    args = parser.parse_args()
+
+    instance = FakeOllama(args.port, ['qwen3:8b', 'qwen3-vl:8b'], parallel=2, token_delay=0.03,
+                          tokens=40, load_delay=0.2, max_loaded=2).start()
+    config = validate_config({'ollama': {'base_url': f'http://127.0.0.1:{args.port}'},
+                              'vision': {'cache_enabled': False}})
+    pool = OllamaPool(config)
+    pool.refresh()
+    chat = ChatManager(config, pool)
+    vision = VisionProcessor(config, pool)
+    messages = [{'role': 'user', 'content': '介绍一下你自己'}]
+    buffer = io.BytesIO()
+    Image.new('RGB', (1280, 720), (30, 120, 200)).save(buffer, 'PNG')
+    image = buffer.getvalue()
+
+    cases = [
+        ('流式对话', '逐个调用', lambda: stream_first_chunk(chat._chat_stream(messages, 'qwen3:8b'))),
+        ('流式对话', '合并', lambda: stream_first_chunk(chat.chat_stream(messages, 'qwen3:8b'))),
+        ('图片分析', '逐个调用', lambda: vision._analyze_image(image, '描述这张图片', 'auto') and None),
+        ('图片分析', '合并', lambda: vision.analyze_image(image, '描述这张图片', 'auto') and None),
+    ]
+    rows = []
+    try:
+        for name, mode, fn in cases:
+            before = instance.requests
+            first, elapsed = run_clients(args.clients, args.spread, fn)
+            rows.append([name, mode, instance.requests - before, elapsed, statistics.median(first), max(first)])
+    finally:
+        instance.stop()
+        vision.preprocessor.shutdown()
+
+    print(f"\n{args.clients} 个客户端在 {args.spread}s 内发出相同请求（模拟 Ollama 并发 2）\n")
+    print_table(['请求', '方式', 'Ollama 请求数', '总耗时(ms)', '首个片段/结果中位数(ms)', '最大(ms)'], rows)
+    print("\n合并统计:\n")
+    print_table(['组', '调用', '共享', '合并率'],
+                [[group, s['calls'], s['shared'], s['coalesce_rate']]
+                 for group, s in (('chat', chat.flights.stats()), ('vision', vision.flights.stats()))])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""启动耗时基准：各模块导入耗时（python -X importtime）和服务启动到首个请求完成的时间
+
+用法: python benchmarks/bench_startup.py [--repeat 3] [--top 15] [--port 7991]
+"""
+
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+from common import PROJECT_ROOT, print_table
+
+import requests
+
+
+def import_times(top: int):
+    """返回 webui 直接导入的模块及其累计导入耗时（毫秒），按耗时降序"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import webui'],
+                            cwd=PROJECT_ROOT, capture_output=True, text=True)
+    rows, total = [], None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        head, cumulative_us, name = line.split('|')
+        self_us = head.split(':')[1]
+        # 模块名前的缩进表示导入层级（每级两个空格）
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if name == 'webui':
+            total = int(cumulative_us) / 1000
+        elif depth == 1:
+            # webui 模块体内直接导入的模块
+            rows.append((name, int(self_us) / 1000, int(cumulative_us) / 1000))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top], total
+
+
+def time_to_first_request(port: int):
+    """启动开发服务器，返回 (客户端测得的首个 / 请求完成时间, 服务端启动报告)"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'import webui; webui.socketio.run(webui.app, host="127.0.0.1", '
+                               f'port={port}, allow_unsafe_werkzeug=True)'],
+        cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + 60
+        while time.perf_counter() < deadline:
+            try:
+                if requests.get(f'http://127.0.0.1:{port}/', timeout=30).ok:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    report = requests.get(f'http://127.0.0.1:{port}/api/system/startup', timeout=5).json()
+                    return elapsed, report
+            except requests.ConnectionError:
+                time.sleep(0.02)
+        raise RuntimeError('服务启动超时')
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--port', type=int, default=7991)
+    args = parser.parse_args()
+
+    modules, total = import_times(args.top)
+    print(f"\nimport webui 累计耗时: {total:.1f}ms\n")
+    print_table(['模块', '自身(ms)', '累计(ms)'], modules)
+
+    samples = [time_to_first_request(args.port) for _ in range(args.repeat)]
+    rows = [[i + 1, elapsed, report['import_ms'], report['init_ms'], report['first_request_ms']]
+            for i, (elapsed, report) in enumerate(samples)]
+    rows.append(['中位数', statistics.median(s[0] for s in samples),
+                 statistics.median(s[1]['import_ms'] for s in samples),
+                 statistics.median(s[1]['init_ms'] for s in samples),
+                 statistics.median(s[1]['first_request_ms'] for s in samples)])
+    print()
+    print_table(['次数', '首页可用(ms)', '服务端导入(ms)', '服务端初始化(ms)', '服务端首个请求(ms)'], rows)
+
+
+if __name__ == '__main__':
+    main()
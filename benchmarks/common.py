@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""基准测试公共工具"""
+
+import os
+import sys
+import time
+import statistics
+from typing import Callable, List, Sequence, Dict, Any
+
+# 添加项目根目录到Python路径
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def measure(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """多次执行并返回耗时统计（毫秒）"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'mean': statistics.mean(samples),
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'max': max(samples)
+    }
+
+
+def print_table(headers: Sequence[str], rows: List[Sequence[Any]]):
+    """以对齐的表格形式打印结果"""
+    cells = [[str(h) for h in headers]] + [[_format_cell(c) for c in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    for index, row in enumerate(cells):
+        print('  '.join(cell.rjust(widths[i]) for i, cell in enumerate(row)))
+        if index == 0:
+            print('  '.join('-' * w for w in widths))
+
+
+def _format_cell(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def format_bytes(size: int) -> str:
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
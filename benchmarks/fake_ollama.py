@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""模拟 Ollama 服务，用于在本机测试多后端路由和故障切换
+
+支持 /api/tags、/api/ps、/api/chat、/api/generate（流式和非流式）以及 /api/embed
+（按字符二元组哈希得到的确定性向量，文字相近的文本相似度较高）。每个实例同时只处理
+--parallel 个生成请求（与 OLLAMA_NUM_PARALLEL 类似），切换到未加载的模型时等待 --load-delay 秒，
+最多同时加载 --max-loaded 个模型。结束帧带有与 Ollama 相同的 eval_count、eval_duration 等计时统计
+
+用法: python benchmarks/fake_ollama.py --ports 11501 11502 11503 [--models qwen3:8b qwen3-vl:8b]
+      然后在 config.json 中设置 "ollama": {"base_urls": ["http://127.0.0.1:11501", ...]}
+"""
+
+import json
+import time
+import zlib
+import socket
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+
+EMBED_DIM = 256
+
+REPLY = ['<think>', '思考', '</think>', '这是', '来自', '模拟', 'Ollama', '的', '回复', '。']
+
+
+class FakeOllama:
+    """单个模拟实例"""
+
+    def __init__(self, port: int, models: List[str], parallel: int = 1, token_delay: float = 0.01,
+                 tokens: int = 10, load_delay: float = 0.5, max_loaded: int = 1,
+                 token_delays: Optional[Dict[str, float]] = None):
+        self.port = port
+        self.models = list(models)
+        self.token_delay = token_delay
+        # 按模型设置每个 token 的耗时，模拟大小不同的模型
+        self.token_delays = dict(token_delays or {})
+        self.tokens = tokens
+        self.load_delay = load_delay
+        self.max_loaded = max_loaded
+        self.slots = threading.Semaphore(parallel)
+        self.loaded: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.loads = 0
+        self.server = None
+        self.connections = set()
+
+    def load(self, model: str) -> float:
+        """返回本次请求的模型加载耗时（秒），已加载时为 0"""
+        with self.lock:
+            if model in self.loaded:
+                self.loaded.move_to_end(model)
+                return 0.0
+            self.loaded[model] = time.time()
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+            self.loads += 1
+        time.sleep(self.load_delay)
+        return self.load_delay
+
+    @staticmethod
+    def embedding(text: str) -> List[float]:
+        """字符二元组哈希到固定维度的计数向量"""
+        vector = [0.0] * EMBED_DIM
+        for i in range(len(text) - 1):
+            vector[zlib.crc32(text[i:i + 2].encode('utf-8')) % EMBED_DIM] += 1.0
+        return vector
+
+    def timings(self, model: str, words: List[str], prompt_tokens: int, load: float) -> Dict[str, int]:
+        """结束帧中的计时统计（纳秒）"""
+        delay = self.token_delays.get(model, self.token_delay)
+        return {'load_duration': int(load * 1e9), 'eval_count': len(words),
+                'eval_duration': int(delay * len(words) * 1e9), 'prompt_eval_count': prompt_tokens,
+                'prompt_eval_duration': int(delay * prompt_tokens * 1e8)}
+
+    def start(self) -> 'FakeOllama':
+        instance = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status: int, body):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def setup(self):
+                super().setup()
+                with instance.lock:
+                    instance.connections.add(self.connection)
+
+            def finish(self):
+                with instance.lock:
+                    instance.connections.discard(self.connection)
+                super().finish()
+
+            def _stopped(self) -> bool:
+                if instance.server is None:
+                    self.close_connection = True
+                    return True
+                return False
+
+            def do_GET(self):
+                if self._stopped():
+                    return
+                if self.path == '/api/tags':
+                    self._json(200, {'models': [{'name': m} for m in instance.models]})
+                elif self.path == '/api/ps':
+                    with instance.lock:
+                        loaded = list(instance.loaded)
+                    self._json(200, {'models': [{'name': m} for m in loaded]})
+                else:
+                    self._json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self._stopped():
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/api/embed':
+                    inputs = request.get('input') or []
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    with instance.lock:
+                        instance.requests += 1
+                    time.sleep(instance.token_delay)
+                    self._json(200, {'model': request.get('model'),
+                                     'embeddings': [instance.embedding(text) for text in inputs]})
+                    return
+                if self.path not in ('/api/chat', '/api/generate'):
+                    self._json(404, {'error': 'not found'})
+                    return
+                model = request.get('model', '')
+                if model not in instance.models:
+                    self._json(404, {'error': f"model '{model}' not found"})
+                    return
+                chat = self.path == '/api/chat'
+                limit = request.get('options', {}).get('num_predict') or instance.tokens
+                words = (REPLY * (instance.tokens // len(REPLY) + 1))[:min(limit, instance.tokens)]
+                delay = instance.token_delays.get(model, instance.token_delay)
+                prompt = request.get('prompt') or ''.join(m.get('content') or '' for m in request.get('messages', []))
+                # 提示词处理按生成速度的 10 倍计算
+                prompt_tokens = len(prompt) // 2 + 1
+                with instance.slots:
+                    with instance.lock:
+                        instance.requests += 1
+                    load = instance.load(model)
+                    time.sleep(delay * prompt_tokens / 10)
+                    timings = instance.timings(model, words, prompt_tokens, load)
+                    if request.get('stream', True):
+                        self._stream(chat, words, delay, timings)
+                    else:
+                        time.sleep(delay * len(words))
+                        text = ''.join(words)
+                        body = {'message': {'role': 'assistant', 'content': text}} if chat else {'response': text}
+                        body.update(timings, done=True)
+                        self._json(200, body)
+
+            def _stream(self, chat: bool, words: List[str], delay: float, timings: Dict[str, int]):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for word in words + [None]:
+                    if instance.server is None:
+                        self.close_connection = True
+                        return
+                    if word is None:
+                        body = dict(timings, done=True)
+                    else:
+                        time.sleep(delay)
+                        body = {'message': {'role': 'assistant', 'content': word}} if chat else {'response': word}
+                        body['done'] = False
+                    line = (json.dumps(body, ensure_ascii=False) + '\n').encode('utf-8')
+                    self.wfile.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+                self.wfile.write(b'0\r\n\r\n')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name=f'fake-ollama-{self.port}', daemon=True).start()
+        return self
+
+    def stop(self):
+        """模拟进程退出：停止监听并断开已建立的长连接"""
+        server, self.server = self.server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ports', type=int, nargs='+', default=[11501, 11502, 11503])
+    parser.add_argument('--models', nargs='+', default=['qwen3:8b', 'qwen3-vl:8b', 'qwen2.5-coder:7b'])
+    parser.add_argument('--parallel', type=int, default=1)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--tokens', type=int, default=20)
+    parser.add_argument('--load-delay', type=float, default=1.0)
+    parser.add_argument('--max-loaded', type=int, default=1)
+    args = parser.parse_args()
+
+    for port in args.ports:
+        FakeOllama(port, args.models, args.parallel, args.token_delay, args.tokens,
+                   args.load_delay, args.max_loaded).start()
+        print(f"模拟 Ollama: http://127.0.0.1:{port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -6,36 +6,49 @@ import logging
 from typing import Dict, Any, List, Callable, Optional, Generator
 import requests
 
+from .utils import ThinkTagFilter
+from .screen_analysis import ScreenAnalyzer
+
 logger = logging.getLogger(__name__)
 
 class AIAgent:
     """AI Agent - 支持 Function Calling 的智能助手"""
     
-    def __init__(self, config: Dict[str, Any], system_controller, vision_processor):
+    def __init__(self, config: Dict[str, Any], system_controller, vision_processor, pool=None, documents=None):
         self.config = config
-        self.ollama_url = config['ollama']['base_url']
+        # 默认与视觉处理共用同一个 Ollama 后端池
+        self.pool = pool or vision_processor.pool
         self.default_model = config['ollama']['default_model']
         self.system_controller = system_controller
         self.vision_processor = vision_processor
+        self.screen_analyzer = ScreenAnalyzer(system_controller, vision_processor)
+        # 本地文档索引（DocumentIndex），启用后提供 search_documents 工具
+        self.documents = documents
         
         # 定义可用的工具函数
         self.tools = self._define_tools()
+    
+    def apply_config(self, config: Dict[str, Any]):
+        """应用重新加载的配置"""
+        self.config = config
+        self.default_model = config['ollama']['default_model']
+        # 文档索引可能被启用或关闭
+        self.tools = self._define_tools()
         
     def _define_tools(self) -> List[Dict[str, Any]]:
         """定义 Agent 可用的工具函数"""
-        return [
+        tools = [
             {
                 "type": "function",
                 "function": {
                     "name": "open_application",
-                    "description": "打开Windows应用程序，如记事本、计算器、画图、文件资源管理器、任务管理器等",
+                    "description": "打开已安装的应用程序，如记事本、计算器、浏览器、文件管理器、任务管理器等",
                     "parameters": {
                         "type": "object",
                         "properties": {
                             "app_name": {
                                 "type": "string",
-                                "description": "应用程序名称",
-                                "enum": ["notepad", "calc", "mspaint", "explorer", "taskmgr", "cmd", "powershell", "control"]
+                                "description": "应用程序名称，支持中文名、英文名或拼音，如 calc、计算器、firefox"
                             }
                         },
                         "required": ["app_name"]
@@ -54,6 +67,28 @@ class AIAgent:
                     }
                 }
             },
+            {
+                "type": "function",
+                "function": {
+                    "name": "analyze_screen",
+                    "description": "截取当前屏幕并用视觉模型分析，直接返回分析结果。用于回答屏幕上显示了什么、读取屏幕上的文字或报错等问题",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "prompt": {
+                                "type": "string",
+                                "description": "对屏幕内容的提问，例如“屏幕上的报错信息是什么”"
+                            },
+                            "scope": {
+                                "type": "string",
+                                "enum": ["screen", "active_window"],
+                                "description": "截图范围：整个屏幕或当前活动窗口，问题只涉及当前窗口时使用 active_window"
+                            }
+                        },
+                        "required": []
+                    }
+                }
+            },
             {
                 "type": "function",
                 "function": {
@@ -66,11 +101,33 @@ class AIAgent:
                     }
                 }
             },
+            {
+                "type": "function",
+                "function": {
+                    "name": "get_top_processes",
+                    "description": "获取占用资源最多的进程，用于回答“什么占用了CPU/内存”等问题",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "sort_by": {
+                                "type": "string",
+                                "enum": ["cpu", "memory", "io"],
+                                "description": "排序依据：CPU、内存或磁盘读写"
+                            },
+                            "limit": {
+                                "type": "integer",
+                                "description": "返回的进程数量，默认 5"
+                            }
+                        },
+                        "required": []
+                    }
+                }
+            },
             {
                 "type": "function",
                 "function": {
                     "name": "execute_command",
-                    "description": "执行系统命令（仅限白名单中的安全命令）",
+                    "description": "执行系统命令（仅限白名单中的安全命令）。命令运行较久时先返回部分输出和 run_id",
                     "parameters": {
                         "type": "object",
                         "properties": {
@@ -82,23 +139,71 @@ class AIAgent:
                         "required": ["command"]
                     }
                 }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "get_command_output",
+                    "description": "获取仍在运行的命令自上次查询以来的新输出",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "run_id": {
+                                "type": "string",
+                                "description": "execute_command 返回的 run_id"
+                            },
+                            "cancel": {
+                                "type": "boolean",
+                                "description": "是否终止该命令"
+                            }
+                        },
+                        "required": ["run_id"]
+                    }
+                }
             }
         ]
+        if self.documents is not None and self.documents.enabled:
+            tools.append({
+                "type": "function",
+                "function": {
+                    "name": "search_documents",
+                    "description": "在已索引的本地文件（项目文档、日志等）中检索与问题相关的片段，返回文件路径、行号和原文",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "query": {
+                                "type": "string",
+                                "description": "要检索的问题或关键词，用自然语言描述效果更好"
+                            },
+                            "limit": {
+                                "type": "integer",
+                                "description": "返回的片段数，默认 5"
+                            }
+                        },
+                        "required": ["query"]
+                    }
+                }
+            })
+        return tools
     
     def _get_function_handler(self, function_name: str) -> Optional[Callable]:
         """获取函数处理器"""
         handlers = {
             "open_application": self._handle_open_application,
             "take_screenshot": self._handle_take_screenshot,
+            "analyze_screen": self._handle_analyze_screen,
             "get_system_info": self._handle_get_system_info,
-            "execute_command": self._handle_execute_command
+            "get_top_processes": self._handle_get_top_processes,
+            "execute_command": self._handle_execute_command,
+            "get_command_output": self._handle_get_command_output,
+            "search_documents": self._handle_search_documents
         }
         return handlers.get(function_name)
     
     def _handle_open_application(self, app_name: str) -> Dict[str, Any]:
         """处理打开应用程序"""
         logger.info(f"[Agent] 打开应用程序: {app_name}")
-        result = self.system_controller.execute_command(app_name)
+        result = self.system_controller.open_application(app_name)
         return result
     
     def _handle_take_screenshot(self) -> Dict[str, Any]:
@@ -118,18 +223,69 @@ class AIAgent:
                 'error': str(e)
             }
     
+    def _handle_analyze_screen(self, prompt: str = "描述屏幕上的内容", scope: str = "screen") -> Dict[str, Any]:
+        """处理截图分析"""
+        logger.info(f"[Agent] 截图分析 ({scope}): {prompt}")
+        result = self.screen_analyzer.analyze(prompt, active_window=(scope == 'active_window'))
+        if not result.get('success'):
+            return {'success': False, 'error': result.get('error') or result.get('analysis')}
+        return {
+            'success': True,
+            'analysis': result['analysis'],
+            'timing': result['timing']
+        }
+    
     def _handle_get_system_info(self) -> Dict[str, Any]:
         """处理获取系统信息"""
         logger.info(f"[Agent] 获取系统信息")
         info = self.system_controller.get_system_info()
         return info
     
+    def _handle_get_top_processes(self, sort_by: str = "cpu", limit: int = 5) -> Dict[str, Any]:
+        """处理进程查询"""
+        logger.info(f"[Agent] 查询进程占用: {sort_by}")
+        return self.system_controller.get_top_processes(sort_by, limit)
+    
     def _handle_execute_command(self, command: str) -> Dict[str, Any]:
-        """处理执行命令"""
+        """处理执行命令，命令运行较久时返回部分输出，不阻塞到命令结束"""
         logger.info(f"[Agent] 执行命令: {command}")
-        result = self.system_controller.execute_command(command)
+        if command.lower().strip() not in self.system_controller.allowed_commands:
+            # 启动应用程序或拒绝未授权命令
+            return self.system_controller.execute_command(command)
+        
+        try:
+            run = self.system_controller.start_command(command)
+        except (PermissionError, RuntimeError) as e:
+            return {'success': False, 'error': str(e)}
+        
+        finished = run.wait(self.config['system'].get('command_agent_wait', 3))
+        result = self.system_controller.command_result(run, partial=True)
+        if not finished:
+            result['message'] = '命令仍在运行，以上为目前的部分输出，可用 get_command_output 获取后续输出'
         return result
     
+    def _handle_get_command_output(self, run_id: str, cancel: bool = False) -> Dict[str, Any]:
+        """处理获取命令输出"""
+        logger.info(f"[Agent] 获取命令输出: {run_id}")
+        run = self.system_controller.command_runner.get(run_id)
+        if run is None:
+            return {'success': False, 'error': f'未找到命令 {run_id}'}
+        if cancel:
+            self.system_controller.command_runner.cancel(run_id)
+            run.wait(2)
+        return self.system_controller.command_result(run, partial=True)
+    
+    def _handle_search_documents(self, query: str, limit: int = 5) -> Dict[str, Any]:
+        """处理本地文档检索"""
+        logger.info(f"[Agent] 检索本地文档: {query}")
+        if self.documents is None or not self.documents.enabled:
+            return {'success': False, 'error': '未启用本地文档索引'}
+        try:
+            results = self.documents.search(query, max(1, min(int(limit), 20)))
+        except Exception as e:
+            return {'success': False, 'error': f'文档检索失败: {str(e)}'}
+        return {'success': True, 'count': len(results), 'results': results}
+    
     def chat_with_tools(self, messages: List[Dict], model: str = None) -> str:
         """支持工具调用的对话"""
         if model is None:
@@ -149,14 +305,16 @@ class AIAgent:
         }
         
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/chat",
+            response = self.pool.post(
+                '/api/chat',
+                model=model,
                 json=payload,
                 timeout=60
             )
             
             if response.status_code == 200:
                 result = response.json()
+                self.pool.record_stats(model, result)
                 message = result.get('message', {})
                 
                 # 检查是否有工具调用
@@ -243,14 +401,16 @@ class AIAgent:
         }
         
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/chat",
+            response = self.pool.post(
+                '/api/chat',
+                model=model,
                 json=payload,
                 timeout=60
             )
             
             if response.status_code == 200:
                 result = response.json()
+                self.pool.record_stats(model, result)
                 return result.get('message', {}).get('content', '')
             else:
                 return f"错误: API返回状态码 {response.status_code}"
@@ -278,8 +438,9 @@ class AIAgent:
         }
         
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/chat",
+            response = self.pool.post(
+                '/api/chat',
+                model=model,
                 json=payload,
                 timeout=60
             )
@@ -292,6 +453,7 @@ class AIAgent:
             
             if response.status_code == 200:
                 result = response.json()
+                self.pool.record_stats(model, result)
                 message = result.get('message', {})
                 tool_calls = message.get('tool_calls', [])
                 
@@ -334,62 +496,35 @@ class AIAgent:
                         'options': {'temperature': 0.7}
                     }
                     
-                    final_resp = requests.post(
-                        f"{self.ollama_url}/api/chat",
+                    final_resp = self.pool.post(
+                        '/api/chat',
+                        model=model,
                         json=final_payload,
                         stream=True,
                         timeout=60
                     )
                     
                     # 用于过滤 <think> 标签的状态
-                    in_think_block = False
-                    buffer = ""
+                    think_filter = ThinkTagFilter()
                     full_content = ""
                     
                     for line in final_resp.iter_lines():
                         if line:
                             chunk = json.loads(line.decode('utf-8'))
+                            if chunk.get('done', False):
+                                self.pool.record_stats(model, chunk)
                             content = chunk.get('message', {}).get('content', '')
                             if content:
-                                buffer += content
-                                
-                                # 处理缓冲区，过滤 <think> 内容
-                                while True:
-                                    if in_think_block:
-                                        end_idx = buffer.find('</think>')
-                                        if end_idx != -1:
-                                            buffer = buffer[end_idx + 8:]
-                                            in_think_block = False
-                                        else:
-                                            buffer = ""
-                                            break
-                                    else:
-                                        start_idx = buffer.find('<think>')
-                                        if start_idx != -1:
-                                            if start_idx > 0:
-                                                out = buffer[:start_idx]
-                                                full_content += out
-                                                yield out
-                                            buffer = buffer[start_idx + 7:]
-                                            in_think_block = True
-                                        else:
-                                            safe_len = len(buffer)
-                                            for i in range(1, min(7, len(buffer) + 1)):
-                                                if buffer.endswith('<think>'[:i]):
-                                                    safe_len = len(buffer) - i
-                                                    break
-                                            
-                                            if safe_len > 0:
-                                                out = buffer[:safe_len]
-                                                full_content += out
-                                                yield out
-                                                buffer = buffer[safe_len:]
-                                            break
+                                out = think_filter.feed(content)
+                                if out:
+                                    full_content += out
+                                    yield out
                     
                     # 输出剩余缓冲区
-                    if buffer and not in_think_block:
-                        full_content += buffer
-                        yield buffer
+                    remaining = think_filter.flush()
+                    if remaining:
+                        full_content += remaining
+                        yield remaining
                     
                     # 将最终完整回复存入历史
                     messages.append({'role': 'assistant', 'content': full_content})
@@ -425,58 +560,35 @@ class AIAgent:
         }
         
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/chat",
+            response = self.pool.post(
+                '/api/chat',
+                model=model,
                 json=payload,
                 stream=True,
                 timeout=60
             )
             
             if response.status_code == 200:
-                in_think_block = False
-                buffer = ""
+                think_filter = ThinkTagFilter()
                 
                 for line in response.iter_lines():
                     if line:
                         try:
                             data = json.loads(line.decode('utf-8'))
                             if data.get('done', False):
+                                self.pool.record_stats(model, data)
                                 break
                             chunk = data.get('message', {}).get('content', '')
                             if chunk:
-                                buffer += chunk
-                                
-                                while True:
-                                    if in_think_block:
-                                        end_idx = buffer.find('</think>')
-                                        if end_idx != -1:
-                                            buffer = buffer[end_idx + 8:]
-                                            in_think_block = False
-                                        else:
-                                            buffer = ""
-                                            break
-                                    else:
-                                        start_idx = buffer.find('<think>')
-                                        if start_idx != -1:
-                                            if start_idx > 0:
-                                                yield buffer[:start_idx]
-                                            buffer = buffer[start_idx + 7:]
-                                            in_think_block = True
-                                        else:
-                                            safe_len = len(buffer)
-                                            for i in range(1, min(7, len(buffer) + 1)):
-                                                if buffer.endswith('<think>'[:i]):
-                                                    safe_len = len(buffer) - i
-                                                    break
-                                            if safe_len > 0:
-                                                yield buffer[:safe_len]
-                                                buffer = buffer[safe_len:]
-                                            break
+                                output = think_filter.feed(chunk)
+                                if output:
+                                    yield output
                         except json.JSONDecodeError:
                             continue
                 
-                if buffer and not in_think_block:
-                    yield buffer
+                remaining = think_filter.flush()
+                if remaining:
+                    yield remaining
             else:
                 yield f"错误: API返回状态码 {response.status_code}"
         except Exception as e:
@@ -0,0 +1,525 @@
+import os
+import re
+import json
+import glob
+import shlex
+import difflib
+import fnmatch
+import logging
+import platform
+import threading
+import subprocess
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PLATFORM = platform.system()
+
+# pypinyin 导入较慢（词典约 0.2 秒），首次需要拼音时再加载
+_pypinyin = None
+
+INDEX_VERSION = 2
+
+# 递归扫描和监视子目录的来源
+RECURSIVE_SOURCES = {'startmenu'}
+
+# 内置应用：启动命令和本地化名称
+if PLATFORM == 'Windows':
+    BUILTIN_APPS = {
+        'notepad': ('notepad.exe', ['记事本']),
+        'calc': ('calc.exe', ['计算器']),
+        'cmd': ('cmd.exe', ['命令提示符']),
+        'taskmgr': ('taskmgr.exe', ['任务管理器']),
+        'mspaint': ('mspaint.exe', ['画图']),
+        'explorer': ('explorer.exe', ['资源管理器']),
+        'control': ('control.exe', ['控制面板']),
+        'powershell': ('powershell.exe', ['PowerShell'])
+    }
+elif PLATFORM == 'Darwin':  # macOS
+    BUILTIN_APPS = {
+        'notepad': (['open', '-a', 'TextEdit'], ['文本编辑']),
+        'calc': (['open', '-a', 'Calculator'], ['计算器']),
+        'mspaint': (['open', '-a', 'Preview'], ['预览']),
+        'explorer': (['open', '.'], ['访达']),
+        'control': (['open', '-a', 'System Preferences'], ['系统偏好设置']),
+        'taskmgr': (['open', '-a', 'Activity Monitor'], ['活动监视器']),
+        'terminal': (['open', '-a', 'Terminal'], ['终端'])
+    }
+else:  # Linux
+    BUILTIN_APPS = {
+        'notepad': (['gedit'], ['文本编辑器']),
+        'calc': (['gnome-calculator'], ['计算器']),
+        'mspaint': (['gimp'], ['图像编辑器']),
+        'explorer': (['nautilus', '.'], ['文件管理器']),
+        'control': (['gnome-control-center'], ['系统设置']),
+        'taskmgr': (['gnome-system-monitor'], ['系统监视器']),
+        'terminal': (['gnome-terminal'], ['终端'])
+    }
+
+# .desktop 中 Exec 的占位符（%f %U 等）
+DESKTOP_FIELD_CODE = re.compile(r'%[fFuUdDnNickvm]')
+
+
+def _desktop_dirs() -> List[str]:
+    data_home = os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share'))
+    data_dirs = os.environ.get('XDG_DATA_DIRS', '/usr/local/share:/usr/share').split(':')
+    dirs = [os.path.join(d, 'applications') for d in [data_home] + data_dirs]
+    dirs += ['/var/lib/flatpak/exports/share/applications',
+             os.path.expanduser('~/.local/share/flatpak/exports/share/applications'),
+             '/var/lib/snapd/desktop/applications']
+    return [d for d in dict.fromkeys(dirs) if os.path.isdir(d)]
+
+
+def _app_dirs() -> List[str]:
+    """需要扫描和监视的应用目录"""
+    if PLATFORM == 'Windows':
+        dirs = [os.path.join(os.environ.get(var, ''), 'Microsoft', 'Windows', 'Start Menu', 'Programs')
+                for var in ('PROGRAMDATA', 'APPDATA')]
+    elif PLATFORM == 'Darwin':
+        dirs = ['/Applications', '/System/Applications', os.path.expanduser('~/Applications')]
+    else:
+        return _desktop_dirs()
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def _path_dirs() -> List[str]:
+    dirs = os.environ.get('PATH', '').split(os.pathsep)
+    return [d for d in dict.fromkeys(dirs) if d and os.path.isdir(d)]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'[\s_\-.]+', '', text.lower())
+
+
+def _pinyin():
+    """返回 pypinyin 模块，未安装时返回 None（不支持拼音匹配）"""
+    global _pypinyin
+    if _pypinyin is None:
+        try:
+            import pypinyin
+            _pypinyin = pypinyin
+        except ImportError:
+            _pypinyin = False
+    return _pypinyin or None
+
+
+def _search_keys(names: List[str]) -> List[str]:
+    """名称的归一化形式，中文名称额外生成全拼和首字母"""
+    keys = []
+    for name in names:
+        if not name:
+            continue
+        keys.append(_normalize(name))
+        if re.search(r'[一-鿿]', name):
+            pypinyin = _pinyin()
+            if pypinyin is not None:
+                keys.append(_normalize(''.join(pypinyin.lazy_pinyin(name))))
+                keys.append(_normalize(''.join(pypinyin.lazy_pinyin(name, style=pypinyin.Style.FIRST_LETTER))))
+    return list(dict.fromkeys(k for k in keys if k))
+
+
+def parse_desktop_file(path: str) -> Optional[Dict[str, Any]]:
+    """解析 .desktop 文件，隐藏或非应用类型的条目返回 None"""
+    values = {}
+    section = None
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    section = line
+                    continue
+                if section != '[Desktop Entry]' or '=' not in line or line.startswith('#'):
+                    continue
+                key, value = line.split('=', 1)
+                values[key.strip()] = value.strip()
+    except OSError:
+        return None
+
+    if values.get('Type') != 'Application' or not values.get('Exec'):
+        return None
+    if values.get('NoDisplay') == 'true' or values.get('Hidden') == 'true':
+        return None
+
+    try:
+        argv = [arg for arg in shlex.split(DESKTOP_FIELD_CODE.sub('', values['Exec'])) if arg]
+    except ValueError:
+        return None
+    if not argv:
+        return None
+
+    app_id = os.path.splitext(os.path.basename(path))[0]
+    names = [values.get('Name', ''), values.get('Name[zh_CN]', ''), values.get('GenericName', ''),
+             values.get('GenericName[zh_CN]', ''), app_id.split('.')[-1], os.path.basename(argv[0])]
+    names += [k for k in values.get('Keywords[zh_CN]', values.get('Keywords', '')).split(';') if k]
+    return {
+        'id': f'desktop:{app_id}',
+        'name': values.get('Name[zh_CN]') or values.get('Name') or app_id,
+        'names': [n for n in dict.fromkeys(names) if n],
+        'exec': argv,
+        'path': path,
+        'source': 'desktop'
+    }
+
+
+def _file_entry(path: str, source: str) -> Optional[Dict[str, Any]]:
+    """macOS .app、Windows 开始菜单快捷方式和 PATH 中的可执行文件"""
+    base = os.path.basename(path)
+    if source == 'macos':
+        name = base[:-4] if base.endswith('.app') else None
+        argv = ['open', '-a', path]
+    elif source == 'startmenu':
+        name = base[:-4] if base.lower().endswith('.lnk') else None
+        argv = None  # 通过 os.startfile 启动
+    else:
+        if not os.path.isfile(path) or not os.access(path, os.X_OK):
+            return None
+        name = os.path.splitext(base)[0] if PLATFORM == 'Windows' else base
+        argv = [path]
+    if not name:
+        return None
+    return {
+        'id': f'{source}:{name.lower()}',
+        'name': name,
+        'names': [name],
+        'exec': argv,
+        'path': path,
+        'source': source
+    }
+
+
+def _is_under(path: str, directory: str) -> bool:
+    """path 是否为 directory 或其子目录（Windows 下不区分大小写）"""
+    path, directory = os.path.normcase(os.path.normpath(path)), os.path.normcase(os.path.normpath(directory))
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+class _WatchHandler:
+    """watchdog 事件处理器（observer 只调用 dispatch，无需继承以便延迟导入 watchdog）"""
+
+    def __init__(self, catalog: 'AppCatalog'):
+        self.catalog = catalog
+
+    def dispatch(self, event):
+        if event.is_directory and not event.src_path.endswith('.app'):
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if path:
+                self.catalog.refresh_path(path)
+
+
+class AppCatalog:
+    """应用程序索引：扫描应用目录和 PATH，支持模糊和拼音匹配，按白名单过滤可启动的应用"""
+
+    def __init__(self, config: Dict[str, Any]):
+        system_config = config.get('system', {})
+        self.index_path = system_config.get('app_catalog_path', os.path.join('cache', 'app_catalog.json'))
+        # 白名单匹配 "来源:ID"，如 builtin:*、desktop:firefox、path:code
+        self.allowlist = system_config.get('app_allowlist', ['builtin:*', 'desktop:*', 'macos:*', 'startmenu:*'])
+        self.watch_enabled = system_config.get('app_watch', True)
+        self.match_threshold = system_config.get('app_match_threshold', 0.75)
+
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._by_path: Dict[str, str] = {}
+        self._keys: Dict[str, List[str]] = {}
+        self._lock = threading.RLock()
+        self._observer = None
+        self._save_timer: Optional[threading.Timer] = None
+        self.ready = threading.Event()
+        # 查询时等待索引加载完成的最长时间
+        self.ready_timeout = system_config.get('app_ready_timeout', 5.0)
+
+    def start(self):
+        """在后台加载持久化索引（目录未变化时）或重新扫描，然后开始监视目录"""
+        threading.Thread(target=self._initialize, name='app-catalog-scan', daemon=True).start()
+
+    def _initialize(self):
+        try:
+            with self._lock:
+                for app_id, (command, localized) in BUILTIN_APPS.items():
+                    self._add({
+                        'id': f'builtin:{app_id}',
+                        'name': localized[0],
+                        'names': [app_id] + localized,
+                        'exec': command if isinstance(command, list) else [command],
+                        'path': None,
+                        'source': 'builtin'
+                    })
+            if not self._load():
+                self.rescan()
+        except Exception as e:
+            logger.error(f"初始化应用索引失败: {str(e)}")
+        finally:
+            self.ready.set()
+        self._start_watch()
+
+    def _directories(self) -> Dict[str, List[str]]:
+        source = {'Windows': 'startmenu', 'Darwin': 'macos'}.get(PLATFORM, 'desktop')
+        return {source: _app_dirs(), 'path': _path_dirs()}
+
+    def _signature(self) -> Dict[str, float]:
+        """各扫描目录（递归扫描的来源包括所有子目录）的修改时间，用于判断持久化索引是否过期"""
+        signature = {}
+        for source, dirs in self._directories().items():
+            for directory in dirs:
+                try:
+                    signature[directory] = os.stat(directory).st_mtime
+                except OSError:
+                    continue
+                if source not in RECURSIVE_SOURCES:
+                    continue
+                for root, subdirs, _ in os.walk(directory):
+                    for name in subdirs:
+                        path = os.path.join(root, name)
+                        try:
+                            signature[path] = os.stat(path).st_mtime
+                        except OSError:
+                            continue
+        return signature
+
+    def rescan(self):
+        """完整扫描所有目录"""
+        entries = []
+        for source, dirs in self._directories().items():
+            for directory in dirs:
+                entries.extend(self._scan_directory(source, directory))
+
+        with self._lock:
+            for app_id in [i for i, e in self._entries.items() if e['source'] != 'builtin']:
+                self._remove(app_id)
+            for entry in entries:
+                self._add(entry)
+        logger.info(f"应用索引扫描完成，共 {len(self._entries)} 个条目")
+        self._save()
+
+    @staticmethod
+    def _scan_directory(source: str, directory: str) -> List[Dict[str, Any]]:
+        entries = []
+        if source == 'desktop':
+            for path in glob.glob(os.path.join(directory, '*.desktop')):
+                entry = parse_desktop_file(path)
+                if entry:
+                    entries.append(entry)
+        elif source == 'startmenu':
+            for path in glob.glob(os.path.join(directory, '**', '*.lnk'), recursive=True):
+                entry = _file_entry(path, source)
+                if entry:
+                    entries.append(entry)
+        else:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                return entries
+            for name in names:
+                entry = _file_entry(os.path.join(directory, name), source)
+                if entry:
+                    entries.append(entry)
+        return entries
+
+    def _add(self, entry: Dict[str, Any]):
+        """加入索引（调用方持有锁或处于初始化阶段）；同 ID 的条目保留先扫描到的"""
+        if entry['id'] in self._entries and self._entries[entry['id']].get('path') != entry.get('path'):
+            return
+        if 'keys' not in entry:
+            entry['keys'] = _search_keys(entry['names'])
+        self._entries[entry['id']] = entry
+        if entry.get('path'):
+            self._by_path[entry['path']] = entry['id']
+        for key in entry['keys']:
+            self._keys.setdefault(key, []).append(entry['id'])
+
+    def _remove(self, app_id: str):
+        entry = self._entries.pop(app_id, None)
+        if entry is None:
+            return
+        if entry.get('path'):
+            self._by_path.pop(entry['path'], None)
+        for key in entry['keys']:
+            ids = self._keys.get(key, [])
+            if app_id in ids:
+                ids.remove(app_id)
+            if not ids:
+                self._keys.pop(key, None)
+
+    def refresh_path(self, path: str):
+        """文件变化时增量更新单个条目"""
+        directory = os.path.dirname(path)
+        dirs = self._directories()
+        # 递归扫描的来源（开始菜单）中快捷方式多在 Programs\<厂商>\ 等子目录下，按路径前缀匹配
+        source = next((s for s, ds in dirs.items()
+                       if directory in ds or (s in RECURSIVE_SOURCES and any(_is_under(directory, d) for d in ds))),
+                      None)
+        if source is None:
+            return
+
+        if source == 'desktop':
+            entry = parse_desktop_file(path) if path.endswith('.desktop') and os.path.exists(path) else None
+        elif os.path.exists(path):
+            entry = _file_entry(path, source)
+        else:
+            entry = None
+
+        with self._lock:
+            old_id = self._by_path.get(path)
+            if old_id:
+                self._remove(old_id)
+            if entry:
+                self._add(entry)
+        self._schedule_save()
+
+    def _start_watch(self):
+        if not self.watch_enabled:
+            return
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.warning("未安装 watchdog，应用目录监视不可用")
+            return
+        try:
+            observer = Observer()
+            handler = _WatchHandler(self)
+            for source, dirs in self._directories().items():
+                for directory in dirs:
+                    observer.schedule(handler, directory, recursive=(source in RECURSIVE_SOURCES))
+            observer.daemon = True
+            observer.start()
+            self._observer = observer
+            logger.info("应用目录监视已启动")
+        except Exception as e:
+            logger.warning(f"启动应用目录监视失败: {str(e)}")
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+
+    def is_allowed(self, entry: Dict[str, Any]) -> bool:
+        return any(fnmatch.fnmatch(entry['id'], pattern) for pattern in self.allowlist)
+
+    def search(self, query: str, limit: int = 5, allowed_only: bool = True) -> List[Dict[str, Any]]:
+        """按名称、拼音或模糊匹配查找应用，返回按得分排序的结果"""
+        self.ready.wait(self.ready_timeout)
+        query_keys = _search_keys([query])
+        if not query_keys:
+            return []
+
+        scores: Dict[str, float] = {}
+
+        def score(app_id: str, value: float):
+            if value > scores.get(app_id, 0):
+                scores[app_id] = value
+
+        with self._lock:
+            all_keys = list(self._keys)
+            for q in query_keys:
+                for app_id in self._keys.get(q, []):
+                    score(app_id, 1.0)
+                for key in all_keys:
+                    if key.startswith(q):
+                        for app_id in self._keys[key]:
+                            score(app_id, 0.9)
+                    elif len(q) >= 3 and q in key:
+                        for app_id in self._keys[key]:
+                            score(app_id, 0.8)
+                for key in difflib.get_close_matches(q, all_keys, n=limit * 2, cutoff=0.6):
+                    ratio = difflib.SequenceMatcher(None, q, key).ratio()
+                    for app_id in self._keys[key]:
+                        score(app_id, 0.9 * ratio)
+
+            results = []
+            for app_id, value in scores.items():
+                entry = self._entries[app_id]
+                if allowed_only and not self.is_allowed(entry):
+                    continue
+                # 同分时优先内置和图形界面应用
+                source_rank = {'builtin': 0, 'desktop': 1, 'macos': 1, 'startmenu': 1}.get(entry['source'], 2)
+                results.append((-value, source_rank, entry['name'], app_id))
+            results.sort()
+            return [self._public(self._entries[app_id], -neg) for neg, _, _, app_id in results[:limit]]
+
+    def resolve(self, query: str) -> Optional[Dict[str, Any]]:
+        """返回得分超过阈值的最佳匹配"""
+        matches = self.search(query, limit=1)
+        if matches and matches[0]['score'] >= self.match_threshold:
+            return matches[0]
+        return None
+
+    def list_apps(self, allowed_only: bool = True) -> List[Dict[str, Any]]:
+        self.ready.wait(self.ready_timeout)
+        with self._lock:
+            entries = [e for e in self._entries.values() if not allowed_only or self.is_allowed(e)]
+        return [self._public(e) for e in sorted(entries, key=lambda e: (e['source'] != 'builtin', e['name']))]
+
+    def launch(self, app: Dict[str, Any]) -> Dict[str, Any]:
+        """启动已解析的应用（必须在白名单内）"""
+        with self._lock:
+            entry = self._entries.get(app['id'])
+        if entry is None or not self.is_allowed(entry):
+            return {'success': False, 'error': f"应用 {app['name']} 不在允许列表中"}
+
+        try:
+            if entry['exec'] is None:
+                os.startfile(entry['path'])
+            else:
+                options = {'shell': False}
+                if PLATFORM == 'Windows':
+                    options['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+                else:
+                    options['start_new_session'] = True
+                subprocess.Popen(entry['exec'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **options)
+            return {'success': True, 'message': f"已启动 {entry['name']}", 'app': self._public(entry)}
+        except Exception as e:
+            logger.error(f"启动应用程序失败: {str(e)}")
+            return {'success': False, 'error': str(e)}
+
+    @staticmethod
+    def _public(entry: Dict[str, Any], score: Optional[float] = None) -> Dict[str, Any]:
+        result = {'id': entry['id'], 'name': entry['name'], 'source': entry['source']}
+        if score is not None:
+            result['score'] = round(score, 3)
+        return result
+
+    def _load(self) -> bool:
+        """加载持久化索引，扫描目录有变化时返回 False"""
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != INDEX_VERSION or data.get('signature') != self._signature():
+                return False
+            # 保存时未安装 pypinyin、现在已安装：重新扫描以生成拼音
+            if not data.get('pinyin') and _pinyin() is not None:
+                return False
+            with self._lock:
+                for entry in data['entries']:
+                    self._add(entry)
+            logger.info(f"已加载应用索引，共 {len(self._entries)} 个条目")
+            return True
+        except Exception as e:
+            logger.warning(f"加载应用索引失败: {str(e)}")
+            return False
+
+    def _schedule_save(self):
+        """目录变化通常成批出现，延迟合并写入"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+            self._save_timer = threading.Timer(2.0, self._save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save(self):
+        with self._lock:
+            # 连同检索键一起保存，加载时无需重新计算拼音
+            entries = [e for e in self._entries.values() if e['source'] != 'builtin']
+        try:
+            directory = os.path.dirname(self.index_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': INDEX_VERSION, 'signature': self._signature(),
+                           'pinyin': _pinyin() is not None, 'entries': entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.warning(f"保存应用索引失败: {str(e)}")
@@ -0,0 +1,191 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    # 未安装 brotli 时只生成 gzip 版本
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 10
+
+# 按优先级排列的预压缩格式：(Content-Encoding, 文件后缀)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _compress(data: bytes, encoding: str) -> Optional[bytes]:
+    if encoding == 'br':
+        return brotli.compress(data, quality=11) if brotli is not None else None
+    # mtime=0 使相同内容生成相同的压缩结果
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def negotiate(accept_encoding: str, available) -> Optional[str]:
+    """根据 Accept-Encoding 选择可用的预压缩格式，q=0 表示拒绝"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding, _ in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+class AssetManager:
+    """静态资源构建与服务：文件名加内容哈希，预生成 gzip/brotli 版本"""
+
+    def __init__(self, config: Dict[str, Any], static_dir: str = 'static'):
+        assets_config = config.get('assets', {})
+        self.enabled = assets_config.get('enabled', True) and not config.get('webui', {}).get('debug', False)
+        self.static_dir = os.path.abspath(static_dir)
+        self.dist_dir = os.path.abspath(assets_config.get('dist_dir', os.path.join(static_dir, 'dist')))
+        self.extensions = tuple(assets_config.get('extensions', ['.js', '.css', '.svg', '.png', '.ico', '.woff2']))
+        self.compress_extensions = tuple(assets_config.get('compress_extensions', ['.js', '.css', '.svg', '.json']))
+        self.min_compress_size = assets_config.get('min_compress_size', 256)
+        self.max_age = assets_config.get('max_age', 31536000)
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        # 带哈希的文件名 -> 源文件名
+        self._reverse: Dict[str, str] = {}
+
+    def _sources(self):
+        for root, dirs, files in os.walk(self.static_dir):
+            # 跳过构建输出目录
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != self.dist_dir]
+            for name in files:
+                if name.endswith(self.extensions):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, self.static_dir).replace(os.sep, '/'), path
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def build(self) -> Dict[str, Dict[str, Any]]:
+        """构建资源：只重新生成内容有变化的文件，删除过期的旧版本"""
+        previous = self._load_manifest()
+        manifest = {}
+        built = 0
+        for name, path in self._sources():
+            with open(path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            entry = previous.get(name)
+            if entry and entry['hash'] == digest and self._complete(entry):
+                manifest[name] = entry
+                continue
+
+            stem, ext = os.path.splitext(name)
+            fingerprinted = f"{stem}.{digest[:HASH_LENGTH]}{ext}"
+            target = os.path.join(self.dist_dir, fingerprinted)
+            self._write(target, data)
+            encodings = {}
+            if ext in self.compress_extensions and len(data) >= self.min_compress_size:
+                for encoding, suffix in ENCODINGS:
+                    compressed = _compress(data, encoding)
+                    # 压缩后没有明显变小的不保留
+                    if compressed is not None and len(compressed) < len(data) * 0.9:
+                        self._write(target + suffix, compressed)
+                        encodings[encoding] = len(compressed)
+            manifest[name] = {'path': fingerprinted, 'hash': digest, 'size': len(data), 'encodings': encodings,
+                              'brotli': brotli is not None}
+            built += 1
+
+            if entry and entry['path'] != fingerprinted:
+                self._remove_variants(entry['path'])
+
+        for name, entry in previous.items():
+            if name not in manifest:
+                self._remove_variants(entry['path'])
+
+        if built or manifest != previous:
+            self._write(os.path.join(self.dist_dir, MANIFEST_NAME),
+                        json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+            logger.info(f"静态资源构建完成: {built} 个文件更新，共 {len(manifest)} 个")
+        return manifest
+
+    def _complete(self, entry: Dict[str, Any]) -> bool:
+        """检查构建产物是否齐全（可能被手动删除或之前未安装 brotli）"""
+        target = os.path.join(self.dist_dir, entry['path'])
+        if not os.path.exists(target):
+            return False
+        suffixes = dict(ENCODINGS)
+        if brotli is not None and not entry.get('brotli') and entry['encodings']:
+            return False
+        return all(os.path.exists(target + suffixes[e]) for e in entry['encodings'])
+
+    def _remove_variants(self, fingerprinted: str):
+        target = os.path.join(self.dist_dir, fingerprinted)
+        for path in [target] + [target + suffix for _, suffix in ENCODINGS]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        """先写临时文件再替换，多个工作进程同时构建时互不影响"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def start(self):
+        """启动时构建资源并加载清单"""
+        if not self.enabled:
+            return
+        try:
+            self.manifest = self.build()
+        except Exception as e:
+            logger.error(f"构建静态资源失败，使用原始文件: {str(e)}")
+            self.manifest = {}
+        self._reverse = {entry['path']: name for name, entry in self.manifest.items()}
+
+    def url_path(self, filename: str) -> Optional[str]:
+        """返回带哈希的文件名，未构建时返回 None"""
+        entry = self.manifest.get(filename)
+        return entry['path'] if entry else None
+
+    def resolve(self, fingerprinted: str, accept_encoding: str) -> Optional[Tuple[str, Optional[str], str]]:
+        """返回 (文件路径, Content-Encoding, MIME 类型)，未知文件返回 None"""
+        name = self._reverse.get(fingerprinted)
+        if name is None:
+            return None
+        entry = self.manifest[name]
+        path = os.path.join(self.dist_dir, entry['path'])
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        encoding = negotiate(accept_encoding, entry['encodings'])
+        if encoding is not None:
+            path += dict(ENCODINGS)[encoding]
+        return path, encoding, mimetype
+
+
+if __name__ == '__main__':
+    # 部署时预先构建（在项目根目录执行）：python -m core.assets
+    from core.utils import validate_config
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    manager = AssetManager(validate_config({'ollama': {}}))
+    for name, entry in manager.build().items():
+        sizes = ', '.join(f"{e} {s}B" for e, s in entry['encodings'].items())
+        print(f"{name} -> {entry['path']} ({entry['size']}B{', ' + sizes if sizes else ''})")
@@ -0,0 +1,392 @@
+import os
+import re
+import time
+import logging
+import platform
+import threading
+import subprocess
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+PLATFORM = platform.system()
+
+# (left, top, width, height)
+Region = Tuple[int, int, int, int]
+
+# 没有可用后端时缓存失败结果，间隔该秒数后才重新探测（探测需要导入各后端并实际截图）
+SELECT_RETRY_INTERVAL = 30
+
+
+class CaptureBackend:
+    """截图后端基类，坐标均为虚拟屏幕坐标"""
+
+    name = 'base'
+
+    @classmethod
+    def available(cls) -> bool:
+        return False
+
+    def monitors(self) -> List[Dict[str, int]]:
+        """返回显示器列表，第 0 项为整个虚拟屏幕"""
+        raise NotImplementedError
+
+    def grab(self, region: Optional[Region] = None) -> Image.Image:
+        raise NotImplementedError
+
+
+class MssBackend(CaptureBackend):
+    """mss：直接读取系统截屏接口，通常是最快的后端"""
+
+    name = 'mss'
+
+    def __init__(self):
+        import mss
+        self._mss = mss
+        # mss 实例不能跨线程使用
+        self._local = threading.local()
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import mss  # noqa: F401
+        except ImportError:
+            return False
+        return PLATFORM != 'Linux' or bool(os.environ.get('DISPLAY'))
+
+    def _sct(self):
+        sct = getattr(self._local, 'sct', None)
+        if sct is None:
+            sct = self._local.sct = self._mss.mss()
+        return sct
+
+    def monitors(self) -> List[Dict[str, int]]:
+        return [
+            {'index': index, 'left': m['left'], 'top': m['top'], 'width': m['width'], 'height': m['height']}
+            for index, m in enumerate(self._sct().monitors)
+        ]
+
+    def grab(self, region: Optional[Region] = None) -> Image.Image:
+        sct = self._sct()
+        if region is None:
+            monitor = sct.monitors[0]
+        else:
+            left, top, width, height = region
+            monitor = {'left': left, 'top': top, 'width': width, 'height': height}
+        shot = sct.grab(monitor)
+        return Image.frombytes('RGB', shot.size, shot.bgra, 'raw', 'BGRX')
+
+
+class PilGrabBackend(CaptureBackend):
+    """PIL.ImageGrab：Windows/macOS 原生接口，Linux 下通过 X11"""
+
+    name = 'pil'
+
+    def __init__(self):
+        from PIL import ImageGrab
+        self._grab = ImageGrab.grab
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            from PIL import ImageGrab  # noqa: F401
+        except ImportError:
+            return False
+        if PLATFORM == 'Linux':
+            from PIL import features
+            return bool(os.environ.get('DISPLAY')) and features.check_feature('xcb')
+        return True
+
+    def monitors(self) -> List[Dict[str, int]]:
+        # ImageGrab 不提供显示器信息，只能返回整个虚拟屏幕
+        width, height = self._grab(all_screens=True).size
+        return [{'index': 0, 'left': 0, 'top': 0, 'width': width, 'height': height}]
+
+    def grab(self, region: Optional[Region] = None) -> Image.Image:
+        bbox = None
+        if region is not None:
+            left, top, width, height = region
+            bbox = (left, top, left + width, top + height)
+        return self._grab(bbox=bbox, all_screens=True).convert('RGB')
+
+
+class PyAutoGuiBackend(CaptureBackend):
+    """pyautogui：兼容性最好但最慢（Linux 下调用外部截图程序）"""
+
+    name = 'pyautogui'
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+
+    @classmethod
+    def available(cls) -> bool:
+        if PLATFORM == 'Linux' and not os.environ.get('DISPLAY'):
+            return False
+        try:
+            import pyautogui  # noqa: F401
+        except Exception:
+            # 无图形环境时导入本身可能失败
+            return False
+        return True
+
+    def monitors(self) -> List[Dict[str, int]]:
+        width, height = self._pyautogui.size()
+        return [{'index': 0, 'left': 0, 'top': 0, 'width': width, 'height': height}]
+
+    def grab(self, region: Optional[Region] = None) -> Image.Image:
+        return self._pyautogui.screenshot(region=region).convert('RGB')
+
+
+class SyntheticBackend(CaptureBackend):
+    """合成画面：用于无图形环境的测试和基准"""
+
+    name = 'synthetic'
+
+    def __init__(self, width: int = 1920, height: int = 1080, monitor_count: int = 1):
+        self.width = width
+        self.height = height
+        self.monitor_count = max(1, monitor_count)
+        self._frame = None
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def monitors(self) -> List[Dict[str, int]]:
+        total_width = self.width * self.monitor_count
+        monitors = [{'index': 0, 'left': 0, 'top': 0, 'width': total_width, 'height': self.height}]
+        for index in range(self.monitor_count):
+            monitors.append({'index': index + 1, 'left': index * self.width, 'top': 0,
+                             'width': self.width, 'height': self.height})
+        return monitors
+
+    def _render(self) -> Image.Image:
+        """绘制类似桌面的画面，右上角的计数器让连续截图内容不同"""
+        if self._frame is None:
+            width = self.width * self.monitor_count
+            frame = Image.linear_gradient('L').resize((width, self.height)).convert('RGB')
+            draw = ImageDraw.Draw(frame)
+            for index in range(self.monitor_count):
+                left = index * self.width
+                draw.rectangle([left, 0, left + self.width, 32], fill=(40, 44, 52))
+                draw.rectangle([left + 80, 120, left + self.width - 80, self.height - 120], fill=(250, 250, 250))
+                for y in range(140, self.height - 140, 24):
+                    draw.text((left + 100, y), f"Display {index + 1} line {y // 24}", fill=(20, 20, 20))
+            self._frame = frame
+        frame = self._frame.copy()
+        draw = ImageDraw.Draw(frame)
+        draw.text((frame.width - 120, 10), f"#{self._counter}", fill=(255, 255, 255))
+        self._counter += 1
+        return frame
+
+    def grab(self, region: Optional[Region] = None) -> Image.Image:
+        with self._lock:
+            frame = self._render()
+        if region is None:
+            return frame
+        left, top, width, height = region
+        return frame.crop((left, top, left + width, top + height))
+
+
+BACKENDS = {
+    'mss': MssBackend,
+    'pil': PilGrabBackend,
+    'pyautogui': PyAutoGuiBackend,
+    'synthetic': SyntheticBackend,
+}
+
+
+def get_active_window_rect() -> Optional[Region]:
+    """获取当前活动窗口的位置，无法获取时返回 None"""
+    try:
+        if PLATFORM == 'Windows':
+            import ctypes
+            from ctypes import wintypes
+            hwnd = ctypes.windll.user32.GetForegroundWindow()
+            rect = wintypes.RECT()
+            if not hwnd or not ctypes.windll.user32.GetWindowRect(hwnd, ctypes.byref(rect)):
+                return None
+            return rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top
+        if PLATFORM == 'Darwin':
+            script = ('tell application "System Events" to tell (first process whose frontmost is true) '
+                      'to get {position, size} of front window')
+            output = subprocess.run(['osascript', '-e', script], capture_output=True,
+                                    text=True, timeout=2).stdout
+            values = [int(v) for v in re.findall(r'-?\d+', output)]
+            return tuple(values[:4]) if len(values) >= 4 else None
+        output = subprocess.run(['xdotool', 'getactivewindow', 'getwindowgeometry', '--shell'],
+                                capture_output=True, text=True, timeout=2).stdout
+        geometry = dict(line.split('=', 1) for line in output.splitlines() if '=' in line)
+        return int(geometry['X']), int(geometry['Y']), int(geometry['WIDTH']), int(geometry['HEIGHT'])
+    except Exception as e:
+        logger.debug(f"获取活动窗口失败: {str(e)}")
+        return None
+
+
+def parse_region(value) -> Region:
+    """解析 "x,y,宽,高" 格式（或四元素列表）的区域"""
+    parts = [int(part) for part in (value.split(',') if isinstance(value, str) else value)]
+    if len(parts) != 4 or parts[2] <= 0 or parts[3] <= 0:
+        raise ValueError(f"区域格式应为 x,y,宽,高: {value}")
+    return tuple(parts)
+
+
+class ScreenCapture:
+    """截图入口：首次截图时选择最快的可用后端，支持显示器、矩形区域和活动窗口截图"""
+
+    def __init__(self, config: Dict[str, Any]):
+        system_config = config.get('system', {})
+        self.backend_name = system_config.get('capture_backend', 'auto')
+        width, height = system_config.get('capture_synthetic_size', [1920, 1080])
+        self._synthetic_options = {'width': width, 'height': height}
+        self._latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self.probe_results: Dict[str, Any] = {}
+        self._backend: Optional[CaptureBackend] = None
+        self._select_error: Optional[Tuple[Exception, float]] = None
+        self._select_lock = threading.Lock()
+
+    @property
+    def backend(self) -> CaptureBackend:
+        """延迟选择后端：探测需要导入 mss/pyautogui 并实际截图，不放在启动阶段"""
+        if self._backend is None:
+            with self._select_lock:
+                if self._backend is None:
+                    failed = self._select_error
+                    if failed is not None and time.monotonic() - failed[1] < SELECT_RETRY_INTERVAL:
+                        raise failed[0]
+                    try:
+                        self._backend = self._select_backend()
+                    except (RuntimeError, ValueError) as e:
+                        self._select_error = (e, time.monotonic())
+                        raise
+                    self._select_error = None
+                    logger.info(f"截图后端: {self._backend.name}")
+        return self._backend
+
+    def _create(self, name: str) -> CaptureBackend:
+        if name == 'synthetic':
+            return SyntheticBackend(**self._synthetic_options)
+        return BACKENDS[name]()
+
+    def _select_backend(self) -> CaptureBackend:
+        if self.backend_name != 'auto':
+            if self.backend_name not in BACKENDS:
+                raise ValueError(f"未知的截图后端: {self.backend_name}")
+            return self._create(self.backend_name)
+
+        # 对每个可用后端截一小块区域计时，选择最快的
+        best, best_ms = None, None
+        for name, cls in BACKENDS.items():
+            if name == 'synthetic' or not cls.available():
+                continue
+            try:
+                backend = self._create(name)
+                backend.grab((0, 0, 64, 64))
+                start_time = time.perf_counter()
+                backend.grab((0, 0, 256, 256))
+                elapsed_ms = (time.perf_counter() - start_time) * 1000
+            except Exception as e:
+                self.probe_results[name] = {'error': str(e)}
+                continue
+            self.probe_results[name] = {'probe_ms': round(elapsed_ms, 2)}
+            if best is None or elapsed_ms < best_ms:
+                best, best_ms = backend, elapsed_ms
+
+        if best is None:
+            # 合成画面只在显式配置 capture_backend 为 synthetic 时使用（无显示环境的测试），
+            # 自动选择时不能把它当作用户的屏幕交给模型分析
+            errors = '; '.join(f"{name}: {result['error']}" for name, result in self.probe_results.items()
+                               if 'error' in result)
+            raise RuntimeError(f"没有可用的截图后端{'（' + errors + '）' if errors else ''}")
+        return best
+
+    def monitors(self) -> List[Dict[str, int]]:
+        return self.backend.monitors()
+
+    def resolve_region(self, monitor: Optional[int] = None, region: Optional[Region] = None,
+                       active_window: bool = False) -> Optional[Region]:
+        """将显示器编号/活动窗口转换为截图区域，None 表示整个虚拟屏幕"""
+        if region is not None:
+            return region
+        if active_window:
+            rect = get_active_window_rect()
+            if rect is None:
+                raise ValueError("无法获取活动窗口位置")
+            return rect
+        if monitor:
+            monitors = self.monitors()
+            if monitor >= len(monitors):
+                raise ValueError(f"显示器 {monitor} 不存在，共 {len(monitors) - 1} 个显示器")
+            m = monitors[monitor]
+            return m['left'], m['top'], m['width'], m['height']
+        return None
+
+    def capture(self, monitor: Optional[int] = None, region: Optional[Region] = None,
+                active_window: bool = False) -> Image.Image:
+        """截图并记录耗时"""
+        target = self.resolve_region(monitor, region, active_window)
+        start_time = time.perf_counter()
+        image = self.backend.grab(target)
+        self._record(self.backend.name, (time.perf_counter() - start_time) * 1000)
+        return image
+
+    def _record(self, name: str, elapsed_ms: float):
+        with self._lock:
+            self._latencies.setdefault(name, deque(maxlen=100)).append(elapsed_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        """当前后端及最近截图耗时"""
+        with self._lock:
+            latency = {}
+            for name, samples in self._latencies.items():
+                ordered = sorted(samples)
+                latency[name] = {
+                    'count': len(ordered),
+                    'last_ms': round(samples[-1], 2),
+                    'mean_ms': round(sum(ordered) / len(ordered), 2),
+                    'p50_ms': round(ordered[len(ordered) // 2], 2),
+                    'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2)
+                }
+        try:
+            backend, error = self.backend.name, None
+        except RuntimeError as e:
+            backend, error = None, str(e)
+        return {
+            'backend': backend,
+            'error': error,
+            'available': [name for name, cls in BACKENDS.items() if cls.available()],
+            'probe': self.probe_results,
+            'latency': latency
+        }
+
+    def compare_backends(self, repeat: int = 5, region: Optional[Region] = None) -> Dict[str, Any]:
+        """依次用每个可用后端截图，返回耗时对比"""
+        repeat = max(1, repeat)
+        results = {}
+        for name, cls in BACKENDS.items():
+            if not cls.available():
+                continue
+            try:
+                current = self._backend
+                backend = current if current is not None and name == current.name else self._create(name)
+                samples = []
+                for _ in range(repeat):
+                    start_time = time.perf_counter()
+                    image = backend.grab(region)
+                    samples.append((time.perf_counter() - start_time) * 1000)
+                samples.sort()
+                results[name] = {
+                    'size': f"{image.width}x{image.height}",
+                    'min_ms': round(samples[0], 2),
+                    'median_ms': round(samples[len(samples) // 2], 2)
+                }
+            except Exception as e:
+                results[name] = {'error': str(e)}
+        return results
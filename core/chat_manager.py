@@ -3,36 +3,49 @@ import requests
 from typing import List, Dict, Any, Generator
 import logging
 
+from .utils import ThinkTagFilter
+from .ollama_client import OllamaPool
+from .singleflight import SingleFlight, digest
+
 logger = logging.getLogger(__name__)
 
 class ChatManager:
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], pool: OllamaPool = None, documents=None):
+        self.config = config
+        self.pool = pool or OllamaPool(config)
+        # 本地文档索引（DocumentIndex），发送前自动附加相关文档片段
+        self.documents = documents
+        self.default_model = config['ollama']['default_model']
+        # 合并并发的相同请求（多个标签页同时刷新模型列表、相同的对话内容）
+        self.flights = SingleFlight('chat')
+    
+    def apply_config(self, config: Dict[str, Any]):
+        """应用重新加载的配置（进行中的请求继续使用原后端和模型，后端列表由 OllamaPool 更新）"""
         self.config = config
-        self.ollama_url = config['ollama']['base_url']
         self.default_model = config['ollama']['default_model']
         
     def get_available_models(self) -> List[str]:
-        """获取可用的模型列表"""
-        try:
-            response = requests.get(f"{self.ollama_url}/api/tags")
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                return [model['name'] for model in models]
-        except requests.exceptions.ConnectionError:
-            logger.warning("无法连接到Ollama服务")
+        """获取可用的模型列表（各后端已安装模型的并集，由后端池定期刷新）"""
+        models = self.flights.do('models', self.pool.list_models)
+        if models is not None:
+            return models
+        logger.warning("无法连接到Ollama服务")
         return ['qwen3:8b', 'qwen3-vl:8b', 'qwen2.5-coder:7b']  # 默认列表
     
     def chat(self, messages: List[Dict], model: str = None, stream: bool = False) -> str:
-        """发送聊天消息"""
+        """发送聊天消息（相同模型和消息的并发请求只调用一次 Ollama）"""
         if model is None:
             model = self.default_model
-        
+        return self.flights.do(digest('chat', model, messages), lambda: self._chat(messages, model, stream))
+    
+    def _chat(self, messages: List[Dict], model: str, stream: bool) -> str:
         # 检查模型是否存在
         available_models = self.get_available_models()
         if available_models and model not in available_models:
             logger.warning(f"模型 {model} 不可用，已安装模型: {available_models}")
             return f"错误: 模型 '{model}' 未安装。\n\n已安装的模型: {', '.join(available_models)}\n\n请运行 install_models.bat 安装模型，或在设置中选择其他模型。"
         
+        messages = self._with_documents(messages)
         payload = {
             'model': model,
             'messages': messages,
@@ -45,8 +58,9 @@ class ChatManager:
         }
         
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/chat",
+            response = self.pool.post(
+                '/api/chat',
+                model=model,
                 json=payload,
                 stream=stream,
                 timeout=60
@@ -60,6 +74,7 @@ class ChatManager:
                         if line:
                             data = json.loads(line.decode('utf-8'))
                             if data.get('done', False):
+                                self.pool.record_stats(model, data)
                                 break
                             chunk = data.get('message', {}).get('content', '')
                             if chunk:
@@ -67,6 +82,7 @@ class ChatManager:
                     return full_response
                 else:
                     data = response.json()
+                    self.pool.record_stats(model, data)
                     return data.get('message', {}).get('content', '')
             elif response.status_code == 404:
                 logger.error(f"模型 {model} 不存在")
@@ -96,10 +112,13 @@ class ChatManager:
             return f"错误: {str(e)}"
     
     def chat_stream(self, messages: List[Dict], model: str = None) -> Generator[str, None, None]:
-        """流式聊天响应"""
+        """流式聊天响应（相同模型和消息的并发请求共享一次生成，后加入的先收到已生成的部分）"""
         if model is None:
             model = self.default_model
-        
+        yield from self.flights.stream(digest('chat_stream', model, messages),
+                                       lambda: self._chat_stream(messages, model))
+    
+    def _chat_stream(self, messages: List[Dict], model: str) -> Generator[str, None, None]:
         # 检查模型是否存在
         available_models = self.get_available_models()
         if available_models and model not in available_models:
@@ -109,6 +128,7 @@ class ChatManager:
             yield "请运行 install_models.bat 安装模型，或在设置中选择其他模型。"
             return
         
+        messages = self._with_documents(messages)
         payload = {
             'model': model,
             'messages': messages,
@@ -120,8 +140,9 @@ class ChatManager:
         }
         
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/chat",
+            response = self.pool.post(
+                '/api/chat',
+                model=model,
                 json=payload,
                 stream=True,
                 timeout=60
@@ -129,62 +150,29 @@ class ChatManager:
             
             if response.status_code == 200:
                 # 用于过滤 <think> 标签的状态
-                in_think_block = False
-                buffer = ""
+                think_filter = ThinkTagFilter()
                 
                 for line in response.iter_lines():
                     if line:
                         try:
                             data = json.loads(line.decode('utf-8'))
                             if data.get('done', False):
+                                self.pool.record_stats(model, data)
                                 break
                             chunk = data.get('message', {}).get('content', '')
                             if chunk:
-                                # 将chunk加入缓冲区处理
-                                buffer += chunk
-                                
-                                # 处理缓冲区，过滤 <think> 内容
-                                while True:
-                                    if in_think_block:
-                                        # 在 think 块内，寻找结束标签
-                                        end_idx = buffer.find('</think>')
-                                        if end_idx != -1:
-                                            # 找到结束标签，跳过 think 内容
-                                            buffer = buffer[end_idx + 8:]  # 8 = len('</think>')
-                                            in_think_block = False
-                                        else:
-                                            # 未找到结束标签，清空缓冲区等待更多数据
-                                            buffer = ""
-                                            break
-                                    else:
-                                        # 不在 think 块内，寻找开始标签
-                                        start_idx = buffer.find('<think>')
-                                        if start_idx != -1:
-                                            # 找到开始标签，先输出之前的内容
-                                            if start_idx > 0:
-                                                yield buffer[:start_idx]
-                                            buffer = buffer[start_idx + 7:]  # 7 = len('<think>')
-                                            in_think_block = True
-                                        else:
-                                            # 检查是否有不完整的 <think 开始
-                                            # 保留可能的部分标签
-                                            safe_len = len(buffer)
-                                            for i in range(1, min(7, len(buffer) + 1)):
-                                                if buffer.endswith('<think>'[:i]):
-                                                    safe_len = len(buffer) - i
-                                                    break
-                                            
-                                            if safe_len > 0:
-                                                yield buffer[:safe_len]
-                                                buffer = buffer[safe_len:]
-                                            break
+                                # 过滤 <think> 内容后输出
+                                output = think_filter.feed(chunk)
+                                if output:
+                                    yield output
                                             
                         except json.JSONDecodeError:
                             continue
                 
                 # 输出剩余缓冲区（如果不在think块内）
-                if buffer and not in_think_block:
-                    yield buffer
+                remaining = think_filter.flush()
+                if remaining:
+                    yield remaining
             elif response.status_code == 404:
                 logger.error(f"模型 {model} 不存在")
                 yield f"\n错误: 模型 '{model}' 未找到。\n\n"
@@ -209,10 +197,12 @@ class ChatManager:
             logger.error(f"流式聊天失败: {str(e)}")
             yield f"\n错误: {str(e)}"
     
+    def _with_documents(self, messages: List[Dict]) -> List[Dict]:
+        """检索与最后一条用户消息相关的本地文档片段，作为系统消息插入（未启用或没有相关片段时原样返回）"""
+        if self.documents is None:
+            return messages
+        return self.documents.build_context(messages)[0]
+    
     def check_ollama_connection(self) -> bool:
-        """检查Ollama连接"""
-        try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
\ No newline at end of file
+        """检查Ollama连接（至少一个后端可用）"""
+        return self.pool.list_models() is not None and self.pool.available()
\ No newline at end of file
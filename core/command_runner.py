@@ -0,0 +1,346 @@
+import time
+import uuid
+import locale
+import logging
+import platform
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+PLATFORM = platform.system()
+
+# 结束状态
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+TIMEOUT = 'timeout'
+CPU_LIMIT = 'cpu_limit'
+OUTPUT_LIMIT = 'output_limit'
+FAILED = 'failed'
+
+
+def _limit_cpu(command: str, seconds: int) -> str:
+    """在命令前加上 ulimit 设置 CPU 时间上限（仅 POSIX）
+
+    由 shell 自身设置，不使用 preexec_fn（多线程进程中 fork 后执行 Python 代码可能死锁）。
+    软限制触发 SIGXCPU，忽略该信号的进程再过 1 秒由硬限制 SIGKILL 终止
+    """
+    # 原有的限制更低时 ulimit 失败，保留原限制继续执行
+    return f"ulimit -S -t {seconds} 2>/dev/null; ulimit -H -t {seconds + 1} 2>/dev/null; {command}"
+
+
+def _killed_by_cpu_limit(return_code: Optional[int]) -> bool:
+    """RLIMIT_CPU 软限制触发 SIGXCPU；经 shell 执行时返回码为 128 + 信号值
+
+    SIGKILL 不计入：无法与 OOM killer 等外部终止区分
+    """
+    import signal
+    return return_code is not None and signal.SIGXCPU in (-return_code, return_code - 128)
+
+
+class CommandRun:
+    """一次命令执行：逐行记录输出，供 Socket.IO/SSE 推送和 Agent 读取部分输出"""
+
+    def __init__(self, run_id: str, command: str, max_output: int):
+        self.run_id = run_id
+        self.command = command
+        self.max_output = max_output
+        self.status = 'queued'
+        self.return_code: Optional[int] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.output_bytes = 0
+        self.truncated = False
+        self.lines: List[Dict[str, Any]] = []
+        self.cancel_event = threading.Event()
+        self._done = threading.Event()
+        self._condition = threading.Condition()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._read_offset = 0
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        with self._condition:
+            self._listeners.append(callback)
+
+    def _publish(self, event: Dict[str, Any]):
+        event['run_id'] = self.run_id
+        with self._condition:
+            listeners = list(self._listeners)
+            self._condition.notify_all()
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.warning(f"推送命令输出失败: {str(e)}")
+
+    def add_line(self, stream: str, text: str) -> bool:
+        """记录一行输出，超过输出上限时返回 False"""
+        with self._condition:
+            if self.truncated:
+                return False
+            size = len(text.encode('utf-8'))
+            if self.output_bytes + size > self.max_output:
+                self.truncated = True
+                return False
+            self.output_bytes += size
+            line = {'seq': len(self.lines), 'stream': stream, 'line': text}
+            self.lines.append(line)
+        self._publish(dict(line, type='line'))
+        return True
+
+    def finish(self, status: str, return_code: Optional[int] = None, error: Optional[str] = None):
+        self.status = status
+        self.return_code = return_code
+        self.error = error
+        self.finished_at = time.monotonic()
+        event = {'type': 'exit', 'status': status, 'return_code': return_code,
+                 'truncated': self.truncated, 'duration_ms': self.duration_ms}
+        if error:
+            event['error'] = error
+        self._done.set()
+        self._publish(event)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return round((end - self.started_at) * 1000, 1)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def events(self, since: int = 0, keepalive: float = 15.0):
+        """按顺序产出输出行（从 since 开始）及结束事件，用于 SSE"""
+        seq = since
+        while True:
+            timed_out = False
+            with self._condition:
+                pending = self.lines[seq:]
+                finished = self.done
+                if not pending and not finished:
+                    timed_out = not self._condition.wait(keepalive)
+                    pending = self.lines[seq:]
+                    finished = self.done
+            for line in pending:
+                yield dict(line, type='line', run_id=self.run_id)
+            seq += len(pending)
+            if finished and seq >= len(self.lines):
+                yield {'type': 'exit', 'run_id': self.run_id, 'status': self.status,
+                       'return_code': self.return_code, 'truncated': self.truncated,
+                       'duration_ms': self.duration_ms}
+                return
+            if timed_out:
+                yield {'type': 'keepalive', 'run_id': self.run_id}
+
+    def read_new(self) -> Dict[str, Any]:
+        """返回上次读取之后的新输出（Agent 查询用）"""
+        with self._condition:
+            lines = self.lines[self._read_offset:]
+            self._read_offset = len(self.lines)
+        return self.summary(lines)
+
+    def summary(self, lines: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        lines = self.lines if lines is None else lines
+        return {
+            'run_id': self.run_id,
+            'command': self.command,
+            'status': self.status,
+            'return_code': self.return_code,
+            'output': '\n'.join(l['line'] for l in lines if l['stream'] == 'stdout'),
+            'error': '\n'.join([l['line'] for l in lines if l['stream'] == 'stderr'] + ([self.error] if self.error else [])),
+            'truncated': self.truncated,
+            'duration_ms': self.duration_ms
+        }
+
+
+class CommandRunner:
+    """白名单命令执行：有界工作线程池、逐行输出、输出量/CPU 时间/运行时间限制和取消"""
+
+    def __init__(self, config: Dict[str, Any]):
+        system_config = config.get('system', {})
+        self.workers = system_config.get('command_workers', 4)
+        self.max_pending = system_config.get('command_max_pending', 8)
+        self.timeout = system_config.get('command_timeout', 10)
+        self.cpu_seconds = system_config.get('command_cpu_seconds', 5)
+        self.max_output = system_config.get('command_max_output', 1024 * 1024)
+        self.history_size = system_config.get('command_history', 50)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='command')
+        # 排队 + 运行中的命令总数上限，超出时直接拒绝而不是无限排队
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self._runs: "OrderedDict[str, CommandRun]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, command: str, on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> CommandRun:
+        """提交命令，立即返回 CommandRun"""
+        if not self._slots.acquire(blocking=False):
+            raise RuntimeError("正在执行的命令过多，请稍后重试")
+
+        run = CommandRun(uuid.uuid4().hex, command, self.max_output)
+        if on_event is not None:
+            run.subscribe(on_event)
+        with self._lock:
+            self._runs[run.run_id] = run
+            while len(self._runs) > self.history_size:
+                oldest_id, oldest = next(iter(self._runs.items()))
+                if not oldest.done:
+                    break
+                del self._runs[oldest_id]
+
+        try:
+            self._executor.submit(self._execute, run)
+        except Exception:
+            self._slots.release()
+            raise
+        return run
+
+    def load(self) -> Tuple[int, int]:
+        """(排队和运行中的命令数, 上限)"""
+        with self._lock:
+            active = sum(1 for run in self._runs.values() if not run.done)
+        return active, self.workers + self.max_pending
+
+    def get(self, run_id: str) -> Optional[CommandRun]:
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def cancel(self, run_id: str) -> bool:
+        run = self.get(run_id)
+        if run is None or run.done:
+            return False
+        run.cancel_event.set()
+        return True
+
+    def _popen(self, command: str) -> subprocess.Popen:
+        options = {
+            'shell': True,
+            'stdout': subprocess.PIPE,
+            'stderr': subprocess.PIPE,
+            'stdin': subprocess.DEVNULL,
+        }
+        if PLATFORM == 'Windows':
+            options['creationflags'] = subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # 独立进程组，便于连同子进程一起终止
+            options['start_new_session'] = True
+            if self.cpu_seconds:
+                command = _limit_cpu(command, int(self.cpu_seconds))
+        return subprocess.Popen(command, **options)
+
+    def _execute(self, run: CommandRun):
+        process = None
+        try:
+            if run.cancel_event.is_set():
+                run.started_at = time.monotonic()
+                run.finish(CANCELLED)
+                return
+
+            run.status = 'running'
+            run.started_at = time.monotonic()
+            run._publish({'type': 'start', 'command': run.command})
+            process = self._popen(run.command)
+
+            readers = [
+                threading.Thread(target=self._read_stream, args=(process.stdout, 'stdout', run), daemon=True),
+                threading.Thread(target=self._read_stream, args=(process.stderr, 'stderr', run), daemon=True),
+            ]
+            for reader in readers:
+                reader.start()
+
+            status = self._supervise(process, run)
+            if status != COMPLETED:
+                self._kill(process)
+            return_code = process.wait()
+            for reader in readers:
+                reader.join(timeout=1)
+
+            if status == COMPLETED and run.truncated:
+                status = OUTPUT_LIMIT
+            if status == COMPLETED and self.cpu_seconds and PLATFORM != 'Windows' and _killed_by_cpu_limit(return_code):
+                status = CPU_LIMIT
+            run.finish(status, return_code)
+        except Exception as e:
+            logger.error(f"执行命令失败: {str(e)}")
+            if process is not None:
+                self._kill(process)
+            if run.started_at is None:
+                run.started_at = time.monotonic()
+            run.finish(FAILED, error=str(e))
+        finally:
+            self._slots.release()
+
+    def _supervise(self, process: subprocess.Popen, run: CommandRun) -> str:
+        """等待进程结束，期间检查取消、超时、输出上限和 CPU 时间"""
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        try:
+            ps_process = psutil.Process(process.pid)
+        except psutil.Error:
+            ps_process = None
+
+        while process.poll() is None:
+            if run.cancel_event.wait(0.1):
+                return CANCELLED
+            if run.truncated:
+                return OUTPUT_LIMIT
+            if deadline is not None and time.monotonic() > deadline:
+                return TIMEOUT
+            if self.cpu_seconds and ps_process is not None and PLATFORM == 'Windows':
+                # Windows 没有 RLIMIT_CPU，轮询 CPU 时间
+                try:
+                    times = ps_process.cpu_times()
+                    if times.user + times.system > self.cpu_seconds:
+                        return CPU_LIMIT
+                except psutil.Error:
+                    pass
+        return COMPLETED
+
+    @staticmethod
+    def _read_stream(stream, name: str, run: CommandRun):
+        """逐行读取输出；超过上限后继续读取并丢弃，避免子进程因管道写满而阻塞
+
+        每次最多读取剩余额度 + 1 字节，不含换行的超长输出不会整段缓存在内存中
+        """
+        encoding = locale.getpreferredencoding(False)
+        try:
+            while not run.truncated:
+                raw = stream.readline(max(run.max_output - run.output_bytes, 0) + 1)
+                if not raw:
+                    return
+                text = raw.decode(encoding, errors='replace').rstrip('\r\n')
+                run.add_line(name, text)
+            # 已截断：按块读取并直接丢弃，不再解码
+            while stream.read(65536):
+                pass
+        except (ValueError, OSError):
+            pass
+        finally:
+            stream.close()
+
+    @staticmethod
+    def _kill(process: subprocess.Popen):
+        """终止进程及其子进程"""
+        try:
+            parent = psutil.Process(process.pid)
+            for child in parent.children(recursive=True):
+                child.kill()
+            parent.kill()
+        except psutil.Error:
+            pass
+
+    def shutdown(self):
+        with self._lock:
+            runs = list(self._runs.values())
+        for run in runs:
+            run.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
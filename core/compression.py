@@ -0,0 +1,64 @@
+import gzip
+import logging
+from typing import Dict, Any, Optional
+
+from .assets import brotli, negotiate
+
+logger = logging.getLogger(__name__)
+
+# 默认压缩的响应类型（图片等已压缩格式不处理）
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css',
+                          'application/javascript', 'image/svg+xml')
+
+
+class ResponseCompressor:
+    """按 Accept-Encoding 压缩 API 响应（br/gzip），跳过小响应、流式响应和已编码的响应"""
+
+    def __init__(self, config: Dict[str, Any]):
+        compression_config = config.get('compression', {})
+        self.enabled = compression_config.get('enabled', True)
+        self.min_size = compression_config.get('min_size', 1024)
+        self.gzip_level = compression_config.get('gzip_level', 6)
+        # 动态内容使用较低的 brotli 等级，压缩率接近而耗时少得多
+        self.brotli_quality = compression_config.get('brotli_quality', 4)
+        self.mimetypes = tuple(compression_config.get('mimetypes', COMPRESSIBLE_MIMETYPES))
+
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    def _choose(self, response, accept_encoding: str) -> Optional[str]:
+        if not self.enabled or not accept_encoding:
+            return None
+        # 流式响应（SSE、NDJSON）和 send_file 的直通响应不缓冲
+        if response.is_streamed or response.direct_passthrough:
+            return None
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return None
+        if 'Content-Encoding' in response.headers or response.mimetype not in self.mimetypes:
+            return None
+        if (response.content_length or 0) < self.min_size:
+            return None
+        available = ('br', 'gzip') if brotli is not None else ('gzip',)
+        return negotiate(accept_encoding, available)
+
+    def process(self, response, accept_encoding: str):
+        """Flask after_request 钩子：原地压缩响应体"""
+        if response.mimetype in self.mimetypes:
+            response.vary.add('Accept-Encoding')
+        encoding = self._choose(response, accept_encoding)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        compressed = self.compress(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        # 压缩后的表示与原文不同，强 ETag 改为弱 ETag
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,146 @@
+import os
+import copy
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, List, Callable, Optional
+
+from .utils import validate_config
+
+logger = logging.getLogger(__name__)
+
+# 配置文件缺失时的最小配置，其余由 validate_config 填充默认值
+FALLBACK_CONFIG = {
+    'webui': {'host': '127.0.0.1', 'port': 7860, 'debug': False},
+    'ollama': {'base_url': 'http://localhost:11434'}
+}
+
+
+class _ConfigFileHandler:
+    """watchdog 事件处理器（observer 只调用 dispatch，无需继承以便延迟导入 watchdog）"""
+
+    def __init__(self, service: 'ConfigService'):
+        self.service = service
+
+    def dispatch(self, event):
+        # 编辑器保存时常见“写临时文件再重命名”，同时检查 dest_path
+        paths = (event.src_path, getattr(event, 'dest_path', ''))
+        if any(path and os.path.abspath(path) == self.service.path for path in paths):
+            self.service.schedule_reload()
+
+
+class ConfigService:
+    """配置服务：加载并校验 config.json，文件变化时重新加载并通知各模块，
+    同时缓存序列化后的 /config.json 响应内容"""
+
+    def __init__(self, path: str = 'config.json', debounce: float = 0.5):
+        self.path = os.path.abspath(path)
+        self.debounce = debounce
+        self.version = 0
+        self._config: Dict[str, Any] = {}
+        self._payload = b''
+        self._etag = ''
+        self._listeners: List[Callable[[Dict[str, Any], List[str]], None]] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._observer = None
+
+        config = self._read()
+        if config is None:
+            config = validate_config(copy.deepcopy(FALLBACK_CONFIG))
+        self._publish(config)
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return self._config
+
+    @property
+    def payload(self) -> bytes:
+        return self._payload
+
+    @property
+    def etag(self) -> str:
+        return self._etag
+
+    def subscribe(self, callback: Callable[[Dict[str, Any], List[str]], None]):
+        """注册配置变化回调，参数为新配置和发生变化的配置分类"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        """读取并校验配置文件，失败时返回 None"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            if not isinstance(config, dict):
+                raise ValueError('配置文件顶层必须是对象')
+            return validate_config(config)
+        except FileNotFoundError:
+            logger.error(f"配置文件 {os.path.basename(self.path)} 未找到")
+        except Exception as e:
+            logger.error(f"加载配置文件失败: {str(e)}")
+        return None
+
+    def _publish(self, config: Dict[str, Any]):
+        """整体替换配置对象和缓存的响应内容，读取方不会看到半更新的状态"""
+        payload = json.dumps(config, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            self._config = config
+            self._payload = payload
+            self._etag = hashlib.sha256(payload).hexdigest()[:32]
+            self.version += 1
+
+    def reload(self) -> bool:
+        """重新加载配置文件；解析或校验失败时保留当前配置"""
+        config = self._read()
+        if config is None:
+            return False
+        old = self._config
+        changed = [key for key in set(old) | set(config) if old.get(key) != config.get(key)]
+        if not changed:
+            return False
+
+        self._publish(config)
+        logger.info(f"配置已重新加载，变化: {', '.join(sorted(changed))}")
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(config, changed)
+            except Exception as e:
+                logger.error(f"应用新配置失败: {str(e)}")
+        return True
+
+    def schedule_reload(self):
+        """合并短时间内的多次文件事件"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self.reload)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def start(self):
+        """在后台开始监视配置文件所在目录（导入 watchdog 不占用启动时间）"""
+        threading.Thread(target=self._start_watch, name='config-watch', daemon=True).start()
+
+    def _start_watch(self):
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.warning("未安装 watchdog，配置热加载不可用")
+            return
+        try:
+            observer = Observer()
+            observer.schedule(_ConfigFileHandler(self), os.path.dirname(self.path), recursive=False)
+            observer.daemon = True
+            observer.start()
+            self._observer = observer
+            logger.info("配置文件监视已启动")
+        except Exception as e:
+            logger.warning(f"启动配置文件监视失败: {str(e)}")
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
@@ -0,0 +1,686 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from .ollama_client import OllamaPool
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只有单个进程，不需要选出索引进程
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_PROMPT = ("以下是本地文档中与问题相关的片段（来源为文件路径和行号），回答时可参考并注明来源；"
+                   "与问题无关时忽略：\n\n{snippets}")
+
+# 内容分块边界：块长度超过 chunk_chars 的一半后，遇到空行或行内容哈希满足条件的行即结束当前块。
+# 边界只取决于附近几行的内容，文件中间插入或删除内容后其后的块边界会重新对齐，未改动的块哈希不变
+BOUNDARY_MODULUS = 8
+
+# 读取文件时先尝试的编码（中文 Windows 上的日志常为 GBK）
+ENCODINGS = ('utf-8', 'gb18030')
+
+
+def read_text(path: str, max_size: int) -> Optional[str]:
+    """读取文本文件；过大、二进制或无法读取时返回 None"""
+    try:
+        if os.path.getsize(path) > max_size:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b'\0' in data[:8192]:
+        return None
+    for encoding in ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+def chunk_text(text: str, chunk_chars: int, overlap: int) -> List[Tuple[int, int, str]]:
+    """按内容定义的边界把文本切分为块，返回 (起始行, 结束行, 文本)
+
+    每块开头附带上一块末尾不超过 overlap 个字符的整行作为上下文，行号只计本块自身的行
+    """
+    lines: List[Tuple[int, str]] = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.rstrip()
+        # 超长的单行（压缩后的 JSON、日志中的大段数据）按长度切开
+        while len(line) > chunk_chars:
+            lines.append((number, line[:chunk_chars]))
+            line = line[chunk_chars:]
+        lines.append((number, line))
+
+    chunks = []
+    start, size, tail = 0, 0, []
+    for i, (_, line) in enumerate(lines):
+        size += len(line) + 1
+        last = i == len(lines) - 1
+        boundary = last or size + len(lines[i + 1][1]) + 1 > chunk_chars
+        if not boundary and size >= chunk_chars // 2:
+            boundary = not line or zlib.crc32(line.encode('utf-8')) % BOUNDARY_MODULUS == 0
+        if not boundary:
+            continue
+        own = [item for _, item in lines[start:i + 1]]
+        if any(item.strip() for item in own):
+            chunks.append((lines[start][0], lines[i][0], '\n'.join(tail + own).strip('\n')))
+        # 上一块末尾的几行作为下一块的上下文
+        tail, kept = [], 0
+        for item in reversed(own):
+            if kept + len(item) + 1 > overlap:
+                break
+            tail.insert(0, item)
+            kept += len(item) + 1
+        start, size = i + 1, 0
+    return chunks
+
+
+class _Document:
+    """已索引文件在内存中的部分：各块的行号和按行归一化的向量"""
+
+    __slots__ = ('mtime', 'size', 'ords', 'lines', 'vectors')
+
+    def __init__(self, mtime: float, size: int, ords: List[int], lines: List[Tuple[int, int]], vectors: np.ndarray):
+        self.mtime = mtime
+        self.size = size
+        self.ords = ords
+        self.lines = lines
+        self.vectors = vectors
+
+
+class _DocWatchHandler:
+    """watchdog 事件处理器（observer 只调用 dispatch，无需继承以便延迟导入 watchdog）"""
+
+    def __init__(self, index: 'DocumentIndex'):
+        self.index = index
+
+    def dispatch(self, event):
+        if event.is_directory:
+            # 目录被移动或删除时无法逐个得知其中的文件，重新扫描
+            if event.event_type in ('moved', 'deleted'):
+                self.index.rescan()
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if path:
+                self.index.schedule(path)
+
+
+class DocumentIndex:
+    """本地文档索引：把配置目录中的文本文件分块，通过 Ollama 批量嵌入后存入 SQLite
+
+    files 表记录已索引文件的修改时间和大小，chunks 表记录各块的行号、文本和内容哈希，
+    embeddings 表按块哈希保存向量（float32），文件变化时只嵌入哈希尚未出现过的块。
+    检索时把所有向量合并为一个矩阵做余弦相似度计算。
+
+    后台线程启动时扫描目录，之后由 watchdog 监视变化（未安装时定期重新扫描），
+    同一文件的连续变化合并为一次索引。多个工作进程时只有取得文件锁的进程写入索引，
+    其他进程在索引更新后重新加载
+    """
+
+    def __init__(self, config: Dict[str, Any], pool: OllamaPool):
+        self.pool = pool
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending: Dict[str, float] = {}
+        self._rescan = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+        self._lock_file = None
+        self._writer = False
+        self._docs: Dict[str, _Document] = {}
+        self._generation = -1
+        self._checked_at = 0.0
+        self._matrix: Optional[np.ndarray] = None
+        self._refs: List[Tuple[str, int, int, int]] = []
+        self._stats = {'files_indexed': 0, 'chunks_embedded': 0, 'chunks_reused': 0, 'embed_ms': 0.0,
+                       'index_ms': 0.0, 'failures': 0, 'queries': 0, 'query_ms': 0.0, 'search_ms': 0.0}
+        self.last_error = ''
+        self.apply_config(config)
+
+    def apply_config(self, config: Dict[str, Any]):
+        documents_config = config.get('documents', {})
+        previous = getattr(self, '_watch_key', None)
+        self.enabled = documents_config.get('enabled', False)
+        self.dirs = [os.path.abspath(os.path.expanduser(d)) for d in documents_config.get('dirs', [])]
+        self.extensions = {e.lower() for e in documents_config.get('extensions', [])}
+        self.exclude_dirs = set(documents_config.get('exclude_dirs', []))
+        self.model = documents_config.get('embed_model', 'nomic-embed-text')
+        self.db_path = documents_config.get('db_path', os.path.join('cache', 'documents.db'))
+        self.max_file_size = documents_config.get('max_file_size', 2 * 1024 * 1024)
+        self.chunk_chars = documents_config.get('chunk_chars', 1200)
+        self.chunk_overlap = documents_config.get('chunk_overlap', 200)
+        self.batch_size = documents_config.get('batch_size', 64)
+        self.files_per_batch = documents_config.get('files_per_batch', 64)
+        self.debounce = documents_config.get('debounce', 2.0)
+        self.retry_interval = documents_config.get('retry_interval', 30)
+        self.scan_interval = documents_config.get('scan_interval', 300)
+        self.embed_timeout = documents_config.get('embed_timeout', 10)
+        self.top_k = documents_config.get('top_k', 5)
+        self.min_score = documents_config.get('min_score', 0.3)
+        self.auto_context = documents_config.get('auto_context', True)
+        self.context_top_k = documents_config.get('context_top_k', 3)
+        self.context_min_score = documents_config.get('context_min_score', 0.45)
+        self.max_context_chars = documents_config.get('max_context_chars', 3000)
+
+        self._watch_key = (tuple(self.dirs), tuple(sorted(self.extensions)), tuple(sorted(self.exclude_dirs)),
+                           self.model, self.chunk_chars, self.chunk_overlap)
+        if previous is not None and previous != self._watch_key and self._writer:
+            # 目录、分块参数或嵌入模型变化：重新监视并扫描（分块参数和模型的变化在扫描时检查，需要时重建索引）
+            self._stop_watch()
+            self._start_watch()
+            self.rescan()
+        if self.enabled and previous is not None:
+            self.start()
+
+    # ---- 存储 ----
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, indexed_at REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS chunks (
+                    path TEXT NOT NULL, ord INTEGER NOT NULL, hash TEXT NOT NULL,
+                    start_line INTEGER NOT NULL, end_line INTEGER NOT NULL, text TEXT NOT NULL,
+                    PRIMARY KEY (path, ord));
+                CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vector BLOB NOT NULL);
+            ''')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, conn: sqlite3.Connection, key: str, default: str = '') -> str:
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn: sqlite3.Connection, key: str, value):
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _bump(self, conn: sqlite3.Connection):
+        """索引有变化，递增版本号，其他进程据此重新加载"""
+        self._set_meta(conn, 'generation', int(self._meta(conn, 'generation', '0')) + 1)
+
+    def _reload(self, force: bool = False):
+        """索引版本号变化（首次使用或其他进程写入）时从数据库重新加载所有向量"""
+        now = time.time()
+        if not force and now - self._checked_at < 2:
+            return
+        self._checked_at = now
+        conn = self._conn()
+        generation = int(self._meta(conn, 'generation', '0'))
+        if not force and generation == self._generation:
+            return
+        start = time.perf_counter()
+        docs: Dict[str, _Document] = {}
+        files = {path: (mtime, size) for path, mtime, size in conn.execute('SELECT path, mtime, size FROM files')}
+        rows: Dict[str, List[Tuple[int, int, int, bytes]]] = {path: [] for path in files}
+        for path, ord_, start_line, end_line, vector in conn.execute(
+                'SELECT c.path, c.ord, c.start_line, c.end_line, e.vector FROM chunks c '
+                'JOIN embeddings e ON e.hash = c.hash ORDER BY c.path, c.ord'):
+            if path in rows:
+                rows[path].append((ord_, start_line, end_line, vector))
+        for path, (mtime, size) in files.items():
+            chunks = rows[path]
+            vectors = (np.frombuffer(b''.join(row[3] for row in chunks), dtype=np.float32).reshape(len(chunks), -1)
+                       if chunks else np.zeros((0, 0), dtype=np.float32))
+            docs[path] = _Document(mtime, size, [row[0] for row in chunks],
+                                   [(row[1], row[2]) for row in chunks], vectors)
+        with self._lock:
+            self._docs = docs
+            self._generation = generation
+            self._matrix = None
+        logger.info(f"文档索引已加载: {len(docs)} 个文件，耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # ---- 后台索引 ----
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='document-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._stop_watch()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _acquire_writer(self) -> bool:
+        """多个工作进程时只有一个进程扫描和写入索引"""
+        if fcntl is None:
+            return True
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(self.db_path + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        try:
+            self._reload(force=True)
+        except sqlite3.Error as e:
+            logger.error(f"打开文档索引失败: {str(e)}")
+            self.last_error = str(e)
+            return
+        if not self._acquire_writer():
+            logger.info("文档索引由其他工作进程维护")
+            return
+        self._writer = True
+        self._rescan = True
+        self._start_watch()
+        scanned_at = time.time()
+        requested = None
+        while not self._stop_event.is_set():
+            try:
+                # 其他工作进程收到的重新扫描请求通过 meta 表转发
+                value = self._meta(self._conn(), 'rescan_requested')
+                if requested is not None and value != requested:
+                    self._rescan = True
+                requested = value
+            except sqlite3.Error as e:
+                logger.error(f"读取文档索引状态失败: {str(e)}")
+            if self._rescan or (self._observer is None and time.time() - scanned_at >= self.scan_interval):
+                self._rescan = False
+                scanned_at = time.time()
+                try:
+                    self._scan()
+                except Exception as e:
+                    logger.error(f"扫描文档目录失败: {str(e)}")
+            paths = self._take_due()
+            if not paths:
+                continue
+            try:
+                self._index_batch(paths)
+            except Exception as e:
+                self.last_error = str(e)
+                with self._lock:
+                    self._stats['failures'] += 1
+                logger.error(f"文档索引失败，{self.retry_interval} 秒后重试 {len(paths)} 个文件: {str(e)}")
+                for path in paths:
+                    self.schedule(path, self.retry_interval)
+
+    def _start_watch(self):
+        if not self.dirs:
+            return
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.warning(f"未安装 watchdog，文档目录每 {self.scan_interval} 秒重新扫描一次")
+            return
+        try:
+            observer = Observer()
+            handler = _DocWatchHandler(self)
+            for directory in self.dirs:
+                if os.path.isdir(directory):
+                    observer.schedule(handler, directory, recursive=True)
+            observer.daemon = True
+            observer.start()
+            self._observer = observer
+            logger.info("文档目录监视已启动")
+        except Exception as e:
+            logger.warning(f"启动文档目录监视失败: {str(e)}")
+
+    def _stop_watch(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def rescan(self) -> bool:
+        """重新扫描所有目录（在后台线程中进行）
+
+        本进程不负责写入索引时把请求记录到 meta 表，由写入索引的进程执行；返回是否已转发
+        """
+        if self._thread is not None and not self._writer:
+            conn = self._conn()
+            with conn:
+                self._set_meta(conn, 'rescan_requested', time.time())
+            return True
+        with self._cond:
+            self._rescan = True
+            self._cond.notify_all()
+        return False
+
+    def schedule(self, path: str, delay: Optional[float] = None):
+        """文件有变化，等待 debounce 秒无新变化后重新索引"""
+        path = os.path.abspath(path)
+        if not self._accept_path(path):
+            return
+        with self._cond:
+            self._pending[path] = time.time() + (self.debounce if delay is None else delay)
+            self._cond.notify_all()
+
+    def _take_due(self, wait: bool = True) -> List[str]:
+        with self._cond:
+            now = time.time()
+            due = [path for path, at in self._pending.items() if at <= now][:self.files_per_batch]
+            for path in due:
+                del self._pending[path]
+            if not due and wait and not self._rescan:
+                wait = min(self._pending.values(), default=now + 5) - now
+                self._cond.wait(max(0.05, min(wait, 5)))
+            return due
+
+    def _accept_path(self, path: str) -> bool:
+        if os.path.splitext(path)[1].lower() not in self.extensions:
+            return False
+        if not any(path == d or path.startswith(d.rstrip(os.sep) + os.sep) for d in self.dirs):
+            return False
+        parts = path.split(os.sep)
+        return not any(part in self.exclude_dirs for part in parts)
+
+    def _scan(self):
+        """对比目录中的文件和已索引文件，排队新增和修改的文件，删除已不存在的文件"""
+        start = time.perf_counter()
+        self._check_params(self._conn())
+        seen = set()
+        changed = []
+        with self._lock:
+            known = {path: (doc.mtime, doc.size) for path, doc in self._docs.items()}
+        for directory in self.dirs:
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [d for d in dirs if d not in self.exclude_dirs]
+                for name in files:
+                    path = os.path.join(root, name)
+                    if os.path.splitext(name)[1].lower() not in self.extensions:
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    seen.add(path)
+                    if known.get(path) != (st.st_mtime, st.st_size):
+                        changed.append(path)
+        removed = [path for path in known if path not in seen]
+        if removed:
+            self._remove(removed)
+        with self._cond:
+            for path in changed:
+                self._pending.setdefault(path, 0)
+        logger.info(f"文档目录扫描完成: {len(seen)} 个文件，{len(changed)} 个待索引，{len(removed)} 个已删除，"
+                    f"耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def sync(self):
+        """在当前线程中扫描并索引全部变化，返回后索引与目录一致（用于重建索引和基准测试）"""
+        self._reload()
+        self._scan()
+        while True:
+            paths = self._take_due(wait=False)
+            if not paths:
+                break
+            self._index_batch(paths)
+
+    def _remove(self, paths: List[str]):
+        conn = self._conn()
+        with conn:
+            for path in paths:
+                conn.execute('DELETE FROM chunks WHERE path = ?', (path,))
+                conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            self._bump(conn)
+        with self._lock:
+            for path in paths:
+                self._docs.pop(path, None)
+            self._matrix = None
+            self._generation += 1
+
+    def _check_params(self, conn: sqlite3.Connection):
+        """嵌入模型或分块参数与建立索引时不同：清空已索引的文件，扫描时全部重新索引
+
+        模型变化后已有向量不可用，一并删除；只有分块参数变化时保留向量，内容相同的块仍可复用
+        """
+        model = self._meta(conn, 'model')
+        chunking = f"{self.chunk_chars}/{self.chunk_overlap}"
+        stored = self._meta(conn, 'chunking')
+        if model == self.model and stored == chunking:
+            return
+        if model and model != self.model:
+            logger.warning(f"嵌入模型变化（{model} -> {self.model}），重建文档索引")
+        elif stored and stored != chunking:
+            logger.warning(f"分块参数变化（{stored} -> {chunking}），重新索引全部文档")
+        with conn:
+            if model != self.model:
+                conn.execute('DELETE FROM embeddings')
+            conn.execute('DELETE FROM chunks')
+            conn.execute('DELETE FROM files')
+            self._set_meta(conn, 'model', self.model)
+            self._set_meta(conn, 'chunking', chunking)
+            self._bump(conn)
+        with self._lock:
+            self._docs = {}
+            self._matrix = None
+            self._generation += 1
+
+    def _index_batch(self, paths: List[str]):
+        """重新索引一批文件：所有文件中尚无向量的块合并后分批嵌入"""
+        start = time.perf_counter()
+        conn = self._conn()
+        with self._lock:
+            known = {path: (doc.mtime, doc.size) for path, doc in self._docs.items()}
+
+        documents = []
+        removed = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                if path in known:
+                    removed.append(path)
+                continue
+            if known.get(path) == (st.st_mtime, st.st_size):
+                continue
+            # 过大或二进制的文件也记录下来（没有块），扫描时不再重复读取
+            text = read_text(path, self.max_file_size) or ''
+            header = os.path.basename(path)
+            chunks = []
+            for start_line, end_line, body in chunk_text(text, self.chunk_chars, self.chunk_overlap):
+                # 嵌入文本带上文件名，便于按文件名提问时命中
+                content = f"{header}\n{body}"
+                chunks.append((hashlib.sha1(content.encode('utf-8')).hexdigest(), start_line, end_line, body, content))
+            documents.append((path, st, chunks))
+        if removed:
+            self._remove(removed)
+        if not documents:
+            return
+
+        hashes = list({chunk[0] for _, _, chunks in documents for chunk in chunks})
+        vectors: Dict[str, bytes] = {}
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            vectors.update(conn.execute(f"SELECT hash, vector FROM embeddings WHERE hash IN ({','.join('?' * len(part))})",
+                                        part))
+        texts = {chunk[0]: chunk[4] for _, _, chunks in documents for chunk in chunks}
+        missing = [h for h in hashes if h not in vectors]
+        reused = sum(len(chunks) for _, _, chunks in documents) - len(missing)
+
+        embed_start = time.perf_counter()
+        try:
+            for i in range(0, len(missing), self.batch_size):
+                part = missing[i:i + self.batch_size]
+                matrix = np.asarray(self.pool.embed(self.model, [texts[h] for h in part],
+                                                    max(self.embed_timeout, 60)), dtype=np.float32)
+                if matrix.ndim != 2 or len(matrix) != len(part):
+                    raise ValueError(f"嵌入数量不符（请求 {len(part)} 条，返回 {len(matrix)} 条）")
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                rows = [(h, matrix[j].tobytes()) for j, h in enumerate(part)]
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO embeddings (hash, vector) VALUES (?, ?)', rows)
+                vectors.update(rows)
+        except (requests.RequestException, KeyError, ValueError) as e:
+            # Ollama 不可用或未安装嵌入模型：稍后重试，已嵌入的块不会重复计算
+            self.last_error = str(e)
+            with self._lock:
+                self._stats['failures'] += 1
+            logger.error(f"文档嵌入失败，{self.retry_interval} 秒后重试 {len(documents)} 个文件: {str(e)}")
+            for path, _, _ in documents:
+                self.schedule(path, self.retry_interval)
+            return
+        embed_ms = (time.perf_counter() - embed_start) * 1000
+
+        now = time.time()
+        updated: Dict[str, _Document] = {}
+        with conn:
+            for path, st, chunks in documents:
+                conn.execute('DELETE FROM chunks WHERE path = ?', (path,))
+                conn.executemany('INSERT INTO chunks (path, ord, hash, start_line, end_line, text) VALUES (?, ?, ?, ?, ?, ?)',
+                                 [(path, i, h, s, e, body) for i, (h, s, e, body, _) in enumerate(chunks)])
+                conn.execute('INSERT OR REPLACE INTO files (path, mtime, size, indexed_at) VALUES (?, ?, ?, ?)',
+                             (path, st.st_mtime, st.st_size, now))
+                matrix = (np.frombuffer(b''.join(vectors[chunk[0]] for chunk in chunks), dtype=np.float32)
+                          .reshape(len(chunks), -1) if chunks else np.zeros((0, 0), dtype=np.float32))
+                updated[path] = _Document(st.st_mtime, st.st_size, list(range(len(chunks))),
+                                          [(chunk[1], chunk[2]) for chunk in chunks], matrix)
+            self._bump(conn)
+        with self._lock:
+            self._docs.update(updated)
+            self._matrix = None
+            self._generation += 1
+            stats = self._stats
+            stats['files_indexed'] += len(documents)
+            stats['chunks_embedded'] += len(missing)
+            stats['chunks_reused'] += reused
+            stats['embed_ms'] += embed_ms
+            stats['index_ms'] += (time.perf_counter() - start) * 1000
+        self.last_error = ''
+        logger.info(f"文档索引: {len(documents)} 个文件，嵌入 {len(missing)} 个块，复用 {reused} 个块，"
+                    f"耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # ---- 检索 ----
+
+    def _search_matrix(self) -> Tuple[Optional[np.ndarray], List[Tuple[str, int, int, int]]]:
+        """所有块的向量合并后的矩阵（索引变化后首次检索时重建）"""
+        with self._lock:
+            if self._matrix is None:
+                parts, refs = [], []
+                for path, doc in self._docs.items():
+                    if not len(doc.ords):
+                        continue
+                    parts.append(doc.vectors)
+                    refs.extend((path, ord_, start, end) for ord_, (start, end) in zip(doc.ords, doc.lines))
+                dims = {part.shape[1] for part in parts}
+                self._matrix = np.concatenate(parts) if len(dims) == 1 else np.zeros((0, 0), dtype=np.float32)
+                self._refs = refs if len(dims) == 1 else []
+            return self._matrix, self._refs
+
+    def search(self, query: str, top_k: Optional[int] = None, min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+        """返回与查询最相关的文档片段（路径、行号、相似度、原文），按相似度降序"""
+        top_k = top_k or self.top_k
+        min_score = self.min_score if min_score is None else min_score
+        self._reload()
+        start = time.perf_counter()
+        vector = np.asarray(self.pool.embed(self.model, [query], self.embed_timeout)[0], dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        query_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        matrix, refs = self._search_matrix()
+        hits = []
+        if len(refs) and matrix.shape[1] == vector.shape[0]:
+            scores = matrix @ vector
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            hits = [(float(scores[i]), refs[i]) for i in top[np.argsort(-scores[top])] if scores[i] >= min_score]
+        search_ms = (time.perf_counter() - start) * 1000
+
+        results = []
+        conn = self._conn()
+        for score, (path, ord_, start_line, end_line) in hits:
+            row = conn.execute('SELECT text FROM chunks WHERE path = ? AND ord = ?', (path, ord_)).fetchone()
+            if row is None:
+                continue
+            results.append({'path': path, 'start_line': start_line, 'end_line': end_line,
+                            'score': round(score, 3), 'text': row[0]})
+        with self._lock:
+            self._stats['queries'] += 1
+            self._stats['query_ms'] += query_ms
+            self._stats['search_ms'] += search_ms
+        return results
+
+    def build_context(self, messages: List[Dict]) -> Tuple[List[Dict], Dict[str, Any]]:
+        """自动检索最后一条用户消息相关的文档片段，作为系统消息插入到该消息之前"""
+        if not (self.enabled and self.auto_context):
+            return messages, {'used': False}
+        self._reload()
+        if not self._docs:
+            return messages, {'used': False}
+        position = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].get('role') == 'user'), None)
+        query = messages[position].get('content') if position is not None else None
+        if not isinstance(query, str) or not query.strip():
+            return messages, {'used': False}
+        try:
+            hits = self.search(query, self.context_top_k, self.context_min_score)
+        except (requests.RequestException, KeyError, ValueError, sqlite3.Error) as e:
+            logger.warning(f"文档检索失败，不附加文档上下文: {str(e)}")
+            return messages, {'used': False, 'error': str(e)}
+        if not hits:
+            return messages, {'used': False}
+
+        snippets, used = [], 0
+        for hit in hits:
+            snippet = f"[{hit['path']}:{hit['start_line']}-{hit['end_line']}]\n{hit['text']}"
+            if snippets and used + len(snippet) > self.max_context_chars:
+                break
+            snippets.append(snippet[:self.max_context_chars])
+            used += len(snippet)
+        context = {'role': 'system', 'content': DOCUMENT_PROMPT.format(snippets='\n\n'.join(snippets))}
+        info = {'used': True, 'sources': [f"{hit['path']}:{hit['start_line']}" for hit in hits[:len(snippets)]],
+                'scores': [hit['score'] for hit in hits[:len(snippets)]]}
+        logger.info(f"文档上下文: 附加 {len(snippets)} 个片段")
+        return messages[:position] + [context] + messages[position:], info
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            files = len(self._docs)
+            chunks = sum(len(doc.ords) for doc in self._docs.values())
+        with self._cond:
+            pending = len(self._pending)
+        queries, indexed_ms = stats['queries'], stats['index_ms']
+        return {
+            'enabled': self.enabled,
+            'model': self.model,
+            'dirs': self.dirs,
+            'writer': self._writer,
+            'watching': self._observer is not None,
+            'files': files,
+            'chunks': chunks,
+            'pending': pending,
+            'files_indexed': stats['files_indexed'],
+            'chunks_embedded': stats['chunks_embedded'],
+            'chunks_reused': stats['chunks_reused'],
+            'embed_failures': stats['failures'],
+            'files_per_second': round(stats['files_indexed'] / indexed_ms * 1000, 1) if indexed_ms else None,
+            'chunks_per_second': round(stats['chunks_embedded'] / stats['embed_ms'] * 1000, 1) if stats['embed_ms'] else None,
+            'queries': queries,
+            'avg_query_embed_ms': round(stats['query_ms'] / queries, 1) if queries else None,
+            'avg_search_ms': round(stats['search_ms'] / queries, 3) if queries else None,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,227 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Callable, Tuple
+
+import requests
+
+from .ollama_client import OllamaPool
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """后台健康探测：定期检查 Ollama 各后端的可达性和延迟、最小生成往返、日志磁盘空间和负载，
+    /health 和 /ready 直接读取最近一次结果，不再随请求访问 Ollama
+
+    每项检查在独立线程中按各自的间隔运行，较慢的生成探测不会推迟其他检查
+    """
+
+    def __init__(self, config: Dict[str, Any], pool: OllamaPool):
+        self.pool = pool
+        self._gauges: Dict[str, Callable[[], Tuple[float, float]]] = {}
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.started_at = time.time()
+        self.apply_config(config)
+
+    def apply_config(self, config: Dict[str, Any]):
+        health_config = config.get('health', {})
+        self.model = health_config.get('generate_model') or config['ollama']['default_model']
+        self.log_dir = config.get('logging', {}).get('dir', 'logs')
+        self.interval = health_config.get('interval', 15)
+        self.timeout = health_config.get('timeout', 3)
+        self.generate_interval = health_config.get('generate_interval', 300)
+        self.generate_timeout = health_config.get('generate_timeout', 60)
+        self.disk_min_free = health_config.get('disk_min_free_mb', 500) * 1024 * 1024
+        self.saturation_threshold = health_config.get('saturation_threshold', 0.9)
+        self.min_refresh = health_config.get('min_refresh_interval', 2)
+        # 超过该时间没有新结果（探测线程卡住）视为未就绪
+        self.stale_after = max(health_config.get('stale_after', 60), self.interval * 3)
+
+    def add_gauge(self, name: str, fn: Callable[[], Tuple[float, float]]):
+        """注册负载指标，fn 返回 (当前值, 上限)，达到上限的 saturation_threshold 即视为饱和"""
+        self._gauges[name] = fn
+
+    def _checks(self) -> Dict[str, Tuple[Callable[[], Dict[str, Any]], Callable[[], float]]]:
+        """检查名 -> (检查函数, 取当前间隔的函数)；间隔为 0 表示禁用"""
+        return {
+            'ollama': (self.check_ollama, lambda: self.interval),
+            'generate': (self.check_generate, self._generate_interval),
+            'disk': (self.check_disk, lambda: self.interval),
+            'saturation': (self.check_saturation, lambda: self.interval),
+        }
+
+    def _generate_interval(self) -> float:
+        """生成探测失败后按常规间隔重试，Ollama 恢复后不必等待完整的探测周期"""
+        last = self._results.get('generate')
+        if self.generate_interval > 0 and last is not None and not last['ok']:
+            return min(self.interval, self.generate_interval)
+        return self.generate_interval
+
+    def start(self):
+        if self._threads:
+            return
+        for name, (check, interval) in self._checks().items():
+            thread = threading.Thread(target=self._run, args=(name, check, interval),
+                                      name=f'health-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"健康检查已启动，间隔 {self.interval} 秒")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self, name: str, check: Callable[[], Dict[str, Any]], interval: Callable[[], float]):
+        while not self._stop_event.is_set():
+            if interval() > 0:
+                self._record(name, check)
+            else:
+                with self._lock:
+                    self._results.pop(name, None)
+            # 按本次结果决定下次检查的时间（禁用时定期确认配置是否重新启用）
+            seconds = interval()
+            self._stop_event.wait(seconds if seconds > 0 else self.interval)
+
+    def _record(self, name: str, check: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            result = check()
+        except Exception as e:
+            result = {'ok': False, 'error': str(e)}
+        result['duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        result['checked_at'] = time.time()
+        previous = self._results.get(name)
+        if previous is not None and previous['ok'] != result['ok']:
+            level = logging.INFO if result['ok'] else logging.WARNING
+            logger.log(level, f"健康检查 {name}: {'恢复正常' if result['ok'] else result.get('error', '异常')}")
+        with self._lock:
+            self._results[name] = result
+        return result
+
+    def check_ollama(self) -> Dict[str, Any]:
+        """Ollama 可达性和 /api/tags 延迟（读取后端池定期刷新的状态，不额外访问 Ollama）"""
+        backends = self.pool.stats()
+        # 最后一个后端不会熔断，以最近一次 /api/tags 是否成功（tags_latency_ms）判断可达性
+        def reachable(b):
+            return b['state'] != 'open' and b['models'] is not None and b['tags_latency_ms'] is not None
+
+        up = [b for b in backends if reachable(b)]
+        if not up:
+            # 没有可用后端时主动重新探测，Ollama 恢复后不必等待后端池的刷新周期
+            backends = self.pool.refresh()
+            up = [b for b in backends if reachable(b)]
+        result = {'ok': bool(up), 'backends': backends,
+                  'available': len(up), 'total': len(backends)}
+        if up:
+            latencies = [b['tags_latency_ms'] for b in up if b['tags_latency_ms'] is not None]
+            result['latency_ms'] = min(latencies) if latencies else None
+            result['models'] = len(set().union(*(b['models'] for b in up)))
+            result['model_available'] = any(self.model in b['models'] for b in up)
+        else:
+            errors = {b['last_error'] for b in backends if b['last_error']}
+            result['error'] = f"无法连接 Ollama: {', '.join(sorted(errors)) or '无可用后端'}"
+        return result
+
+    def check_generate(self) -> Dict[str, Any]:
+        """最小生成往返（只生成 1 个 token），反映模型加载和推理是否正常"""
+        ollama = self._results.get('ollama')
+        if ollama is not None and not ollama['ok']:
+            return {'ok': False, 'skipped': True, 'error': 'Ollama 不可用'}
+        start = time.perf_counter()
+        try:
+            response = self.pool.post('/api/generate', model=self.model,
+                                      json={'model': self.model, 'prompt': 'ping', 'stream': False,
+                                            'options': {'num_predict': 1}},
+                                      timeout=self.generate_timeout)
+        except requests.RequestException as e:
+            return {'ok': False, 'model': self.model, 'error': f'生成请求失败: {e.__class__.__name__}'}
+        latency = round((time.perf_counter() - start) * 1000, 1)
+        if response.status_code != 200:
+            return {'ok': False, 'model': self.model, 'latency_ms': latency, 'error': f'HTTP {response.status_code}'}
+        data = response.json()
+        result = {'ok': True, 'model': self.model, 'latency_ms': latency}
+        # Ollama 返回的耗时单位为纳秒
+        if 'load_duration' in data:
+            result['load_ms'] = round(data['load_duration'] / 1e6, 1)
+        return result
+
+    def check_disk(self) -> Dict[str, Any]:
+        """日志目录所在磁盘的剩余空间"""
+        usage = shutil.disk_usage(self.log_dir if os.path.isdir(self.log_dir) else '.')
+        result = {'ok': usage.free >= self.disk_min_free, 'free_mb': usage.free // (1024 * 1024),
+                  'percent': round(usage.used / usage.total * 100, 1) if usage.total else 0}
+        if not result['ok']:
+            result['error'] = f"磁盘剩余空间不足 {self.disk_min_free // (1024 * 1024)}MB"
+        return result
+
+    def check_saturation(self) -> Dict[str, Any]:
+        """工作线程、命令队列、日志队列等的占用比例"""
+        gauges, saturated = {}, []
+        for name, fn in self._gauges.items():
+            value, limit = fn()
+            ratio = value / limit if limit else 0
+            gauges[name] = {'value': value, 'limit': limit, 'ratio': round(ratio, 2)}
+            if limit and ratio >= self.saturation_threshold:
+                saturated.append(name)
+        result = {'ok': not saturated, 'gauges': gauges}
+        if saturated:
+            result['error'] = f"负载饱和: {', '.join(saturated)}"
+        return result
+
+    def refresh(self) -> Dict[str, Any]:
+        """立即重新检查 Ollama（如设置页的连接测试），间隔过短时直接返回缓存结果"""
+        with self._refresh_lock:
+            cached = self._results.get('ollama')
+            if cached is None or time.time() - cached['checked_at'] >= self.min_refresh:
+                self.pool.refresh()
+                self._record('ollama', self.check_ollama)
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        """最近一次检查结果及其时长（秒）"""
+        now = time.time()
+        with self._lock:
+            checks = {name: dict(result, age_seconds=round(now - result['checked_at'], 1))
+                      for name, result in self._results.items()}
+        ollama = checks.get('ollama')
+        if ollama is None:
+            status = 'starting'
+        elif not ollama['ok']:
+            status = 'unhealthy'
+        elif all(check['ok'] for check in checks.values()):
+            status = 'healthy'
+        else:
+            status = 'degraded'
+        return {
+            'status': status,
+            'timestamp': datetime.now().isoformat(),
+            'uptime_seconds': round(now - self.started_at, 1),
+            'ollama_connected': bool(ollama and ollama['ok']),
+            'age_seconds': max((c['age_seconds'] for c in checks.values()), default=None),
+            'checks': checks
+        }
+
+    def readiness(self) -> Tuple[bool, List[str]]:
+        """负载均衡就绪判断：Ollama 可达、结果未过期且未饱和"""
+        now = time.time()
+        with self._lock:
+            ollama = self._results.get('ollama')
+            saturation = self._results.get('saturation')
+        reasons = []
+        if ollama is None:
+            reasons.append('健康检查尚未完成')
+        else:
+            if not ollama['ok']:
+                reasons.append(ollama.get('error', 'Ollama 不可用'))
+            if now - ollama['checked_at'] > self.stale_after:
+                reasons.append('健康检查结果已过期')
+        if saturation is not None and not saturation['ok']:
+            reasons.append(saturation['error'])
+        return not reasons, reasons
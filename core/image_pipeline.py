@@ -0,0 +1,482 @@
+import math
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, Any, List, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖，缺失时不计算感知哈希
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# 缩放倍数超过该值时改用更快的重采样滤镜（大倍数缩小时 LANCZOS 的画质优势不明显）
+FAST_RESAMPLE_RATIO = 3.0
+
+# 默认解压炸弹限制：5000 万像素
+DEFAULT_MAX_PIXELS = 50_000_000
+
+
+class ImageTooLargeError(ValueError):
+    """图片像素数超过解压炸弹限制"""
+
+
+def _flatten_to_rgb(image: Image.Image) -> Image.Image:
+    """转换为 JPEG 可编码的模式，透明区域填充白色背景"""
+    if image.mode in ('RGB', 'L'):
+        return image
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+_DCT_MATRIX = None
+
+
+def _dct_matrix(size: int):
+    """DCT-II 变换矩阵"""
+    global _DCT_MATRIX
+    if _DCT_MATRIX is None or _DCT_MATRIX.shape[0] != size:
+        n = np.arange(size)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+        matrix[0] *= np.sqrt(1 / size)
+        matrix[1:] *= np.sqrt(2 / size)
+        _DCT_MATRIX = matrix
+    return _DCT_MATRIX
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8, highfreq_factor: int = 4) -> Optional[int]:
+    """计算 64 位 DCT 感知哈希，NumPy 不可用时返回 None"""
+    if np is None:
+        return None
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(
+        image.convert('L').resize((size, size), Image.Resampling.BILINEAR),
+        dtype=np.float64
+    )
+    matrix = _dct_matrix(size)
+    dct = matrix @ pixels @ matrix.T
+    low = dct[:hash_size, :hash_size]
+    # 排除直流分量后取中位数作为阈值
+    bits = (low > np.median(low.flatten()[1:])).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个哈希值之间不同的位数"""
+    return bin(a ^ b).count('1')
+
+
+def preprocess_image(data: bytes,
+                     max_size: Tuple[int, int] = (1024, 1024),
+                     quality: int = 85,
+                     max_pixels: int = DEFAULT_MAX_PIXELS,
+                     compute_phash: bool = False) -> Dict[str, Any]:
+    """解码、缩放并编码为 JPEG（可在子进程中运行）"""
+    start_time = time.perf_counter()
+    image = Image.open(BytesIO(data))
+    original_width, original_height = image.size
+    source_format = image.format
+
+    # 打开图片只读取文件头，在完整解码前检查像素数
+    if original_width * original_height > max_pixels:
+        raise ImageTooLargeError(
+            f"图片像素数 {original_width}x{original_height} 超过限制 {max_pixels}"
+        )
+
+    fits = original_width <= max_size[0] and original_height <= max_size[1]
+
+    # 尺寸已满足要求的 JPEG 直接复用原始字节，避免重复编码
+    if fits and source_format == 'JPEG' and image.mode in ('RGB', 'L'):
+        return {
+            'data': data,
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'phash': perceptual_hash(image) if compute_phash else None,
+            'width': original_width,
+            'height': original_height,
+            'original_width': original_width,
+            'original_height': original_height,
+            'format': source_format,
+            'mode': image.mode,
+            'reencoded': False,
+            'elapsed_ms': (time.perf_counter() - start_time) * 1000
+        }
+
+    # JPEG 在 DCT 阶段按比例缩小解码，结果尺寸不小于目标尺寸
+    if source_format == 'JPEG' and not fits:
+        image.draft('RGB', max_size)
+
+    return prepare_image(image, max_size, quality, compute_phash,
+                         source_format=source_format,
+                         original_size=(original_width, original_height),
+                         start_time=start_time)
+
+
+def prepare_image(image: Image.Image,
+                  max_size: Tuple[int, int] = (1024, 1024),
+                  quality: int = 85,
+                  compute_phash: bool = False,
+                  source_format: Optional[str] = None,
+                  original_size: Optional[Tuple[int, int]] = None,
+                  start_time: Optional[float] = None) -> Dict[str, Any]:
+    """缩放并编码已解码的图片，可直接处理内存中的截图"""
+    if start_time is None:
+        start_time = time.perf_counter()
+    original_width, original_height = original_size or image.size
+
+    if image.width > max_size[0] or image.height > max_size[1]:
+        ratio = max(image.width / max_size[0], image.height / max_size[1])
+        if ratio >= FAST_RESAMPLE_RATIO:
+            resample = Image.Resampling.BILINEAR
+        else:
+            resample = Image.Resampling.LANCZOS
+        # 内存中的图片可能被调用方复用，缩放副本而不是原图
+        image = image.copy() if original_size is None else image
+        image.thumbnail(max_size, resample)
+
+    image = _flatten_to_rgb(image)
+
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    encoded = buffered.getvalue()
+
+    return {
+        'data': encoded,
+        'sha256': hashlib.sha256(encoded).hexdigest(),
+        'phash': perceptual_hash(image) if compute_phash else None,
+        'width': image.width,
+        'height': image.height,
+        'original_width': original_width,
+        'original_height': original_height,
+        'format': source_format,
+        'mode': image.mode,
+        'reencoded': True,
+        'elapsed_ms': (time.perf_counter() - start_time) * 1000
+    }
+
+
+def read_image_size(data: bytes) -> Tuple[int, int]:
+    """只解析文件头获取图片尺寸"""
+    with Image.open(BytesIO(data)) as image:
+        return image.size
+
+
+def plan_tile_grid(width: int, height: int, tile_size: int, max_tiles: int) -> Tuple[float, int, int]:
+    """计算切片网格，图片过大时整体缩小使切片数不超过上限
+
+    返回 (缩放比例, 行数, 列数)
+    """
+    scale = 1.0
+    while True:
+        cols = math.ceil(width * scale / tile_size)
+        rows = math.ceil(height * scale / tile_size)
+        if rows * cols <= max_tiles or scale < 0.05:
+            return scale, rows, cols
+        scale *= 0.9
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffered = BytesIO()
+    _flatten_to_rgb(image).save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+SCREENSHOT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+}
+
+
+def encode_screenshot(image: Image.Image,
+                      fmt: str = 'jpeg',
+                      quality: int = 85,
+                      max_dimension: int = 0,
+                      grayscale: bool = False) -> Dict[str, Any]:
+    """按配置编码截图：可选缩放（max_dimension 为 0 表示保持原尺寸）和灰度"""
+    start_time = time.perf_counter()
+    fmt = (fmt or 'jpeg').lower()
+    if fmt not in SCREENSHOT_FORMATS:
+        raise ValueError(f"不支持的截图格式: {fmt}")
+    pil_format, mimetype = SCREENSHOT_FORMATS[fmt]
+    original = image
+    original_width, original_height = image.size
+
+    # 先转灰度，后续缩放和编码只需处理单通道
+    if grayscale:
+        image = image.convert('L')
+    elif pil_format != 'PNG':
+        image = _flatten_to_rgb(image)
+
+    if max_dimension and max(image.size) > max_dimension:
+        ratio = max(image.size) / max_dimension
+        if ratio >= FAST_RESAMPLE_RATIO:
+            resample = Image.Resampling.BILINEAR
+        else:
+            resample = Image.Resampling.LANCZOS
+        image = image.copy() if image is original else image
+        image.thumbnail((max_dimension, max_dimension), resample, reducing_gap=2.0)
+
+    buffered = BytesIO()
+    if pil_format == 'PNG':
+        # PNG 不使用 quality 参数，用较低的压缩级别换取编码速度
+        image.save(buffered, format='PNG', compress_level=3)
+    elif pil_format == 'WEBP':
+        # method 2 的编码速度约为默认值的两倍，体积只增加几个百分点
+        image.save(buffered, format='WEBP', quality=quality, method=2)
+    else:
+        image.save(buffered, format=pil_format, quality=quality)
+    encoded = buffered.getvalue()
+
+    return {
+        'data': encoded,
+        'mimetype': mimetype,
+        'format': fmt,
+        'etag': hashlib.sha256(encoded).hexdigest()[:32],
+        'width': image.width,
+        'height': image.height,
+        'original_width': original_width,
+        'original_height': original_height,
+        'elapsed_ms': (time.perf_counter() - start_time) * 1000
+    }
+
+
+def preprocess_tiles(data: bytes,
+                     tile_size: int = 1024,
+                     overlap: int = 64,
+                     max_tiles: int = 9,
+                     overview_size: Tuple[int, int] = (1024, 1024),
+                     quality: int = 85,
+                     max_pixels: int = DEFAULT_MAX_PIXELS) -> Dict[str, Any]:
+    """将大图切分为带重叠的高分辨率切片，并生成一张整体缩略图（可在子进程中运行）"""
+    start_time = time.perf_counter()
+    image = Image.open(BytesIO(data))
+    original_width, original_height = image.size
+    source_format = image.format
+
+    if original_width * original_height > max_pixels:
+        raise ImageTooLargeError(
+            f"图片像素数 {original_width}x{original_height} 超过限制 {max_pixels}"
+        )
+
+    scale, _, _ = plan_tile_grid(original_width, original_height, tile_size, max_tiles)
+    if scale < 1.0 and source_format == 'JPEG':
+        image.draft('RGB', (round(original_width * scale), round(original_height * scale)))
+
+    return tile_image(image, tile_size, overlap, max_tiles, overview_size, quality,
+                      source_format=source_format,
+                      original_size=(original_width, original_height),
+                      start_time=start_time)
+
+
+def tile_image(image: Image.Image,
+               tile_size: int = 1024,
+               overlap: int = 64,
+               max_tiles: int = 9,
+               overview_size: Tuple[int, int] = (1024, 1024),
+               quality: int = 85,
+               source_format: Optional[str] = None,
+               original_size: Optional[Tuple[int, int]] = None,
+               start_time: Optional[float] = None) -> Dict[str, Any]:
+    """切分已解码的图片，可直接处理内存中的截图"""
+    if start_time is None:
+        start_time = time.perf_counter()
+    original_width, original_height = original_size or image.size
+
+    scale, rows, cols = plan_tile_grid(original_width, original_height, tile_size, max_tiles)
+    target = (max(1, round(original_width * scale)), max(1, round(original_height * scale)))
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+
+    width, height = image.size
+    step_x = math.ceil(width / cols)
+    step_y = math.ceil(height / rows)
+
+    tiles: List[Dict[str, Any]] = []
+    for row in range(rows):
+        for col in range(cols):
+            left = max(0, col * step_x - overlap)
+            top = max(0, row * step_y - overlap)
+            right = min(width, (col + 1) * step_x + overlap)
+            bottom = min(height, (row + 1) * step_y + overlap)
+            tile = image.crop((left, top, right, bottom))
+            encoded = _encode_jpeg(tile, quality)
+            tiles.append({
+                'data': encoded,
+                'sha256': hashlib.sha256(encoded).hexdigest(),
+                'phash': None,
+                'row': row,
+                'col': col,
+                # 切片在原图坐标系中的位置
+                'box': [round(v / scale) for v in (left, top, right, bottom)],
+                'width': tile.width,
+                'height': tile.height,
+                'original_width': original_width,
+                'original_height': original_height,
+                'format': source_format,
+                'mode': 'RGB'
+            })
+
+    overview = image.copy()
+    overview.thumbnail(overview_size, Image.Resampling.BILINEAR)
+    overview_data = _encode_jpeg(overview, quality)
+
+    return {
+        'overview': {
+            'data': overview_data,
+            'sha256': hashlib.sha256(overview_data).hexdigest(),
+            'phash': None,
+            'width': overview.width,
+            'height': overview.height,
+            'original_width': original_width,
+            'original_height': original_height,
+            'format': source_format,
+            'mode': 'RGB'
+        },
+        'tiles': tiles,
+        'rows': rows,
+        'cols': cols,
+        'scale': scale,
+        'original_width': original_width,
+        'original_height': original_height,
+        'format': source_format,
+        'elapsed_ms': (time.perf_counter() - start_time) * 1000
+    }
+
+
+class ImagePreprocessor:
+    """图片预处理器，在进程池中执行解码、缩放和编码，不占用请求线程的 GIL"""
+
+    def __init__(self, config: Dict[str, Any]):
+        vision_config = config.get('vision', {})
+        max_image_size = vision_config.get('max_image_size', 1024)
+        self.max_size = (max_image_size, max_image_size)
+        self.quality = vision_config.get('jpeg_quality', 85)
+        self.max_pixels = vision_config.get('max_pixels', DEFAULT_MAX_PIXELS)
+        self.workers = vision_config.get('preprocess_workers', 2)
+        # 近似重复匹配需要感知哈希
+        self.compute_phash = vision_config.get('cache_similarity_threshold', 0) > 0
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """按需创建进程池，创建失败时回退到当前线程处理"""
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                try:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"无法创建图片预处理进程池，改为同步处理: {str(e)}")
+                    self.workers = 0
+            return self._executor
+
+    def _reset_executor(self):
+        """丢弃已损坏的进程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _options(self, overrides: Dict[str, Any]) -> Dict[str, Any]:
+        options = {
+            'max_size': self.max_size,
+            'quality': self.quality,
+            'max_pixels': self.max_pixels,
+            'compute_phash': self.compute_phash
+        }
+        options.update(overrides)
+        return options
+
+    def _submit(self, fn, data: bytes, options: Dict[str, Any]) -> Future:
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                return executor.submit(fn, data, **options)
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.warning(f"图片预处理进程池不可用，改为同步处理: {str(e)}")
+                self._reset_executor()
+
+        future = Future()
+        try:
+            future.set_result(fn(data, **options))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def submit(self, data: bytes, **overrides) -> Future:
+        """提交预处理任务，返回 Future"""
+        return self._submit(preprocess_image, data, self._options(overrides))
+
+    def _tile_options(self, tile_size: int, overlap: int, max_tiles: int) -> Dict[str, Any]:
+        return {
+            'tile_size': tile_size,
+            'overlap': overlap,
+            'max_tiles': max_tiles,
+            'overview_size': self.max_size,
+            'quality': self.quality,
+            'max_pixels': self.max_pixels
+        }
+
+    def submit_tiles(self, data: bytes, tile_size: int, overlap: int, max_tiles: int) -> Future:
+        """提交切片预处理任务，返回 Future"""
+        return self._submit(preprocess_tiles, data, self._tile_options(tile_size, overlap, max_tiles))
+
+    def result(self, future: Future, data: bytes, **overrides) -> Dict[str, Any]:
+        """等待预处理结果，子进程崩溃时在当前线程重试"""
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            logger.warning("图片预处理子进程异常退出，改为同步处理")
+            self._reset_executor()
+            return preprocess_image(data, **self._options(overrides))
+
+    def prepare_pil(self, image: Image.Image) -> Dict[str, Any]:
+        """在当前线程处理内存中的图片（传给子进程需要序列化整帧像素，得不偿失）"""
+        if image.width * image.height > self.max_pixels:
+            raise ImageTooLargeError(
+                f"图片像素数 {image.width}x{image.height} 超过限制 {self.max_pixels}"
+            )
+        return prepare_image(image, self.max_size, self.quality, self.compute_phash)
+
+    def tile_pil(self, image: Image.Image, tile_size: int, overlap: int, max_tiles: int) -> Dict[str, Any]:
+        """在当前线程切分内存中的图片"""
+        if image.width * image.height > self.max_pixels:
+            raise ImageTooLargeError(
+                f"图片像素数 {image.width}x{image.height} 超过限制 {self.max_pixels}"
+            )
+        return tile_image(image, tile_size, overlap, max_tiles, self.max_size, self.quality)
+
+    def tiles_result(self, future: Future, data: bytes, tile_size: int, overlap: int,
+                     max_tiles: int) -> Dict[str, Any]:
+        """等待切片预处理结果，子进程崩溃时在当前线程重试"""
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            logger.warning("图片预处理子进程异常退出，改为同步处理")
+            self._reset_executor()
+            return preprocess_tiles(data, **self._tile_options(tile_size, overlap, max_tiles))
+
+    def process(self, data: bytes, **overrides) -> Dict[str, Any]:
+        """同步获取预处理结果"""
+        return self.result(self.submit(data, **overrides), data, **overrides)
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -0,0 +1,199 @@
+import os
+import re
+import glob
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+# 当前请求 ID（HTTP 请求、Socket.IO 事件），由 RequestContextFilter 写入日志记录
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar('request_id', default='-')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 客户端传入的 X-Request-ID 只接受简单字符，避免日志注入
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+
+def set_request_id(request_id: Optional[str] = None) -> str:
+    """设置当前上下文的请求 ID（为空或不合法时生成新的），返回实际使用的 ID"""
+    if not request_id or not _REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex[:12]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def get_request_id() -> str:
+    return request_id_var.get()
+
+
+def queue_size() -> int:
+    """等待后台线程写入的日志条数"""
+    return _queue_handler.queue.qsize() if _queue_handler is not None else 0
+
+
+class RequestContextFilter(logging.Filter):
+    """在调用方线程中补充请求 ID 并截断过长的消息，之后才放入队列"""
+
+    def __init__(self, max_length: int = 4000):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if self.max_length > 0:
+            message = record.getMessage()
+            if len(message) > self.max_length:
+                # 工具参数、模型输出等可能很长（如 base64 截图），只保留开头
+                record.msg = message[:self.max_length] + f'...（已省略 {len(message) - self.max_length} 字符）'
+                record.args = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+            'process': record.process,
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DailyRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """按日期和大小轮转的日志文件
+
+    当前日志写入 localai.log；跨天或超过 max_bytes 时归档为 localai_YYYYMMDD[.N].log，
+    并删除 cleanup_pattern 匹配的、超过 retention_days 天未修改的文件
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, retention_days: int = 14,
+                 cleanup_pattern: Optional[str] = None):
+        super().__init__(filename, 'a', encoding='utf-8', delay=False)
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.base, self.ext = os.path.splitext(self.baseFilename)
+        self.cleanup_pattern = cleanup_pattern or f'{glob.escape(self.base)}_*{self.ext}'
+        # 已有日志文件按其修改日期归档，进程重启后不会混入新一天的日志
+        self.current_date = self._file_date()
+
+    def _file_date(self) -> str:
+        try:
+            return datetime.fromtimestamp(os.path.getmtime(self.baseFilename)).strftime('%Y%m%d')
+        except OSError:
+            return datetime.now().strftime('%Y%m%d')
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if datetime.now().strftime('%Y%m%d') != self.current_date:
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            if self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes:
+                return True
+        return False
+
+    def _archive_name(self) -> str:
+        name = f'{self.base}_{self.current_date}{self.ext}'
+        index = 0
+        while os.path.exists(name):
+            index += 1
+            name = f'{self.base}_{self.current_date}.{index}{self.ext}'
+        return name
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            os.replace(self.baseFilename, self._archive_name())
+        self.current_date = datetime.now().strftime('%Y%m%d')
+        self._remove_expired()
+        self.stream = self._open()
+
+    def _remove_expired(self):
+        if self.retention_days <= 0:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for path in glob.glob(self.cleanup_pattern):
+            if os.path.abspath(path) == self.baseFilename:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def shutdown_logging():
+    """移除队列处理器并停止监听线程（写完队列中剩余的日志）"""
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def configure_logging(config: Optional[Dict[str, Any]] = None):
+    """配置根日志器：调用方只把记录放入队列，由后台监听线程写文件和控制台
+
+    可重复调用（如配置热更新），会先停止旧的监听线程并写完队列中剩余的日志
+    """
+    global _listener, _queue_handler
+    log_config = (config or {}).get('logging', {})
+    log_dir = log_config.get('dir', 'logs')
+    root, ext = os.path.splitext(log_config.get('filename', 'localai.log'))
+    filename = root + ext
+    # 多进程模式下每个工作进程写独立文件，避免同时轮转同一个文件；
+    # 清理时也覆盖已退出的工作进程留下的文件
+    if int(os.environ.get('LOCALAI_WORKERS', '1')) > 1:
+        filename = f'{root}.{os.getpid()}{ext}'
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    file_handler = DailyRotatingFileHandler(os.path.join(log_dir, filename),
+                                            max_bytes=log_config.get('max_bytes', 20 * 1024 * 1024),
+                                            retention_days=log_config.get('retention_days', 14),
+                                            cleanup_pattern=os.path.join(glob.escape(log_dir), f'{glob.escape(root)}[._]*{ext}'))
+    if log_config.get('format', 'text') == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [file_handler]
+    if log_config.get('console', True):
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(console_handler)
+
+    shutdown_logging()
+    root_logger = logging.getLogger()
+
+    _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(RequestContextFilter(log_config.get('max_message_length', 4000)))
+    root_logger.addHandler(_queue_handler)
+    root_logger.setLevel(log_config.get('level', 'INFO').upper())
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+atexit.register(shutdown_logging)
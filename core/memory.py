@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from .ollama_client import OllamaPool
+from .model_router import estimate_tokens
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只有单个进程，进程内的线程锁已足够
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PROMPT = "以下是与当前问题相关的早期对话片段（按时间顺序），回答时可参考：\n\n{snippets}"
+
+# 每轮对话参与嵌入和保存的最大字符数（嵌入模型的上下文有限）
+EMBED_MAX_CHARS = 4000
+
+
+class UserMemory:
+    """单个用户的向量存储
+
+    vectors.f32 为按行追加的 float32 矩阵（已归一化，通过内存映射读取，容量不足时按倍数扩展），
+    index.jsonl 每行对应一行向量（原文、在对话历史中的位置、时间），meta.json 记录维度、
+    模型和已写入的行数。先写向量和索引、最后原子替换 meta.json，中途退出时多出的行会被忽略。
+    多个工作进程共用同一目录，写入时持有 .lock 文件的排他锁，读取时持有共享锁
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, 'vectors.f32')
+        self.index_path = os.path.join(directory, 'index.jsonl')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.lock_path = os.path.join(directory, '.lock')
+        self.dim = 0
+        self.model = ''
+        self.count = 0
+        self.capacity = 0
+        # index.jsonl 中前 count 行的字节数，之后的内容是中途退出时留下的，追加前截掉
+        self.index_size = 0
+        self.entries: List[Dict[str, Any]] = []
+        self.seqs = np.zeros(0, dtype=np.int64)
+        self._matrix: Optional[np.memmap] = None
+        self._meta_mtime = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """跨进程的文件锁，与 self.lock 配合使用（调用方已持有线程锁）"""
+        if fcntl is None or (not exclusive and not os.path.isdir(self.directory)):
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        """meta.json 有变化（首次使用或其他工作进程写入）时重新加载索引和内存映射"""
+        try:
+            stat = os.stat(self.meta_path)
+        except OSError:
+            return
+        # meta.json 每次写入都是替换文件，同时比较 inode，避免时间戳精度不足时漏掉其他进程的写入
+        mtime = (stat.st_mtime_ns, stat.st_ino)
+        if mtime == self._meta_mtime:
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        entries, size = [], 0
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                if len(entries) >= meta['count']:
+                    break
+                entries.append(json.loads(line))
+                size += len(line)
+        self.dim, self.model = meta['dim'], meta['model']
+        self.entries = entries
+        self.index_size = size
+        self.count = len(entries)
+        self.seqs = np.array([entry['seq'] for entry in entries], dtype=np.int64)
+        self.capacity = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(self.capacity, self.dim))
+        self._meta_mtime = mtime
+
+    def _reset(self, dim: int, model: str):
+        """首次写入或嵌入模型（维度）变化时重建存储"""
+        if self.count:
+            logger.warning(f"嵌入模型变化（{self.model} -> {model}），清空记忆 {self.directory}")
+        os.makedirs(self.directory, exist_ok=True)
+        self._matrix = None
+        for path in (self.vectors_path, self.index_path):
+            open(path, 'wb').close()
+        self.dim, self.model, self.count, self.capacity = dim, model, 0, 0
+        self.index_size = 0
+        self.entries, self.seqs = [], np.zeros(0, dtype=np.int64)
+
+    def _grow(self, needed: int):
+        capacity = max(256, self.capacity)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        self._matrix = None
+        with open(self.vectors_path, 'r+b') as f:
+            f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+
+    def append(self, vectors: np.ndarray, entries: List[Dict[str, Any]], model: str):
+        with self.lock:
+            with self._file_lock(exclusive=True):
+                self._load()
+                if self.dim != vectors.shape[1] or self.model != model:
+                    self._reset(vectors.shape[1], model)
+                self._grow(self.count + len(entries))
+                self._matrix[self.count:self.count + len(entries)] = vectors
+                self._matrix.flush()
+                data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+                with open(self.index_path, 'r+b') as f:
+                    f.truncate(self.index_size)
+                    f.seek(self.index_size)
+                    f.write(data)
+                self.index_size += len(data)
+                self.entries.extend(entries)
+                self.count += len(entries)
+                self.seqs = np.concatenate([self.seqs, np.array([e['seq'] for e in entries], dtype=np.int64)])
+                tmp_path = self.meta_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim, 'model': self.model, 'count': self.count}, f)
+                os.replace(tmp_path, self.meta_path)
+                stat = os.stat(self.meta_path)
+                self._meta_mtime = (stat.st_mtime_ns, stat.st_ino)
+
+    def search(self, query: np.ndarray, top_k: int, before_seq: int, min_score: float) -> List[Tuple[float, Dict[str, Any]]]:
+        """余弦相似度 top-K（向量已归一化，一次矩阵乘法），只检索对话历史中 before_seq 之前的片段"""
+        with self.lock:
+            # 其他进程重建存储时会截断向量文件，读取内存映射期间也持有共享锁
+            with self._file_lock(exclusive=False):
+                self._load()
+                if not self.count or query.shape[0] != self.dim:
+                    return []
+                scores = np.asarray(self._matrix[:self.count] @ query)
+                seqs, entries = self.seqs, self.entries
+        scores = np.where(seqs < before_seq, scores, -np.inf)
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(float(scores[i]), entries[i]) for i in top if scores[i] >= min_score]
+
+
+class ConversationMemory:
+    """长期对话记忆：后台批量嵌入已完成的对话轮次，提问时检索相关的早期片段，
+    发送给模型的只有这些片段和最近几条消息，而不是完整历史
+
+    嵌入通过 Ollama 的 /api/embed 计算（旧版本回退到 /api/embeddings），每个用户的向量单独存放
+    """
+
+    def __init__(self, config: Dict[str, Any], pool: OllamaPool):
+        self.pool = pool
+        self._users: Dict[str, UserMemory] = {}
+        self._users_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, int, str]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'queries': 0, 'retrieved': 0, 'embedded': 0, 'embed_failures': 0,
+                       'retrieval_ms': 0.0, 'query_embed_ms': 0.0, 'embed_ms': 0.0,
+                       'tokens_full': 0, 'tokens_sent': 0}
+        self.apply_config(config)
+
+    def apply_config(self, config: Dict[str, Any]):
+        memory_config = config.get('memory', {})
+        self.enabled = memory_config.get('enabled', False)
+        self.model = memory_config.get('embed_model', 'nomic-embed-text')
+        self.directory = memory_config.get('dir', os.path.join('cache', 'memory'))
+        # 至少保留最后一条用户消息
+        self.recent_messages = max(1, memory_config.get('recent_messages', 8))
+        self.min_history = memory_config.get('min_history', 16)
+        self.top_k = memory_config.get('top_k', 4)
+        self.min_score = memory_config.get('min_score', 0.35)
+        self.max_snippet_chars = memory_config.get('max_snippet_chars', 600)
+        self.batch_size = memory_config.get('batch_size', 32)
+        self.batch_interval = memory_config.get('batch_interval', 1.0)
+        self.embed_timeout = memory_config.get('embed_timeout', 10)
+
+    def _user(self, user_id: str) -> UserMemory:
+        with self._users_lock:
+            memory = self._users.get(user_id)
+            if memory is None:
+                # 用户 ID 可能包含任意字符，目录名使用其哈希
+                name = hashlib.sha1(user_id.encode('utf-8')).hexdigest()[:16]
+                memory = UserMemory(os.path.join(self.directory, name))
+                self._users[user_id] = memory
+            return memory
+
+    # ---- 嵌入 ----
+
+    def embed(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """批量计算嵌入，返回按行归一化的 float32 矩阵"""
+        vectors = self.pool.embed(self.model, texts, timeout or self.embed_timeout)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    # ---- 写入 ----
+
+    def remember(self, user_id: str, seq: int, question: str, answer: str):
+        """记录一轮已完成的对话（seq 为用户消息在历史中的位置），在后台批量嵌入"""
+        if not self.enabled or not question:
+            return
+        # 非流式回复中可能带有 <think> 内容，不参与嵌入
+        answer = re.sub(r'<think>.*?</think>', '', answer or '', flags=re.DOTALL).strip()
+        text = f"用户: {question}\n助手: {answer}"[:EMBED_MAX_CHARS]
+        self._queue.put((user_id, seq, text))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='memory-embed', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.batch_interval
+            # 凑满一批或等待 batch_interval 后一起嵌入
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._embed_batch(batch)
+            except Exception as e:
+                with self._stats_lock:
+                    self._stats['embed_failures'] += len(batch)
+                logger.error(f"对话记忆嵌入失败（{len(batch)} 条）: {str(e)}")
+
+    def _embed_batch(self, batch: List[Tuple[str, int, str]]):
+        start = time.perf_counter()
+        vectors = self.embed([text for _, _, text in batch], timeout=max(self.embed_timeout, 60))
+        by_user: Dict[str, List[int]] = {}
+        for i, (user_id, _, _) in enumerate(batch):
+            by_user.setdefault(user_id, []).append(i)
+        now = time.time()
+        for user_id, rows in by_user.items():
+            entries = [{'seq': batch[i][1], 'text': batch[i][2], 'time': now} for i in rows]
+            self._user(user_id).append(vectors[rows], entries, self.model)
+        with self._stats_lock:
+            self._stats['embedded'] += len(batch)
+            self._stats['embed_ms'] += (time.perf_counter() - start) * 1000
+        logger.info(f"对话记忆已嵌入 {len(batch)} 条，耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    # ---- 检索 ----
+
+    def build_prompt(self, user_id: str, messages: List[Dict]) -> Tuple[List[Dict], Dict[str, Any]]:
+        """返回发送给模型的消息列表和记忆信息
+
+        历史较短、未启用或检索失败时原样返回完整历史；否则保留开头的系统消息和最近
+        recent_messages 条消息（从用户消息开始，不截断工具调用），并把相关的早期片段作为系统消息插入
+        """
+        if not self.enabled or len(messages) <= self.min_history:
+            return messages, {'used': False}
+
+        cut = max(0, len(messages) - self.recent_messages)
+        while cut > 0 and messages[cut].get('role') != 'user':
+            cut -= 1
+        if cut == 0:
+            return messages, {'used': False}
+        query = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+
+        start = time.perf_counter()
+        try:
+            vector = self.embed([query])[0]
+        except (requests.RequestException, KeyError, ValueError) as e:
+            logger.warning(f"对话记忆检索失败，发送完整历史: {str(e)}")
+            return messages, {'used': False, 'error': str(e)}
+        embed_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        try:
+            hits = self._user(user_id).search(vector, self.top_k, cut, self.min_score)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"读取对话记忆失败，发送完整历史: {str(e)}")
+            return messages, {'used': False, 'error': str(e)}
+        retrieval_ms = (time.perf_counter() - start) * 1000
+
+        hits.sort(key=lambda hit: hit[1]['seq'])
+        snippets = '\n\n'.join(entry['text'][:self.max_snippet_chars] for _, entry in hits)
+        system = [m for m in messages[:cut] if m.get('role') == 'system']
+        if snippets:
+            system.append({'role': 'system', 'content': MEMORY_PROMPT.format(snippets=snippets)})
+        prompt = system + messages[cut:]
+
+        tokens_full = sum(estimate_tokens(m.get('content') or '') for m in messages)
+        tokens_sent = sum(estimate_tokens(m.get('content') or '') for m in prompt)
+        if tokens_sent >= tokens_full:
+            # 被省略的历史比插入的片段还短，直接发送完整历史
+            return messages, {'used': False, 'retrieval_ms': round(retrieval_ms, 3)}
+        with self._stats_lock:
+            stats = self._stats
+            stats['queries'] += 1
+            stats['retrieved'] += len(hits)
+            stats['retrieval_ms'] += retrieval_ms
+            stats['query_embed_ms'] += embed_ms
+            stats['tokens_full'] += tokens_full
+            stats['tokens_sent'] += tokens_sent
+        info = {'used': True, 'snippets': len(hits), 'scores': [round(score, 3) for score, _ in hits],
+                'embed_ms': round(embed_ms, 1), 'retrieval_ms': round(retrieval_ms, 3),
+                'prompt_tokens': tokens_sent, 'tokens_saved': tokens_full - tokens_sent}
+        logger.info(f"对话记忆: 检索 {len(hits)} 条片段，耗时 {retrieval_ms:.2f} ms，"
+                    f"节省约 {tokens_full - tokens_sent} 个 token")
+        return prompt, info
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        queries = stats['queries']
+        return {
+            'enabled': self.enabled,
+            'model': self.model,
+            'pending': self._queue.qsize(),
+            'queries': queries,
+            'embedded': stats['embedded'],
+            'embed_failures': stats['embed_failures'],
+            'avg_retrieval_ms': round(stats['retrieval_ms'] / queries, 3) if queries else None,
+            'avg_query_embed_ms': round(stats['query_embed_ms'] / queries, 1) if queries else None,
+            'avg_batch_embed_ms': round(stats['embed_ms'] / stats['embedded'], 1) if stats['embedded'] else None,
+            'avg_snippets': round(stats['retrieved'] / queries, 2) if queries else None,
+            'prompt_tokens_full': stats['tokens_full'],
+            'prompt_tokens_sent': stats['tokens_sent'],
+            'tokens_saved': stats['tokens_full'] - stats['tokens_sent']
+        }
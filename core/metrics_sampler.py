@@ -0,0 +1,389 @@
+import time
+import heapq
+import logging
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """定长环形缓冲区，数据存放在连续的 array 中；width 为 None 时每行一个标量，否则每行 width 个值"""
+
+    def __init__(self, capacity: int, width: Optional[int] = None, typecode: str = 'f'):
+        self.capacity = capacity
+        self.scalar = width is None
+        self.width = width or 1
+        self._data = array(typecode, [0]) * (capacity * self.width)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, values):
+        """写入一行，values 为标量或长度为 width 的序列"""
+        offset = self._next * self.width
+        if self.scalar:
+            self._data[offset] = values
+        else:
+            self._data[offset:offset + self.width] = array(self._data.typecode, values)
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def latest(self):
+        if not self._size:
+            return None
+        return self.row((self._next - 1) % self.capacity)
+
+    def row(self, index: int):
+        offset = index * self.width
+        if self.scalar:
+            return self._data[offset]
+        return self._data[offset:offset + self.width].tolist()
+
+    def tail(self, count: int) -> List[Any]:
+        """按时间顺序返回最近 count 行"""
+        count = min(count, self._size)
+        start = (self._next - count) % self.capacity
+        return [self.row((start + i) % self.capacity) for i in range(count)]
+
+
+# 只读取排序所需的字段，避免 process_iter 为每个进程获取全部信息
+PROCESS_ATTRS = ['pid', 'name', 'cpu_times', 'memory_info', 'create_time']
+if hasattr(psutil.Process, 'io_counters'):
+    PROCESS_ATTRS.append('io_counters')
+
+PROCESS_SORT_KEYS = {
+    'cpu': 'cpu_percent',
+    'memory': 'memory_rss',
+    'io': 'io_bytes_per_sec',
+}
+
+
+class ProcessScanner:
+    """两次扫描之间的 CPU 时间和 I/O 差值即为该周期的进程占用，不需要阻塞等待"""
+
+    def __init__(self):
+        self._previous: Dict[int, tuple] = {}
+        self._previous_at: Optional[float] = None
+
+    def reset(self):
+        self._previous = {}
+        self._previous_at = None
+
+    def scan(self) -> Optional[List[Dict[str, Any]]]:
+        """扫描一次进程表，有上一次扫描作为基准时返回各进程的占用"""
+        now = time.monotonic()
+        elapsed = now - self._previous_at if self._previous_at is not None else None
+        total_memory = psutil.virtual_memory().total
+        current, processes = {}, []
+
+        for proc in psutil.process_iter(PROCESS_ATTRS):
+            info = proc.info
+            cpu_times, memory_info = info.get('cpu_times'), info.get('memory_info')
+            if cpu_times is None or memory_info is None:
+                # 无权限读取的进程
+                continue
+            cpu_total = cpu_times.user + cpu_times.system
+            io = info.get('io_counters')
+            io_total = io.read_bytes + io.write_bytes if io is not None else 0
+            key = info['pid']
+            current[key] = (info.get('create_time'), cpu_total, io_total)
+
+            if elapsed is None:
+                continue
+            previous = self._previous.get(key)
+            if previous is None or previous[0] != info.get('create_time'):
+                # 新进程（或 PID 被复用）没有基准，从零开始计算
+                previous = (None, cpu_total, io_total)
+            processes.append({
+                'pid': key,
+                'name': info.get('name') or '',
+                'cpu_percent': round(max(0.0, cpu_total - previous[1]) / elapsed * 100, 1),
+                'memory_rss': memory_info.rss,
+                'memory_percent': round(memory_info.rss / total_memory * 100, 2),
+                'io_bytes_per_sec': round(max(0, io_total - previous[2]) / elapsed)
+            })
+
+        self._previous, self._previous_at = current, now
+        return processes if elapsed is not None else None
+
+
+class MetricsSampler:
+    """后台系统指标采样：按固定频率采样 psutil 写入环形缓冲区，请求直接读取最新样本"""
+
+    SERIES = ('cpu', 'memory', 'disk_read', 'disk_write', 'net_sent', 'net_recv')
+
+    def __init__(self, config: Dict[str, Any]):
+        metrics_config = config.get('metrics', {})
+        self.interval = metrics_config.get('interval', 1.0)
+        # 磁盘容量和进程数变化缓慢，单独按较长周期刷新
+        self.slow_interval = metrics_config.get('slow_interval', 30.0)
+        capacity = max(1, int(metrics_config.get('history_seconds', 3600) / self.interval))
+
+        self.cpu_count = psutil.cpu_count() or 1
+        self.timestamps = RingBuffer(capacity, typecode='d')
+        self.series = {name: RingBuffer(capacity) for name in self.SERIES}
+        self.per_core = RingBuffer(capacity, width=self.cpu_count)
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._slow: Dict[str, Any] = {}
+        self._slow_at = 0.0
+        self._latest: Optional[Dict[str, Any]] = None
+
+        # 进程扫描按需进行：最近有查询时才在采样线程中扫描
+        self.process_interval = metrics_config.get('process_interval', 2.0)
+        self.process_ttl = metrics_config.get('process_ttl', 5.0)
+        self.process_idle = metrics_config.get('process_idle', 60.0)
+        self._scanner = ProcessScanner()
+        self._process_condition = threading.Condition()
+        self._process_snapshot: Optional[List[Dict[str, Any]]] = None
+        self._process_snapshot_at = 0.0
+        self._process_scan_at = 0.0
+        self._process_demand_at = 0.0
+        self._top_cache: Dict[tuple, List[Dict[str, Any]]] = {}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+        logger.info(f"系统指标采样已启动，间隔 {self.interval} 秒")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        """每次采样后回调最新指标"""
+        self._listeners.append(callback)
+
+    def _run(self):
+        # 首次调用只建立基准，之后每次返回的都是一个采样周期内的平均值
+        psutil.cpu_percent(percpu=True)
+        disk_io = _disk_io()
+        net_io = psutil.net_io_counters()
+        last = time.monotonic()
+
+        while not self._stop_event.wait(self.interval):
+            try:
+                now = time.monotonic()
+                elapsed = max(now - last, 1e-6)
+                last = now
+
+                per_core = psutil.cpu_percent(percpu=True)
+                memory = psutil.virtual_memory()
+                new_disk_io = _disk_io()
+                new_net_io = psutil.net_io_counters()
+
+                sample = {
+                    'cpu': sum(per_core) / len(per_core),
+                    'memory': memory.percent,
+                    'disk_read': _rate(disk_io, new_disk_io, 'read_bytes', elapsed),
+                    'disk_write': _rate(disk_io, new_disk_io, 'write_bytes', elapsed),
+                    'net_sent': _rate(net_io, new_net_io, 'bytes_sent', elapsed),
+                    'net_recv': _rate(net_io, new_net_io, 'bytes_recv', elapsed)
+                }
+                disk_io, net_io = new_disk_io, new_net_io
+
+                if now - self._slow_at >= self.slow_interval:
+                    self._slow = _slow_stats()
+                    self._slow_at = now
+
+                with self._lock:
+                    self.timestamps.append(time.time())
+                    for name, value in sample.items():
+                        self.series[name].append(value)
+                    self.per_core.append(per_core[:self.cpu_count])
+                    self._latest = self._build_info(sample, per_core, memory)
+                    latest = self._latest
+
+                for callback in self._listeners:
+                    try:
+                        callback(latest)
+                    except Exception as e:
+                        logger.warning(f"推送系统指标失败: {str(e)}")
+
+                self._sample_processes(now)
+            except Exception as e:
+                logger.error(f"系统指标采样失败: {str(e)}")
+
+    def _sample_processes(self, now: float):
+        """最近有进程查询时，按 process_interval 扫描进程表"""
+        if now - self._process_demand_at > self.process_idle:
+            if self._process_scan_at:
+                # 长时间无查询后停止扫描，旧基准不再有意义
+                self._scanner.reset()
+                self._process_scan_at = 0.0
+            return
+        if now - self._process_scan_at < self.process_interval and self._process_snapshot_at >= self._process_demand_at:
+            return
+
+        start_time = time.perf_counter()
+        processes = self._scanner.scan()
+        self._process_scan_at = now
+        if processes is None:
+            return
+        with self._process_condition:
+            self._process_snapshot = processes
+            self._process_snapshot_at = time.monotonic()
+            self._top_cache = {}
+            self._process_condition.notify_all()
+        logger.debug(f"扫描 {len(processes)} 个进程，耗时 {(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+    def _build_info(self, sample: Dict[str, float], per_core: List[float], memory) -> Dict[str, Any]:
+        """与 SystemController.get_system_info 相同的结构，附加每核 CPU 和 I/O 速率"""
+        return {
+            'cpu': {
+                'percent': round(sample['cpu'], 1),
+                'cores': self.cpu_count,
+                'per_core': per_core
+            },
+            'memory': {
+                'total': memory.total,
+                'available': memory.available,
+                'percent': memory.percent,
+                'used': memory.used
+            },
+            'disk': self._slow.get('disk', {}),
+            'disk_io': {
+                'read_bytes_per_sec': round(sample['disk_read']),
+                'write_bytes_per_sec': round(sample['disk_write'])
+            },
+            'network': {
+                'sent_bytes_per_sec': round(sample['net_sent']),
+                'recv_bytes_per_sec': round(sample['net_recv'])
+            },
+            'system': self._slow.get('system', {}),
+            'sampled_at': datetime.now().isoformat()
+        }
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """最新样本，尚未采样时返回 None"""
+        with self._lock:
+            return self._latest
+
+    def top_processes(self, sort_by: str = 'cpu', limit: int = 5, timeout: float = 5.0) -> Dict[str, Any]:
+        """按 CPU、内存或 I/O 返回占用最高的进程
+        
+        结果来自采样线程的最近一次扫描；快照超过 process_ttl 时等待下一次扫描。
+        """
+        if sort_by not in PROCESS_SORT_KEYS:
+            raise ValueError(f"不支持的排序方式: {sort_by}")
+        key = PROCESS_SORT_KEYS[sort_by]
+
+        with self._process_condition:
+            self._process_demand_at = time.monotonic()
+            deadline = self._process_demand_at + timeout
+            while (self._process_snapshot is None
+                   or time.monotonic() - self._process_snapshot_at > self.process_ttl):
+                if self._thread is None:
+                    # 采样线程未启动时在当前线程完成两次扫描
+                    self._process_condition.release()
+                    try:
+                        self._scan_inline()
+                    finally:
+                        self._process_condition.acquire()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._process_condition.wait(remaining)
+
+            if self._process_snapshot is None:
+                raise TimeoutError("进程扫描超时")
+
+            cache_key = (key, limit)
+            top = self._top_cache.get(cache_key)
+            if top is None:
+                top = heapq.nlargest(limit, self._process_snapshot, key=lambda proc: proc[key])
+                self._top_cache[cache_key] = top
+            return {
+                'sort_by': sort_by,
+                'processes': top,
+                'total': len(self._process_snapshot),
+                'age_seconds': round(time.monotonic() - self._process_snapshot_at, 2)
+            }
+
+    def _scan_inline(self):
+        self._scanner.scan()
+        time.sleep(0.5)
+        processes = self._scanner.scan()
+        with self._process_condition:
+            self._process_snapshot = processes
+            self._process_snapshot_at = time.monotonic()
+            self._top_cache = {}
+
+    def history(self, seconds: float = 300, points: int = 120, per_core: bool = False) -> Dict[str, Any]:
+        """最近 seconds 秒的历史，按时间分桶取平均降采样到不超过 points 个点"""
+        count = max(1, int(seconds / self.interval))
+        with self._lock:
+            timestamps = self.timestamps.tail(count)
+            columns = {name: buffer.tail(count) for name, buffer in self.series.items()}
+            if per_core:
+                columns['per_core'] = self.per_core.tail(count)
+
+        bucket = max(1, -(-len(timestamps) // max(1, points)))
+        result = {
+            'interval': round(self.interval * bucket, 3),
+            'timestamps': [round(t, 3) for t in _downsample(timestamps, bucket)]
+        }
+        for name, values in columns.items():
+            if name == 'per_core':
+                # 每核数据转置后逐核降采样
+                cores = list(zip(*values)) if values else []
+                result[name] = [[round(v, 1) for v in _downsample(core, bucket)] for core in cores]
+            else:
+                result[name] = [round(v, 1) for v in _downsample(values, bucket)]
+        return result
+
+
+def _downsample(values, bucket: int) -> List[float]:
+    if bucket <= 1:
+        return list(values)
+    return [sum(values[i:i + bucket]) / len(values[i:i + bucket]) for i in range(0, len(values), bucket)]
+
+
+def _disk_io():
+    try:
+        return psutil.disk_io_counters()
+    except Exception:
+        # 部分容器环境没有磁盘计数器
+        return None
+
+
+def _rate(old, new, field: str, elapsed: float) -> float:
+    if old is None or new is None:
+        return 0.0
+    return max(0, getattr(new, field) - getattr(old, field)) / elapsed
+
+
+def _slow_stats() -> Dict[str, Any]:
+    """磁盘容量、进程数和启动时间"""
+    disk = {'total': 0, 'free': 0, 'percent': 0, 'used': 0}
+    for path in ('C:', '/'):
+        try:
+            usage = psutil.disk_usage(path)
+            disk = {'total': usage.total, 'free': usage.free, 'percent': usage.percent, 'used': usage.used}
+            break
+        except Exception:
+            continue
+
+    try:
+        processes = len(psutil.pids())
+    except Exception:
+        processes = 0
+
+    try:
+        boot_time = datetime.fromtimestamp(psutil.boot_time()).isoformat()
+    except Exception:
+        boot_time = datetime.now().isoformat()
+
+    return {'disk': disk, 'system': {'processes': processes, 'boot_time': boot_time}}
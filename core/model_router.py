@@ -0,0 +1,218 @@
+import re
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from .ollama_client import OllamaPool
+
+logger = logging.getLogger(__name__)
+
+# 客户端传入该值（或不传模型）时由路由器选择模型
+AUTO = 'auto'
+
+# 各类对话的预计回复长度（token，含 qwen3 的思考内容），可在 router.expected_tokens 中覆盖
+EXPECTED_TOKENS = {'greeting': 60, 'simple': 250, 'tool': 300, 'code': 800, 'complex': 700}
+
+CODE_PATTERN = re.compile(
+    r'```|Traceback \(most recent call last\)|=>|[;{}]\s*$|'
+    r'^\s*(?:def|class|import|from\s+\S+\s+import|function|const|let|var|public|private|#include|SELECT)\b',
+    re.M)
+CODE_KEYWORDS = ('代码', '函数', '编程', '报错', '异常', '调试', '正则', '脚本', '编译', '重构', '算法', '接口',
+                 'python', 'javascript', 'typescript', 'java', 'sql', 'c++', 'rust', 'golang', 'bash', 'powershell',
+                 'bug', 'debug', 'regex', 'script', 'code', 'function', 'compile')
+TOOL_KEYWORDS = ('打开', '启动', '关闭', '截图', '截屏', '屏幕', '进程', '执行', '运行', '命令', '系统信息',
+                 'cpu', '内存', '磁盘', '占用', '显卡', 'open ', 'launch', 'screenshot', 'screen', 'process',
+                 'command', 'run ', 'memory usage', 'disk')
+GREETINGS = ('你好', '您好', '嗨', '哈喽', '早上好', '中午好', '下午好', '晚上好', '晚安', '谢谢', '感谢', '再见',
+             '好的', '收到', '在吗', 'hi', 'hello', 'hey', 'thanks', 'thank you', 'bye', 'ok', 'good morning')
+COMPLEX_KEYWORDS = ('分析', '解释', '详细', '比较', '对比', '为什么', '原理', '总结', '翻译', '设计', '方案', '步骤',
+                    '优缺点', '写一篇', '写一份', '论文', '计划', 'explain', 'compare', 'why', 'analy', 'summar',
+                    'design', 'translate', 'step by step', 'in detail')
+
+# 英文问候语后面不能紧跟字母（避免 "history" 被当作 "hi"）
+GREETING_PATTERN = re.compile('(?:' + '|'.join(map(re.escape, GREETINGS)) + ')(?![a-z])')
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中文约每字 0.7 个 token，其他字符约每 4 个一个"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return int(cjk * 0.7 + (len(text) - cjk) / 4) + 1
+
+
+def classify(text: str, use_tools: bool = False, simple_max_chars: int = 60) -> str:
+    """按长度、代码特征和工具调用可能性对一轮对话分类
+
+    返回 greeting / simple / tool / code / complex；只做字符串匹配，耗时在微秒级
+    """
+    stripped = text.strip()
+    lowered = stripped.lower()
+    if use_tools and any(keyword in lowered for keyword in TOOL_KEYWORDS):
+        return 'tool'
+    if CODE_PATTERN.search(stripped) or any(keyword in lowered for keyword in CODE_KEYWORDS):
+        return 'code'
+    if len(stripped) <= 16 and GREETING_PATTERN.match(lowered):
+        return 'greeting'
+    if (len(stripped) <= simple_max_chars and stripped.count('\n') <= 1
+            and not any(keyword in lowered for keyword in COMPLEX_KEYWORDS)):
+        return 'simple'
+    return 'complex'
+
+
+class ModelStats:
+    """从 Ollama 结束帧学习到的单个模型速度（指数移动平均）"""
+
+    def __init__(self):
+        self.tokens_per_second: Optional[float] = None
+        self.prompt_tokens_per_second: Optional[float] = None
+        self.load_ms: Optional[float] = None
+        self.samples = 0
+        self.routed = 0
+        self.updated_at = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tokens_per_second': round(self.tokens_per_second, 1) if self.tokens_per_second else None,
+            'prompt_tokens_per_second': round(self.prompt_tokens_per_second, 1) if self.prompt_tokens_per_second else None,
+            'load_ms': round(self.load_ms, 1) if self.load_ms is not None else None,
+            'samples': self.samples,
+            'routed': self.routed,
+            'updated_at': self.updated_at
+        }
+
+
+def _ewma(current: Optional[float], value: float, alpha: float) -> float:
+    return value if current is None else current * (1 - alpha) + value * alpha
+
+
+class ModelRouter:
+    """对话模型路由：客户端选择“自动”时，按本轮对话的类型在配置的模型中选择，
+    优先使用该类对话的首选模型，预计耗时超过 latency_target_ms 时换用更快的模型
+
+    各模型的生成速度、提示词处理速度和冷加载耗时从 OllamaPool 转发的结束帧统计中学习；
+    客户端明确指定的模型总是直接使用
+    """
+
+    def __init__(self, config: Dict[str, Any], pool: OllamaPool):
+        self.pool = pool
+        self._stats: Dict[str, ModelStats] = {}
+        self._kinds: Dict[str, int] = {}
+        self._recent = deque(maxlen=50)
+        self._lock = threading.Lock()
+        self.apply_config(config)
+        pool.subscribe(self.observe)
+
+    def apply_config(self, config: Dict[str, Any]):
+        ollama_config = config['ollama']
+        router_config = config.get('router', {})
+        self.enabled = router_config.get('enabled', False)
+        self.default_model = ollama_config['default_model']
+        self.code_model = ollama_config.get('code_model') or self.default_model
+        self.fast_model = router_config.get('fast_model') or self.default_model
+        self.latency_target_ms = router_config.get('latency_target_ms', 10000)
+        self.simple_max_chars = router_config.get('simple_max_chars', 60)
+        self.alpha = router_config.get('ewma_alpha', 0.3)
+        self.expected_tokens = dict(EXPECTED_TOKENS, **router_config.get('expected_tokens', {}))
+
+    def _preferences(self, kind: str) -> List[str]:
+        """各类对话按优先顺序排列的候选模型"""
+        if kind in ('greeting', 'simple'):
+            order = [self.fast_model, self.default_model]
+        elif kind == 'code':
+            order = [self.code_model, self.default_model, self.fast_model]
+        else:
+            # 工具调用和复杂问题优先使用默认模型（需支持 function calling），超出延迟目标时才降级
+            order = [self.default_model, self.fast_model]
+        return list(dict.fromkeys(model for model in order if model))
+
+    def estimate_ms(self, model: str, prompt_tokens: int, output_tokens: int,
+                    loaded: Optional[set] = None) -> Optional[float]:
+        """预计完整回复耗时（毫秒）；尚未观察到该模型的生成速度时返回 None"""
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None or not stats.tokens_per_second:
+                return None
+            estimate = output_tokens / stats.tokens_per_second * 1000
+            if stats.prompt_tokens_per_second:
+                estimate += prompt_tokens / stats.prompt_tokens_per_second * 1000
+            if loaded is not None and model not in loaded and stats.load_ms:
+                estimate += stats.load_ms
+        return estimate
+
+    def _loaded_models(self) -> set:
+        loaded = set()
+        for backend in self.pool.stats():
+            if backend['state'] != 'open':
+                loaded.update(backend['loaded'])
+        return loaded
+
+    def route(self, messages: List[Dict], requested: Optional[str] = None,
+              use_tools: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """返回 (模型, 路由说明)；requested 为具体模型名时原样返回"""
+        if requested and requested != AUTO:
+            return requested, {'reason': 'explicit'}
+        if not self.enabled:
+            return self.default_model, {'reason': 'disabled'}
+
+        text = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+        kind = classify(text, use_tools, self.simple_max_chars)
+        prompt_tokens = sum(estimate_tokens(m.get('content') or '') for m in messages)
+        output_tokens = self.expected_tokens.get(kind, EXPECTED_TOKENS['complex'])
+
+        candidates = self._preferences(kind)
+        installed = self.pool.list_models()
+        if installed is not None:
+            candidates = [model for model in candidates if model in installed] or candidates
+        loaded = self._loaded_models()
+
+        estimates = {model: self.estimate_ms(model, prompt_tokens, output_tokens, loaded) for model in candidates}
+        # 按优先顺序选第一个预计不超过延迟目标的模型；没有数据的模型先用起来以便学习其速度
+        choice = next((model for model in candidates
+                       if estimates[model] is None or estimates[model] <= self.latency_target_ms), None)
+        reason = 'preferred' if choice == candidates[0] else 'latency'
+        if choice is None:
+            # 都超过延迟目标时选预计最快的
+            choice = min(candidates, key=lambda model: estimates[model])
+            reason = 'fastest'
+
+        info = {'reason': reason, 'kind': kind, 'prompt_tokens': prompt_tokens, 'expected_tokens': output_tokens,
+                'estimate_ms': round(estimates[choice]) if estimates[choice] is not None else None}
+        with self._lock:
+            self._stats.setdefault(choice, ModelStats()).routed += 1
+            self._kinds[kind] = self._kinds.get(kind, 0) + 1
+            self._recent.append(dict(info, model=choice, time=time.time()))
+        logger.info(f"模型路由: {kind} -> {choice} ({reason}, 预计 {info['estimate_ms']} ms)")
+        return choice, info
+
+    def observe(self, model: str, data: Dict[str, Any]):
+        """记录一次生成的结束帧统计（Ollama 的耗时单位为纳秒）"""
+        eval_count = data.get('eval_count') or 0
+        eval_duration = data.get('eval_duration') or 0
+        prompt_count = data.get('prompt_eval_count') or 0
+        prompt_duration = data.get('prompt_eval_duration') or 0
+        load_duration = data.get('load_duration') or 0
+        with self._lock:
+            stats = self._stats.setdefault(model, ModelStats())
+            if eval_count and eval_duration:
+                stats.tokens_per_second = _ewma(stats.tokens_per_second, eval_count / (eval_duration / 1e9), self.alpha)
+                stats.samples += 1
+            # 命中 KV 缓存时只处理少量新 token，耗时主要是固定开销，不用于估计提示词速度
+            if prompt_count >= 32 and prompt_duration:
+                stats.prompt_tokens_per_second = _ewma(stats.prompt_tokens_per_second,
+                                                       prompt_count / (prompt_duration / 1e9), self.alpha)
+            # 模型已加载时 load_duration 只有几毫秒，超过 0.5 秒才视为一次冷加载
+            if load_duration > 5e8:
+                stats.load_ms = _ewma(stats.load_ms, load_duration / 1e6, self.alpha)
+            stats.updated_at = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'latency_target_ms': self.latency_target_ms,
+                'models': {model: stats.stats() for model, stats in self._stats.items()},
+                'kinds': dict(self._kinds),
+                'recent': list(self._recent)[-10:]
+            }
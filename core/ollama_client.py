@@ -0,0 +1,376 @@
+import time
+import random
+import logging
+import weakref
+import threading
+from typing import Dict, Any, List, Callable, Optional, Set
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class Backend:
+    """单个 Ollama 实例的状态：已安装/已加载的模型、进行中的请求数、熔断器和统计"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.in_flight = 0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        # None 表示尚未获取到模型列表（启动时或后端一直不可达）
+        self.models: Optional[Set[str]] = None
+        # 已加载的模型，最近使用的在前；数量不超过 /api/ps 中观察到的最大同时加载数
+        self.loaded: List[str] = []
+        self.max_loaded = 1
+        self.requests = 0
+        self.failures = 0
+        self.latency_ms = 0.0  # 响应头到达耗时的指数移动平均
+        self.tags_latency_ms: Optional[float] = None
+        self.last_error = ''
+        self.checked_at = 0.0
+
+    def tier(self, model: Optional[str]) -> int:
+        """模型亲和度：0 已加载，1 已安装，2 未知，3 未安装"""
+        if not model:
+            return 0
+        if model in self.loaded:
+            return 0
+        if self.models is None:
+            return 2
+        return 1 if model in self.models else 3
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'state': self.state,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'latency_ms': round(self.latency_ms, 1),
+            'tags_latency_ms': self.tags_latency_ms,
+            'models': sorted(self.models) if self.models is not None else None,
+            'loaded': list(self.loaded),
+            'last_error': self.last_error,
+            'checked_at': self.checked_at
+        }
+
+
+class OllamaPool:
+    """多个 Ollama 实例组成的后端池
+
+    按模型亲和度（优先已加载该模型的实例，避免冷加载）和进行中的请求数选择后端；
+    连接失败和与模型无关的 5xx 计入熔断器，连续失败后暂停使用该后端，冷却后放行一个试探请求；
+    最后一个可用的后端不熔断（熔断后所有请求都会直接失败）。
+    请求在收到响应头之前失败时自动换下一个后端重试
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self._backends: Dict[str, Backend] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._refreshed_at = 0.0
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._legacy_embed = False
+        self.apply_config(config)
+
+    def apply_config(self, config: Dict[str, Any]):
+        """应用配置；保留仍在列表中的后端的状态和统计"""
+        ollama_config = config['ollama']
+        urls = ollama_config.get('base_urls') or [ollama_config['base_url']]
+        self.connect_timeout = ollama_config.get('connect_timeout', 3)
+        self.failure_threshold = ollama_config.get('failure_threshold', 3)
+        self.cooldown = ollama_config.get('circuit_cooldown', 30)
+        self.refresh_interval = ollama_config.get('refresh_interval', 10)
+        self.affinity_weight = ollama_config.get('affinity_weight', 4)
+        with self._lock:
+            backends = {}
+            for url in urls:
+                url = url.rstrip('/')
+                backends[url] = self._backends.get(url) or Backend(url)
+            self._backends = backends
+        logger.info(f"Ollama 后端: {', '.join(backends)}")
+
+    @property
+    def backends(self) -> List[Backend]:
+        with self._lock:
+            return list(self._backends.values())
+
+    def _session(self) -> requests.Session:
+        """每个线程一个 Session，复用到各后端的连接"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    # ---- 后端选择与熔断 ----
+
+    def _available(self, backend: Backend, now: float) -> bool:
+        if backend.state == OPEN and now - backend.opened_at >= self.cooldown:
+            backend.state = HALF_OPEN
+        if backend.state == HALF_OPEN:
+            # 半开状态只放行一个试探请求
+            return backend.in_flight == 0
+        return backend.state == CLOSED
+
+    def _acquire(self, model: Optional[str], exclude: Set[str]) -> Optional[Backend]:
+        """选择后端并占用一个进行中的请求名额"""
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self._backends.values()
+                          if b.url not in exclude and self._available(b, now)]
+            if not candidates:
+                return None
+            # 未加载该模型的后端按多 affinity_weight 个进行中请求计算，避免为均衡负载频繁冷加载；
+            # 明确没有安装该模型的后端只在没有其他选择时使用
+            best = min(candidates, key=lambda b: (b.tier(model) == 3,
+                                                  b.in_flight + (self.affinity_weight if b.tier(model) else 0),
+                                                  random.random()))
+            best.in_flight += 1
+            best.requests += 1
+            return best
+
+    def _release(self, backend: Backend):
+        with self._lock:
+            backend.in_flight -= 1
+
+    def _record_success(self, backend: Backend, model: Optional[str] = None, latency_ms: Optional[float] = None):
+        with self._lock:
+            if backend.state != CLOSED:
+                logger.info(f"Ollama 后端 {backend.url} 已恢复")
+            backend.state = CLOSED
+            backend.consecutive_failures = 0
+            if latency_ms is not None:
+                backend.latency_ms = latency_ms if not backend.latency_ms else backend.latency_ms * 0.8 + latency_ms * 0.2
+            if model:
+                # 成功处理过的模型视为已加载在该后端上，并按 Ollama 的方式挤出最久未用的模型
+                if model in backend.loaded:
+                    backend.loaded.remove(model)
+                backend.loaded.insert(0, model)
+                del backend.loaded[backend.max_loaded:]
+
+    def _record_failure(self, backend: Backend, error: str, count: bool = True):
+        """记录失败；count 为 False 时只计入统计，不计入熔断器（后端本身正常，如生成超时、模型加载失败）"""
+        with self._lock:
+            backend.failures += 1
+            backend.last_error = error
+            if not count:
+                return
+            backend.consecutive_failures += 1
+            if backend.state == HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+                if not any(b is not backend and b.state == CLOSED for b in self._backends.values()):
+                    # 没有其他可用的后端，熔断只会让所有请求直接失败，继续尝试该后端
+                    backend.state = CLOSED
+                    return
+                if backend.state != OPEN:
+                    logger.warning(f"Ollama 后端 {backend.url} 熔断 {self.cooldown} 秒: {error}")
+                backend.state = OPEN
+                backend.opened_at = time.time()
+
+    # ---- 请求 ----
+
+    def request(self, method: str, path: str, model: Optional[str] = None, stream: bool = False,
+                timeout: float = 60, **kwargs) -> requests.Response:
+        """向选中的后端发送请求，返回 requests.Response
+
+        流式响应在关闭（或被回收）前一直计入该后端的进行中请求数，调用方应在读取完毕后关闭响应。
+        所有后端都不可用时抛出 requests.exceptions.ConnectionError
+        """
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self._acquire(model, tried)
+            if backend is None:
+                break
+            tried.add(backend.url)
+            start = time.perf_counter()
+            try:
+                response = self._session().request(method, f"{backend.url}{path}", stream=stream,
+                                                   timeout=(self.connect_timeout, timeout), **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._release(backend)
+                # 读取超时说明后端已接受请求、只是处理较慢（如长时间生成），不计入熔断器；
+                # 换后端重试只会重复计算
+                read_timeout = isinstance(e, requests.exceptions.ReadTimeout)
+                self._record_failure(backend, f"{e.__class__.__name__}", count=not read_timeout)
+                if read_timeout:
+                    raise
+                last_error = e
+                continue
+
+            latency_ms = (time.perf_counter() - start) * 1000
+            if response.status_code >= 500:
+                # 指定模型的请求返回 5xx 多为该模型的问题（如加载时显存不足），不计入熔断器，
+                # 但仍换其他后端重试
+                self._record_failure(backend, f"HTTP {response.status_code}", count=model is None)
+                if self._has_alternative(tried):
+                    response.close()
+                    self._release(backend)
+                    continue
+            else:
+                self._record_success(backend, model if response.status_code == 200 else None, latency_ms)
+
+            if not stream:
+                self._release(backend)
+                return response
+            self._track(response, backend)
+            return response
+
+        raise requests.exceptions.ConnectionError(
+            f"没有可用的 Ollama 后端{f' ({last_error.__class__.__name__})' if last_error else ''}")
+
+    def _has_alternative(self, tried: Set[str]) -> bool:
+        now = time.time()
+        with self._lock:
+            return any(b.url not in tried and self._available(b, now) for b in self._backends.values())
+
+    def _track(self, response: requests.Response, backend: Backend):
+        """流式响应关闭时释放后端名额；调用方未关闭时在响应被回收时释放"""
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self._release(backend)
+
+        # 通过弱引用调用原 close，避免响应对象与替换的 close 之间形成引用环而推迟回收
+        response_ref = weakref.ref(response)
+        original_close = type(response).close
+
+        def close():
+            try:
+                current = response_ref()
+                if current is not None:
+                    original_close(current)
+            finally:
+                release()
+
+        response.close = close
+        weakref.finalize(response, release)
+
+    def subscribe(self, callback: Callable[[str, Dict[str, Any]], None]):
+        """注册生成统计回调，参数为模型名和 Ollama 结束帧（含 eval_count、eval_duration 等）"""
+        self._listeners.append(callback)
+
+    def record_stats(self, model: str, data: Dict[str, Any]):
+        """调用方读到生成结束帧（流式 done 帧或非流式响应）时上报其计时统计"""
+        if not model or not data.get('eval_count'):
+            return
+        for callback in list(self._listeners):
+            try:
+                callback(model, data)
+            except Exception as e:
+                logger.error(f"处理生成统计失败: {str(e)}")
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def embed(self, model: str, texts: List[str], timeout: float = 60) -> List[List[float]]:
+        """批量计算嵌入向量（/api/embed，旧版本 Ollama 回退到逐条调用 /api/embeddings）"""
+        if not self._legacy_embed:
+            response = self.post('/api/embed', model=model, timeout=timeout,
+                                 json={'model': model, 'input': texts})
+            if response.status_code == 404 and 'model' not in response.text:
+                # 旧版本 Ollama 没有 /api/embed
+                self._legacy_embed = True
+            else:
+                response.raise_for_status()
+                return response.json()['embeddings']
+        vectors = []
+        for text in texts:
+            response = self.post('/api/embeddings', model=model, timeout=timeout,
+                                 json={'model': model, 'prompt': text})
+            response.raise_for_status()
+            vectors.append(response.json()['embedding'])
+        return vectors
+
+    # ---- 模型列表与健康检查 ----
+
+    def refresh(self) -> List[Dict[str, Any]]:
+        """检查所有后端（包括熔断中的）：获取已安装和已加载的模型，成功则关闭熔断器"""
+        for backend in self.backends:
+            start = time.perf_counter()
+            try:
+                session = self._session()
+                response = session.get(f"{backend.url}/api/tags", timeout=(self.connect_timeout, self.connect_timeout))
+                response.raise_for_status()
+                latency_ms = round((time.perf_counter() - start) * 1000, 1)
+                models = {m.get('name', '') for m in response.json().get('models', [])}
+                loaded = []
+                try:
+                    ps = session.get(f"{backend.url}/api/ps", timeout=(self.connect_timeout, self.connect_timeout))
+                    if ps.status_code == 200:
+                        loaded = [m.get('name', '') for m in ps.json().get('models', [])]
+                except requests.exceptions.RequestException:
+                    pass
+                with self._lock:
+                    backend.models = models
+                    # 保留本地记录的使用顺序
+                    backend.loaded = sorted(loaded, key=lambda m: backend.loaded.index(m)
+                                            if m in backend.loaded else len(backend.loaded))
+                    backend.max_loaded = max(backend.max_loaded, len(loaded))
+                    backend.tags_latency_ms = latency_ms
+                    backend.checked_at = time.time()
+                self._record_success(backend)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                with self._lock:
+                    backend.tags_latency_ms = None
+                    backend.checked_at = time.time()
+                self._record_failure(backend, e.__class__.__name__)
+        self._refreshed_at = time.time()
+        return self.stats()
+
+    def list_models(self) -> Optional[List[str]]:
+        """各可用后端已安装模型的并集；从未成功获取过模型列表时返回 None"""
+        if time.time() - self._refreshed_at > self.refresh_interval and self._thread is None:
+            self.refresh()
+        now = time.time()
+        models: Set[str] = set()
+        known = False
+        with self._lock:
+            for backend in self._backends.values():
+                if backend.models is not None and (backend.state != OPEN or now - backend.opened_at >= self.cooldown):
+                    models |= backend.models
+                    known = True
+        return sorted(models) if known else None
+
+    def available(self) -> bool:
+        now = time.time()
+        with self._lock:
+            return any(self._available(b, now) for b in self._backends.values())
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [backend.stats() for backend in self._backends.values()]
+
+    def start(self):
+        """后台定期刷新各后端的模型列表和健康状态"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='ollama-pool', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"刷新 Ollama 后端状态失败: {str(e)}")
+            if self._stop_event.wait(self.refresh_interval):
+                break
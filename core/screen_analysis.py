@@ -0,0 +1,41 @@
+import time
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ScreenAnalyzer:
+    """服务端截图分析流水线：截图 → 预处理 → 视觉分析，图片始终以 PIL/bytes 形式留在内存中"""
+
+    def __init__(self, system_controller, vision_processor):
+        self.system_controller = system_controller
+        self.vision_processor = vision_processor
+
+    def analyze(self, prompt: str = "描述屏幕上的内容", resolution: str = 'auto',
+                monitor: Optional[int] = None, region=None, active_window: bool = False) -> Dict[str, Any]:
+        """截取屏幕（或指定显示器、区域、活动窗口）并分析，返回分析结果和各阶段耗时"""
+        start_time = time.perf_counter()
+        try:
+            image = self.system_controller.capture_screen(monitor, region, active_window)
+        except Exception as e:
+            logger.error(f"截图失败: {str(e)}")
+            return {'success': False, 'error': f"截图失败: {str(e)}"}
+        capture_ms = round((time.perf_counter() - start_time) * 1000, 1)
+
+        result = self.vision_processor.analyze_pil_image(image, prompt, resolution)
+
+        timing = {'capture_ms': capture_ms}
+        timing.update(result.get('timing', {}))
+        timing['total_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+        logger.info(f"截图分析完成，耗时: {timing}")
+
+        return {
+            'success': result.get('success', False),
+            'analysis': result['analysis'],
+            'description': result['description'],
+            'cache': result.get('cache', {'hit': False}),
+            'resolution': result.get('resolution', {'mode': 'single'}),
+            'screen': {'width': image.width, 'height': image.height},
+            'timing': timing
+        }
@@ -0,0 +1,327 @@
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+WATCH_PROMPT = """你正在持续监视用户的屏幕，下面是屏幕上发生变化的{scope}。
+用户关注的内容：{prompt}
+{previous}请简要说明发生了什么变化，只描述与用户关注内容相关的部分。如果变化无关紧要，请回答“无明显变化”。"""
+
+
+class FrameDiffer:
+    """分块帧差：灰度帧写入复用的 NumPy 缓冲区，按块统计变化像素比例"""
+
+    def __init__(self, block_size: int = 32, pixel_threshold: int = 24, block_threshold: float = 0.02,
+                 scale: int = 2):
+        self.block_size = block_size
+        self.pixel_threshold = pixel_threshold
+        # 块内变化像素超过该比例才算变化块，过滤光标闪烁和抗锯齿噪声
+        self.block_threshold = block_threshold
+        self.scale = max(1, scale)
+        self._shape = None
+        self._diff = None
+        self._mask = None
+
+    def _allocate(self, shape: Tuple[int, int]):
+        self._shape = shape
+        self._diff = np.empty(shape, dtype=np.int16)
+        self._mask = np.empty(shape, dtype=bool)
+
+    def load(self, image: Image.Image, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """将帧转为缩小后的灰度数组，尺寸不变时写入 out 复用内存"""
+        gray = image.convert('L')
+        if self.scale > 1:
+            gray = gray.reduce(self.scale)
+        array = np.asarray(gray)
+        if out is not None and out.shape == array.shape:
+            np.copyto(out, array)
+            return out
+        return array.copy()
+
+    def diff(self, current: np.ndarray, reference: np.ndarray) -> Dict[str, Any]:
+        """比较两帧，返回变化块比例和合并后的变化区域（原图坐标）"""
+        if current.shape != reference.shape:
+            # 分辨率变化视为整屏变化
+            height, width = current.shape
+            full = (0, 0, width * self.scale, height * self.scale)
+            return {'ratio': 1.0, 'blocks': -1, 'regions': [full], 'bbox': full}
+
+        if self._shape != current.shape:
+            self._allocate(current.shape)
+
+        np.subtract(current, reference, out=self._diff, dtype=np.int16)
+        np.abs(self._diff, out=self._diff)
+        np.greater(self._diff, self.pixel_threshold, out=self._mask)
+
+        size = self.block_size
+        height, width = current.shape
+        rows, cols = height // size, width // size
+        blocks = self._mask[:rows * size, :cols * size].reshape(rows, size, cols, size).mean(axis=(1, 3))
+        changed = blocks > self.block_threshold
+
+        count = int(changed.sum())
+        regions = self._regions(changed) if count else []
+        bbox = None
+        if regions:
+            bbox = (min(r[0] for r in regions), min(r[1] for r in regions),
+                    max(r[2] for r in regions), max(r[3] for r in regions))
+        return {
+            'ratio': count / max(1, rows * cols),
+            'blocks': count,
+            'regions': regions,
+            'bbox': bbox
+        }
+
+    def _regions(self, changed: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """对变化块做连通域合并，返回 (left, top, right, bottom) 列表"""
+        rows, cols = changed.shape
+        seen = np.zeros_like(changed)
+        unit = self.block_size * self.scale
+        regions = []
+        for row, col in zip(*np.nonzero(changed)):
+            if seen[row, col]:
+                continue
+            stack = [(row, col)]
+            seen[row, col] = True
+            top, left, bottom, right = row, col, row, col
+            while stack:
+                r, c = stack.pop()
+                top, left = min(top, r), min(left, c)
+                bottom, right = max(bottom, r), max(right, c)
+                # 八邻域，斜向相邻的变化块也合并为同一区域
+                for dr in (-1, 0, 1):
+                    for dc in (-1, 0, 1):
+                        nr, nc = r + dr, c + dc
+                        if 0 <= nr < rows and 0 <= nc < cols and changed[nr, nc] and not seen[nr, nc]:
+                            seen[nr, nc] = True
+                            stack.append((nr, nc))
+            regions.append((int(left * unit), int(top * unit), int((right + 1) * unit), int((bottom + 1) * unit)))
+        return regions
+
+
+class ScreenWatcher:
+    """屏幕监视：按固定频率截图，画面稳定后只把变化区域发送给视觉模型"""
+
+    def __init__(self, watch_id: str, system_controller, vision_processor, options: Dict[str, Any],
+                 on_event: Callable[[Dict[str, Any]], None]):
+        self.watch_id = watch_id
+        self.system_controller = system_controller
+        self.vision_processor = vision_processor
+        self.on_event = on_event
+        self.prompt = options.get('prompt') or '屏幕内容的变化'
+        self.interval = options['interval']
+        self.debounce = options['debounce']
+        self.max_wait = options['max_wait']
+        self.cooldown = options['cooldown']
+        self.min_change_ratio = options['min_change_ratio']
+        self.region_max_ratio = options['region_max_ratio']
+        self.target = {
+            'monitor': options.get('monitor'),
+            'region': options.get('region'),
+            'active_window': options.get('active_window', False)
+        }
+        self.differ = FrameDiffer(options['block_size'], options['pixel_threshold'],
+                                  options['block_threshold'], options['diff_scale'])
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'screen-watch-{watch_id[:8]}', daemon=True)
+        self._last_analysis = ''
+        self.stats = {'frames': 0, 'changes': 0, 'analyses': 0, 'skipped_frames': 0, 'diff_ms': 0.0}
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive() and not self._stop_event.is_set()
+
+    def _emit(self, event: Dict[str, Any]):
+        event['watch_id'] = self.watch_id
+        try:
+            self.on_event(event)
+        except Exception as e:
+            logger.warning(f"推送监视事件失败: {str(e)}")
+
+    def _run(self):
+        # baseline 为上一次分析时的画面，previous 为上一帧；两块缓冲区交替复用
+        baseline = previous = current = None
+        pending_since = None
+        last_change = 0.0
+        last_analysis_at = 0.0
+
+        self._emit({'type': 'started', 'interval': self.interval})
+        try:
+            while not self._stop_event.is_set():
+                tick = time.perf_counter()
+                try:
+                    image = self.system_controller.capture_screen(**self.target)
+                except Exception as e:
+                    logger.error(f"屏幕监视截图失败: {str(e)}")
+                    self._emit({'type': 'error', 'error': f"截图失败: {str(e)}"})
+                    break
+
+                diff_start = time.perf_counter()
+                current = self.differ.load(image, out=current)
+                self.stats['frames'] += 1
+
+                if baseline is None:
+                    baseline = current.copy()
+                    current, previous = previous, current
+                    self._wait(tick)
+                    continue
+
+                motion = self.differ.diff(current, previous)
+                self.stats['diff_ms'] = round((time.perf_counter() - diff_start) * 1000, 2)
+                now = time.monotonic()
+
+                if motion['ratio'] >= self.min_change_ratio:
+                    self.stats['changes'] += 1
+                    last_change = now
+                    if pending_since is None:
+                        pending_since = now
+                        self._emit({'type': 'change', 'ratio': round(motion['ratio'], 4),
+                                    'regions': motion['regions']})
+                else:
+                    self.stats['skipped_frames'] += 1
+
+                # 画面稳定 debounce 秒后分析；持续变化时（如滚动日志）最多等待 max_wait 秒
+                settled = pending_since is not None and (
+                    now - last_change >= self.debounce or now - pending_since >= self.max_wait)
+                if settled and now - last_analysis_at >= self.cooldown:
+                    change = self.differ.diff(current, baseline)
+                    if change['ratio'] >= self.min_change_ratio:
+                        self._analyze(image, change)
+                        last_analysis_at = time.monotonic()
+                    if baseline.shape == current.shape:
+                        np.copyto(baseline, current)
+                    else:
+                        baseline = current.copy()
+                    pending_since = None
+
+                current, previous = previous, current
+                self._wait(tick)
+        except Exception as e:
+            logger.error(f"屏幕监视异常: {str(e)}")
+            self._emit({'type': 'error', 'error': f"屏幕监视异常: {str(e)}"})
+        self._emit({'type': 'stopped', 'stats': dict(self.stats)})
+
+    def _wait(self, tick: float):
+        elapsed = time.perf_counter() - tick
+        self._stop_event.wait(max(0.0, self.interval - elapsed))
+
+    def _analyze(self, image: Image.Image, change: Dict[str, Any]):
+        """裁剪变化区域（变化面积较大时发送整帧）并调用视觉模型"""
+        left, top, right, bottom = change['bbox']
+        area_ratio = (right - left) * (bottom - top) / float(image.width * image.height)
+        if area_ratio <= self.region_max_ratio:
+            # 向外扩展一圈，给模型保留上下文
+            pad = self.differ.block_size * self.differ.scale
+            box = (max(0, left - pad), max(0, top - pad),
+                   min(image.width, right + pad), min(image.height, bottom + pad))
+            frame = image.crop(box)
+            scope = '区域'
+        else:
+            box = (0, 0, image.width, image.height)
+            frame = image
+            scope = '整个画面'
+
+        previous = f"上一次的观察：{self._last_analysis[:500]}\n" if self._last_analysis else ''
+        prompt = WATCH_PROMPT.format(scope=scope, prompt=self.prompt, previous=previous)
+        result = self.vision_processor.analyze_pil_image(frame, prompt, 'auto')
+        self.stats['analyses'] += 1
+
+        if not result.get('success'):
+            self._emit({'type': 'error', 'error': result.get('analysis', '分析失败')})
+            return
+        self._last_analysis = result['analysis']
+        self._emit({
+            'type': 'analysis',
+            'analysis': result['analysis'],
+            'ratio': round(change['ratio'], 4),
+            'box': list(box),
+            'cropped': scope == '区域',
+            'cache': result.get('cache', {'hit': False}),
+            'timing': result.get('timing', {})
+        })
+
+
+class ScreenWatchManager:
+    """管理各客户端的屏幕监视任务"""
+
+    OPTION_KEYS = ('interval', 'debounce', 'max_wait', 'cooldown', 'min_change_ratio', 'region_max_ratio',
+                   'block_size', 'pixel_threshold', 'block_threshold', 'diff_scale')
+    # 允许为 0 的参数（立即分析、不限制分析间隔），其余参数必须为正数
+    NON_NEGATIVE_KEYS = ('debounce', 'cooldown')
+
+    def __init__(self, config: Dict[str, Any], system_controller, vision_processor):
+        self.defaults = dict(config.get('watch', {}))
+        self.max_watches = self.defaults.pop('max_watches', 2)
+        self.min_interval = self.defaults.pop('min_interval', 0.5)
+        self.system_controller = system_controller
+        self.vision_processor = vision_processor
+        self._watches: Dict[str, Tuple[str, ScreenWatcher]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, owner: str, options: Dict[str, Any],
+              on_event: Callable[[Dict[str, Any]], None]) -> str:
+        """启动监视，返回监视 ID"""
+        merged = dict(self.defaults)
+        for key in self.OPTION_KEYS:
+            if options.get(key) is not None:
+                merged[key] = type(self.defaults[key])(options[key])
+            value = merged[key]
+            if not (value >= 0 if key in self.NON_NEGATIVE_KEYS else value > 0):
+                raise ValueError(f"监视参数 {key} 无效: {value}")
+        merged['interval'] = max(self.min_interval, merged['interval'])
+        for key in ('prompt', 'monitor', 'region', 'active_window'):
+            if options.get(key) is not None:
+                merged[key] = options[key]
+
+        with self._lock:
+            self._prune()
+            if len(self._watches) >= self.max_watches:
+                raise RuntimeError(f"同时进行的屏幕监视不能超过 {self.max_watches} 个")
+            watch_id = uuid.uuid4().hex
+            watcher = ScreenWatcher(watch_id, self.system_controller, self.vision_processor, merged, on_event)
+            self._watches[watch_id] = (owner, watcher)
+        watcher.start()
+        logger.info(f"开始屏幕监视 {watch_id}，间隔 {merged['interval']} 秒")
+        return watch_id
+
+    def stop(self, watch_id: str, owner: Optional[str] = None) -> bool:
+        with self._lock:
+            entry = self._watches.get(watch_id)
+            if entry is None or (owner is not None and entry[0] != owner):
+                return False
+            del self._watches[watch_id]
+        entry[1].stop()
+        logger.info(f"停止屏幕监视 {watch_id}")
+        return True
+
+    def stop_owner(self, owner: str):
+        """停止某个客户端的所有监视"""
+        with self._lock:
+            watch_ids = [watch_id for watch_id, (o, _) in self._watches.items() if o == owner]
+        for watch_id in watch_ids:
+            self.stop(watch_id)
+
+    def _prune(self):
+        """移除已自行结束的监视（调用方持有锁）"""
+        for watch_id in [w for w, (_, watcher) in self._watches.items() if not watcher.running]:
+            del self._watches[watch_id]
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._prune()
+            return [{'watch_id': watch_id, 'prompt': watcher.prompt, 'interval': watcher.interval,
+                     'stats': dict(watcher.stats)}
+                    for watch_id, (_, watcher) in self._watches.items()]
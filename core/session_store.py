@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def lean_message(message: Dict[str, Any], limit: int) -> Dict[str, Any]:
+    """截断工具消息的内容（可能包含 base64 截图），只用于返回给客户端"""
+    content = message.get('content')
+    if message.get('role') != 'tool' or not isinstance(content, str) or len(content) <= limit:
+        return message
+    return dict(message, content=content[:limit] + f'...（已省略 {len(content) - limit} 字符）', truncated=True)
+
+
+class SessionStore:
+    """对话历史存储（SQLite，WAL 模式），多个工作进程共享同一份会话状态"""
+
+    def __init__(self, config: Dict[str, Any]):
+        webui_config = config.get('webui', {})
+        self.path = webui_config.get('session_db', os.path.join('cache', 'sessions.db'))
+        self._local = threading.local()
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id, id)')
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: str, limit: int = 0) -> List[Dict[str, Any]]:
+        """按顺序返回用户的对话历史，limit > 0 时只返回最近的消息"""
+        conn = self._conn()
+        if limit > 0:
+            rows = conn.execute('SELECT message FROM (SELECT id, message FROM messages WHERE user_id = ? '
+                                'ORDER BY id DESC LIMIT ?) ORDER BY id', (user_id, limit)).fetchall()
+        else:
+            rows = conn.execute('SELECT message FROM messages WHERE user_id = ? ORDER BY id',
+                                (user_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def since(self, user_id: str, cursor: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """返回游标之后的新消息和新的游标（消息 ID），用于客户端增量同步"""
+        rows = self._conn().execute('SELECT id, message FROM messages WHERE user_id = ? AND id > ? ORDER BY id',
+                                    (user_id, cursor)).fetchall()
+        return [json.loads(row[1]) for row in rows], (rows[-1][0] if rows else cursor)
+
+    def append(self, user_id: str, message: Dict[str, Any]):
+        self.extend(user_id, [message])
+
+    def extend(self, user_id: str, messages: List[Dict[str, Any]]):
+        """追加多条消息（如 Agent 的工具调用和结果）"""
+        if not messages:
+            return
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT INTO messages (user_id, message, created_at) VALUES (?, ?, ?)',
+                             [(user_id, json.dumps(m, ensure_ascii=False), now) for m in messages])
+
+    def clear(self, user_id: str):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
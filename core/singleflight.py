@@ -0,0 +1,163 @@
+import copy
+import json
+import hashlib
+import logging
+import threading
+import contextvars
+import weakref
+from typing import Dict, Any, Callable, Generator, Hashable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 所有合并组，用于汇总统计
+_groups: "weakref.WeakSet[SingleFlight]" = weakref.WeakSet()
+
+
+def digest(*parts) -> str:
+    """把调用参数（消息列表、图片哈希、提示词等）转换为定长的合并键"""
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    """进行中的普通调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class _Stream:
+    """进行中的流式调用：已产生的片段全部缓冲，后加入的调用方先读缓冲再等待新片段"""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+
+class SingleFlight:
+    """合并并发的相同调用：同一个键同时只执行一次，等待中的调用方共享结果
+
+    只合并正在执行的调用，执行结束后立即移除，不缓存结果。
+    普通调用用 do()，结果为字典等可变对象时其他调用方拿到浅拷贝；
+    流式调用用 stream()，由后台线程读取原生成器，所有调用方都从共享缓冲中读取，
+    全部调用方都离开后停止读取原生成器
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _Stream] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+        _groups.add(self)
+
+    def _count(self, leader: bool):
+        self.calls += 1
+        if not leader:
+            self.shared += 1
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """执行 fn 并返回结果；相同键的调用正在执行时等待并共享其结果（或异常）"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            self._count(leader)
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.copy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stream(self, key: Hashable, fn: Callable[[], Iterable[Any]]) -> Generator[Any, None, None]:
+        """流式执行 fn 返回的生成器；相同键的流正在进行时从头重放已缓冲的片段再接收新片段"""
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Stream()
+                self._streams[key] = flight
+            flight.subscribers += 1
+            self._count(leader)
+
+        if leader:
+            # 复制上下文以沿用请求 ID
+            threading.Thread(target=contextvars.copy_context().run, args=(self._pump, key, flight, fn),
+                             name=f'singleflight-{self.name}', daemon=True).start()
+
+        index = 0
+        try:
+            while True:
+                with flight.condition:
+                    while index >= len(flight.chunks) and not flight.done:
+                        flight.condition.wait()
+                    chunks = flight.chunks[index:]
+                    done = flight.done
+                for chunk in chunks:
+                    yield chunk
+                index += len(chunks)
+                if done:
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+
+    def _pump(self, key: Hashable, flight: _Stream, fn: Callable[[], Iterable[Any]]):
+        iterator = None
+        try:
+            iterator = iter(fn())
+            for chunk in iterator:
+                with flight.condition:
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+                if flight.subscribers == 0:
+                    logger.info(f"[{self.name}] 调用方均已离开，停止生成")
+                    break
+        except Exception as e:
+            logger.error(f"[{self.name}] 合并的流式调用失败: {str(e)}")
+            flight.error = e
+        finally:
+            if iterator is not None and hasattr(iterator, 'close'):
+                iterator.close()
+            with self._lock:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'shared': self.shared,
+                'coalesce_rate': round(self.shared / self.calls, 3) if self.calls else 0.0,
+                'in_flight': len(self._calls) + len(self._streams)
+            }
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """各合并组的调用次数、共享结果的次数（合并率）和进行中的调用数"""
+    return {group.name: group.stats() for group in sorted(_groups, key=lambda g: g.name)}
@@ -0,0 +1,117 @@
+import os
+import glob
+import queue
+import logging
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from typing import Dict, Any
+
+from socketio import PubSubManager
+
+logger = logging.getLogger(__name__)
+
+
+def _load_authkey(directory: str) -> bytes:
+    """读取或创建各工作进程共享的认证密钥（仅当前用户可读）"""
+    path = os.path.join(directory, 'authkey')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32).hex().encode('ascii'))
+    except FileExistsError:
+        pass
+    with open(path, 'rb') as f:
+        key = f.read().strip()
+    if not key:
+        raise RuntimeError('消息总线认证密钥为空')
+    return key
+
+
+class LocalSocketManager(PubSubManager):
+    """本机多进程 Socket.IO 消息总线，无需 Redis 等外部服务
+
+    每个工作进程在本地回环地址监听一个端口并登记到共享目录，发布消息时
+    发送给所有已登记的进程（包括自身）。连接使用共享密钥认证。
+    """
+
+    name = 'local'
+
+    def __init__(self, directory: str, channel: str = 'flask-socketio', write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.authkey = _load_authkey(directory)
+        self._inbox: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._peers: Dict[str, Any] = {}
+        self._peers_lock = threading.Lock()
+        self._listener = None
+        self._registration = None
+
+    def initialize(self):
+        if not self.write_only:
+            self._listener = Listener(('127.0.0.1', 0), authkey=self.authkey)
+            port = self._listener.address[1]
+            self._registration = os.path.join(self.directory, f'{self.channel}.{self.host_id}.{port}.peer')
+            with open(self._registration, 'w') as f:
+                f.write(str(os.getpid()))
+            threading.Thread(target=self._accept_loop, name='socket-bus-accept', daemon=True).start()
+        super().initialize()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                # 认证失败的连接直接丢弃
+                logger.warning(f"消息总线连接被拒绝: {str(e)}")
+                continue
+            threading.Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+    def _receive(self, conn):
+        try:
+            while True:
+                self._inbox.put(conn.recv())
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _publish(self, data):
+        for path in glob.glob(os.path.join(self.directory, f'{self.channel}.*.peer')):
+            port = int(path.rsplit('.', 2)[1])
+            if not self._send(path, port, data):
+                # 对端进程已退出，移除登记
+                logger.info(f"移除失效的消息总线节点: {os.path.basename(path)}")
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _send(self, path: str, port: int, data) -> bool:
+        """通过缓存的连接发送，连接断开时重连一次"""
+        with self._peers_lock:
+            for attempt in range(2):
+                conn = self._peers.get(path)
+                try:
+                    if conn is None:
+                        conn = Client(('127.0.0.1', port), authkey=self.authkey)
+                        self._peers[path] = conn
+                    conn.send(data)
+                    return True
+                except (OSError, EOFError, AuthenticationError):
+                    self._peers.pop(path, None)
+                    if conn is not None:
+                        conn.close()
+            return False
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+    def close(self):
+        if self._registration:
+            try:
+                os.remove(self._registration)
+            except OSError:
+                pass
@@ -1,14 +1,19 @@
 import os
 import subprocess
 import psutil
-import pyautogui
 import json
 import logging
 import platform
 from datetime import datetime
-from io import BytesIO
 import base64
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+from .capture import ScreenCapture, Region
+from .image_pipeline import encode_screenshot
+from .metrics_sampler import MetricsSampler
+from .command_runner import CommandRunner, CommandRun, COMPLETED
+from .app_catalog import AppCatalog, BUILTIN_APPS
+from .singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -20,39 +25,39 @@ class SystemController:
         self.config = config
         self.allowed_commands = config['system'].get('allowed_commands', [])
         self.screenshot_quality = config['system'].get('screenshot_quality', 85)
+        self.screenshot_format = config['system'].get('screenshot_format', 'jpeg')
+        # 截图最长边，0 表示保持原始分辨率
+        self.screenshot_max_dimension = config['system'].get('screenshot_max_dimension', 0)
+        self.screenshot_grayscale = config['system'].get('screenshot_grayscale', False)
+        self.screen_capture = ScreenCapture(config)
+        self.metrics_sampler = MetricsSampler(config)
+        self.command_runner = CommandRunner(config)
         
-        # 根据平台设置安全命令白名单
-        if PLATFORM == 'Windows':
-            self.safe_commands = {
-                'notepad': 'notepad.exe',
-                'calc': 'calc.exe',
-                'cmd': 'cmd.exe',
-                'taskmgr': 'taskmgr.exe',
-                'mspaint': 'mspaint.exe',
-                'explorer': 'explorer.exe',
-                'control': 'control.exe',
-                'powershell': 'powershell.exe'
-            }
-        elif PLATFORM == 'Darwin':  # macOS
-            self.safe_commands = {
-                'notepad': ['open', '-a', 'TextEdit'],
-                'calc': ['open', '-a', 'Calculator'],
-                'mspaint': ['open', '-a', 'Preview'],
-                'explorer': ['open', '.'],
-                'control': ['open', '-a', 'System Preferences'],
-                'taskmgr': ['open', '-a', 'Activity Monitor'],
-                'terminal': ['open', '-a', 'Terminal']
-            }
-        else:  # Linux
-            self.safe_commands = {
-                'notepad': ['gedit'],
-                'calc': ['gnome-calculator'],
-                'mspaint': ['gimp'],
-                'explorer': ['nautilus', '.'],
-                'control': ['gnome-control-center'],
-                'taskmgr': ['gnome-system-monitor'],
-                'terminal': ['gnome-terminal']
-            }
+        self.app_catalog = AppCatalog(config)
+        # 采样线程未运行时，合并并发的系统信息查询
+        self.flights = SingleFlight('system')
+        
+        # 安全命令白名单：内置应用的启动命令
+        self.safe_commands = {name: command for name, (command, _) in BUILTIN_APPS.items()}
+    
+    def apply_config(self, config: Dict[str, Any]):
+        """应用重新加载的配置；截图后端、线程池大小等需重启生效"""
+        system_config = config['system']
+        self.config = config
+        self.allowed_commands = system_config.get('allowed_commands', [])
+        self.screenshot_quality = system_config.get('screenshot_quality', 85)
+        self.screenshot_format = system_config.get('screenshot_format', 'jpeg')
+        self.screenshot_max_dimension = system_config.get('screenshot_max_dimension', 0)
+        self.screenshot_grayscale = system_config.get('screenshot_grayscale', False)
+        
+        runner = self.command_runner
+        runner.timeout = system_config.get('command_timeout', runner.timeout)
+        runner.cpu_seconds = system_config.get('command_cpu_seconds', runner.cpu_seconds)
+        runner.max_output = system_config.get('command_max_output', runner.max_output)
+        
+        catalog = self.app_catalog
+        catalog.allowlist = system_config.get('app_allowlist', catalog.allowlist)
+        catalog.match_threshold = system_config.get('app_match_threshold', catalog.match_threshold)
     
     def execute_command(self, command: str) -> Dict[str, Any]:
         """执行系统命令（有限制）"""
@@ -94,32 +99,9 @@ class SystemController:
         # 检查是否是已知的安全命令
         elif command_lower in self.allowed_commands:
             try:
-                if PLATFORM == 'Windows':
-                    result = subprocess.run(
-                        command,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        timeout=10,
-                        creationflags=subprocess.CREATE_NO_WINDOW
-                    )
-                else:
-                    # macOS/Linux 不支持 creationflags
-                    result = subprocess.run(
-                        command,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                return {
-                    'success': True,
-                    'output': result.stdout,
-                    'error': result.stderr,
-                    'return_code': result.returncode
-                }
-            except subprocess.TimeoutExpired:
-                return {'success': False, 'error': '命令执行超时'}
+                run = self.command_runner.start(command)
+                run.wait(self.command_runner.timeout + 5)
+                return self.command_result(run)
             except Exception as e:
                 logger.error(f"执行命令失败: {str(e)}")
                 return {'success': False, 'error': str(e)}
@@ -130,25 +112,75 @@ class SystemController:
                 'error': f'命令 "{command}" 不在允许列表中'
             }
     
+    def start_command(self, command: str, on_event=None) -> CommandRun:
+        """异步执行白名单命令，输出逐行推送给 on_event"""
+        if not self.config['system'].get('allow_system_control', False):
+            raise PermissionError('系统控制功能已禁用')
+        if command.lower().strip() not in self.allowed_commands:
+            logger.warning(f"尝试执行未授权的命令: {command}")
+            raise PermissionError(f'命令 "{command}" 不在允许列表中')
+        return self.command_runner.start(command, on_event)
+    
+    @staticmethod
+    def command_result(run: CommandRun, partial: bool = False) -> Dict[str, Any]:
+        """将命令执行结果转换为 execute_command 的返回格式"""
+        summary = run.read_new() if partial else run.summary()
+        messages = {
+            'timeout': '命令执行超时',
+            'cpu_limit': '命令超过 CPU 时间限制',
+            'output_limit': '命令输出超过大小限制，已终止',
+            'cancelled': '命令已取消'
+        }
+        summary['success'] = summary['status'] in (COMPLETED, 'running', 'queued')
+        if summary['status'] in messages:
+            summary['error'] = '\n'.join(filter(None, [summary['error'], messages[summary['status']]]))
+        return summary
+    
+    def capture_screen(self, monitor: Optional[int] = None, region: Optional[Region] = None,
+                       active_window: bool = False):
+        """截取屏幕，返回内存中的 PIL 图片
+        
+        monitor 为显示器编号（从 1 开始），region 为 (x, y, 宽, 高)，都不指定时截取整个虚拟屏幕。
+        """
+        return self.screen_capture.capture(monitor, region, active_window)
+    
+    def capture_screenshot(self, fmt: Optional[str] = None, quality: Optional[int] = None,
+                           max_dimension: Optional[int] = None,
+                           grayscale: Optional[bool] = None,
+                           monitor: Optional[int] = None, region: Optional[Region] = None,
+                           active_window: bool = False) -> Dict[str, Any]:
+        """截取屏幕并按配置编码，参数为 None 时使用配置值"""
+        screenshot = self.capture_screen(monitor, region, active_window)
+        encoded = encode_screenshot(
+            screenshot,
+            fmt=fmt or self.screenshot_format,
+            quality=quality or self.screenshot_quality,
+            max_dimension=self.screenshot_max_dimension if max_dimension is None else max_dimension,
+            grayscale=self.screenshot_grayscale if grayscale is None else grayscale
+        )
+        logger.info(f"截图成功，{encoded['format']} {encoded['width']}x{encoded['height']}，"
+                    f"大小: {len(encoded['data'])} 字节，编码耗时: {encoded['elapsed_ms']:.1f}ms")
+        return encoded
+    
     def take_screenshot(self) -> str:
-        """截取屏幕"""
+        """截取屏幕，返回 base64 编码的图片"""
         try:
-            screenshot = pyautogui.screenshot()
-            
-            # 转换为base64
-            buffered = BytesIO()
-            screenshot.save(buffered, format="PNG", quality=self.screenshot_quality)
-            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            logger.info(f"截图成功，大小: {len(img_base64)} 字符")
-            return img_base64
+            encoded = self.capture_screenshot()
+            return base64.b64encode(encoded['data']).decode('utf-8')
             
         except Exception as e:
             logger.error(f"截图失败: {str(e)}")
             raise
     
     def get_system_info(self) -> Dict[str, Any]:
-        """获取系统信息"""
+        """获取系统信息，采样线程运行时直接返回最新样本"""
+        latest = self.metrics_sampler.latest()
+        if latest is not None:
+            return latest
+        return self.flights.do('system_info', self._collect_system_info)
+    
+    def _collect_system_info(self) -> Dict[str, Any]:
+        """直接通过 psutil 获取系统信息"""
         try:
             # CPU信息
             # 不使用 interval=1 避免阻塞，改用默认的上次采样
@@ -209,66 +241,34 @@ class SystemController:
             logger.error(f"获取系统信息失败: {str(e)}")
             return {'error': str(e)}
     
-    def get_available_apps(self) -> List[str]:
-        """获取可用的应用程序列表"""
-        apps = list(self.safe_commands.keys())
-        
-        # 根据平台添加本地化名称
-        if PLATFORM == 'Windows':
-            localized_apps = [
-                '记事本', '计算器', '画图', '资源管理器',
-                '控制面板', '任务管理器', '命令提示符', 'PowerShell'
-            ]
-        elif PLATFORM == 'Darwin':  # macOS
-            localized_apps = [
-                '文本编辑', '计算器', '预览', '访达',
-                '系统偏好设置', '活动监视器', '终端'
-            ]
-        else:  # Linux
-            localized_apps = [
-                '文本编辑器', '计算器', '图像编辑器', '文件管理器',
-                '系统设置', '系统监视器', '终端'
-            ]
-        
-        return apps + localized_apps
+    def get_top_processes(self, sort_by: str = 'cpu', limit: int = 5) -> Dict[str, Any]:
+        """获取占用最高的进程，sort_by 为 cpu、memory 或 io"""
+        try:
+            limit = max(1, min(int(limit), 50))
+            return self.metrics_sampler.top_processes(sort_by, limit)
+        except Exception as e:
+            logger.error(f"获取进程列表失败: {str(e)}")
+            return {'error': str(e)}
+    
+    def get_available_apps(self, query: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """获取可用的应用程序列表，指定 query 时按匹配度返回"""
+        if query:
+            return self.app_catalog.search(query, limit=limit)
+        return self.app_catalog.list_apps()
     
     def open_application(self, app_name: str) -> Dict[str, Any]:
-        """打开应用程序"""
-        # 根据平台设置本地化名称映射
-        if PLATFORM == 'Windows':
-            app_mapping = {
-                '记事本': 'notepad',
-                '计算器': 'calc',
-                '画图': 'mspaint',
-                '资源管理器': 'explorer',
-                '控制面板': 'control',
-                '任务管理器': 'taskmgr',
-                '命令提示符': 'cmd',
-                'PowerShell': 'powershell'
-            }
-        elif PLATFORM == 'Darwin':  # macOS
-            app_mapping = {
-                '文本编辑': 'notepad',
-                '计算器': 'calc',
-                '预览': 'mspaint',
-                '访达': 'explorer',
-                '系统偏好设置': 'control',
-                '活动监视器': 'taskmgr',
-                '终端': 'terminal'
-            }
-        else:  # Linux
-            app_mapping = {
-                '文本编辑器': 'notepad',
-                '计算器': 'calc',
-                '图像编辑器': 'mspaint',
-                '文件管理器': 'explorer',
-                '系统设置': 'control',
-                '系统监视器': 'taskmgr',
-                '终端': 'terminal'
-            }
+        """打开应用程序（按名称、本地化名称或拼音匹配应用索引）"""
+        if not self.config['system'].get('allow_system_control', False):
+            return {'success': False, 'error': '系统控制功能已禁用'}
         
-        # 转换本地化名称
-        if app_name in app_mapping:
-            app_name = app_mapping[app_name]
+        app = self.app_catalog.resolve(app_name)
+        if app is None:
+            candidates = self.app_catalog.search(app_name)
+            return {
+                'success': False,
+                'error': f'未找到应用程序 "{app_name}"',
+                'candidates': candidates
+            }
         
-        return self.execute_command(app_name)
\ No newline at end of file
+        logger.info(f"打开应用程序: {app_name} -> {app['id']}")
+        return self.app_catalog.launch(app)
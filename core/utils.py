@@ -1,24 +1,9 @@
-import logging
-import os
-from datetime import datetime
 from typing import Dict, Any
 
-def setup_logging():
-    """设置日志配置"""
-    log_dir = 'logs'
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
-    log_file = os.path.join(log_dir, f'localai_{datetime.now().strftime("%Y%m%d")}.log')
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
+def setup_logging(config: Dict[str, Any] = None):
+    """设置日志配置（队列异步写入、按日期和大小轮转，见 core/logging_setup.py）"""
+    from .logging_setup import configure_logging
+    configure_logging(config)
 
 def validate_config(config: Dict[str, Any]) -> Dict[str, Any]:
     """验证和填充配置"""
@@ -26,20 +11,168 @@ def validate_config(config: Dict[str, Any]) -> Dict[str, Any]:
         'webui': {
             'host': '127.0.0.1',
             'port': 7860,
-            'debug': False
+            'debug': False,
+            'workers': 0,  # 生产模式工作进程数，0 表示按 CPU 核数自动选择
+            'threads': 32,  # 每个工作进程的线程数
+            'message_queue': 'local',  # 多进程 Socket.IO 消息队列：local（本机）或 redis:// 等地址
+            'message_queue_dir': 'cache/socket_bus',
+            'session_db': 'cache/sessions.db',
+            'chat_tool_preview': 500  # 增量返回对话时工具消息保留的字符数
         },
         'ollama': {
             'base_url': 'http://localhost:11434',
             'default_model': 'qwen3:8b',
             'vision_model': 'qwen3-vl:8b',
-            'code_model': 'qwen2.5-coder:7b'
+            'code_model': 'qwen2.5-coder:7b',
+            'base_urls': [],  # 多个 Ollama 实例地址，为空时只使用 base_url
+            'connect_timeout': 3,  # 连接超时（秒），不可达的后端尽快切换
+            'failure_threshold': 3,  # 连续失败次数达到后熔断该后端
+            'circuit_cooldown': 30,  # 熔断后多久放行试探请求（秒）
+            'affinity_weight': 4,  # 选择未加载所需模型的后端时额外计入的请求数，越大越倾向避免冷加载
+            'refresh_interval': 10  # 刷新各后端模型列表和健康状态的间隔（秒）
+        },
+        'router': {
+            'enabled': False,  # 启用后客户端可选择“自动”，按对话类型和延迟目标选择模型
+            'fast_model': 'qwen3:4b',  # 问候和简单问题使用的小模型，未安装时使用 default_model
+            'latency_target_ms': 10000,  # 预计完整回复耗时的目标，首选模型超出时换用更快的模型
+            'simple_max_chars': 60,  # 不超过该长度且不含分析类关键词的问题视为简单问题
+            'ewma_alpha': 0.3,  # 学习各模型速度的平滑系数
+            'expected_tokens': {}  # 覆盖各类对话的预计回复 token 数，如 {"code": 1000}
+        },
+        'memory': {
+            'enabled': False,  # 启用后长对话只发送最近的消息和检索到的相关早期片段
+            'embed_model': 'nomic-embed-text',  # Ollama 嵌入模型（需先 ollama pull）
+            'dir': 'cache/memory',  # 每个用户一个子目录（向量矩阵 + 索引）
+            'recent_messages': 8,  # 原样保留的最近消息数
+            'min_history': 16,  # 历史超过该条数才检索，较短的对话仍发送完整历史
+            'top_k': 4,  # 插入的早期片段数上限
+            'min_score': 0.35,  # 余弦相似度阈值
+            'max_snippet_chars': 600,  # 每个片段插入提示词的最大字符数
+            'batch_size': 32,  # 后台批量嵌入的条数
+            'batch_interval': 1.0,  # 凑批等待时间（秒）
+            'embed_timeout': 10  # 检索时计算问题嵌入的超时（秒）
+        },
+        'documents': {
+            'enabled': False,  # 启用后索引 dirs 中的文本文件，对话时自动附加相关片段，Agent 可调用 search_documents
+            'dirs': [],  # 要索引的目录（递归），如 ["D:/docs", "logs"]
+            'extensions': ['.md', '.txt', '.rst', '.log', '.py', '.js', '.ts', '.json', '.yaml', '.yml',
+                           '.toml', '.ini', '.cfg', '.csv', '.html', '.css', '.sh', '.bat', '.ps1'],
+            'exclude_dirs': ['.git', 'node_modules', '__pycache__', '.venv', 'venv', 'dist', 'build'],
+            'embed_model': 'nomic-embed-text',  # Ollama 嵌入模型（需先 ollama pull）
+            'db_path': 'cache/documents.db',  # 文件、分块和向量（SQLite）
+            'max_file_size': 2 * 1024 * 1024,  # 超过该字节数的文件不索引
+            'chunk_chars': 1200,  # 每块最大字符数
+            'chunk_overlap': 200,  # 每块开头附带的上一块末尾字符数
+            'batch_size': 64,  # 每次嵌入请求的块数
+            'files_per_batch': 64,  # 每批索引的文件数（其中未嵌入过的块合并后嵌入）
+            'debounce': 2.0,  # 文件停止变化多少秒后重新索引
+            'retry_interval': 30,  # 嵌入失败后重试间隔（秒）
+            'scan_interval': 300,  # 未安装 watchdog 时重新扫描目录的间隔（秒）
+            'embed_timeout': 10,  # 检索时计算问题嵌入的超时（秒）
+            'top_k': 5,  # search_documents 默认返回的片段数
+            'min_score': 0.3,  # 余弦相似度阈值
+            'auto_context': True,  # 普通对话自动检索并附加相关片段
+            'context_top_k': 3,  # 自动附加的片段数上限
+            'context_min_score': 0.45,  # 自动附加的相似度阈值（高于手动检索，避免无关片段）
+            'max_context_chars': 3000  # 自动附加的片段总字符数上限
         },
         'system': {
             'allow_system_control': True,
             'enable_agent_mode': True,
             'allowed_commands': ['dir', 'echo', 'type'],
             'screenshot_quality': 85,
+            'screenshot_format': 'jpeg',  # jpeg / webp / png
+            'screenshot_max_dimension': 0,  # 截图最长边，0 表示不缩放
+            'screenshot_grayscale': False,
+            'command_workers': 4,  # 同时执行的命令数
+            'command_max_pending': 8,  # 排队等待的命令数上限
+            'command_timeout': 10,  # 命令最长运行时间（秒）
+            'command_cpu_seconds': 5,  # 命令 CPU 时间上限（秒）
+            'command_max_output': 1048576,  # 输出上限（字节）
+            'command_history': 50,
+            'command_agent_wait': 3,  # Agent 等待命令输出的时间，超时后先返回部分输出
+            'capture_backend': 'auto',  # auto / mss / pil / pyautogui / synthetic
+            'capture_synthetic_size': [1920, 1080],
+            'app_catalog_path': 'cache/app_catalog.json',
+            'app_allowlist': ['builtin:*', 'desktop:*', 'macos:*', 'startmenu:*'],  # 来源:ID 通配，PATH 中的程序需显式加入（如 path:code）
+            'app_watch': True,  # 监视应用目录并增量更新索引
+            'app_match_threshold': 0.75,
             'max_file_size': 5242880  # 5MB
+        },
+        'vision': {
+            'max_image_size': 1024,
+            'jpeg_quality': 85,
+            'max_pixels': 50000000,  # 解压炸弹限制
+            'preprocess_workers': 2,
+            'cache_enabled': True,
+            'cache_size': 256,
+            'cache_path': 'cache/vision_cache.json',
+            'cache_similarity_threshold': 4,  # 感知哈希汉明距离，0 表示只做精确匹配
+            'batch_concurrency': 2,
+            'batch_max_concurrency': 8,
+            'batch_max_items': 1000,
+            'batch_jobs_dir': 'cache/vision_jobs',
+            'tile_size': 1024,
+            'tile_overlap': 64,
+            'max_tiles': 9,
+            'tile_concurrency': 3,
+            'tile_min_side': 1600  # 长边超过该值且需要阅读细节时切片分析
+        },
+        'watch': {
+            'interval': 2.0,  # 截图间隔（秒）
+            'min_interval': 0.5,
+            'debounce': 3.0,  # 画面稳定多少秒后再分析
+            'max_wait': 30.0,  # 持续变化时最长等待时间
+            'cooldown': 10.0,  # 两次调用视觉模型的最小间隔
+            'min_change_ratio': 0.005,  # 变化块占比阈值
+            'region_max_ratio': 0.5,  # 变化区域超过该面积比例时发送整帧
+            'block_size': 32,
+            'pixel_threshold': 24,
+            'block_threshold': 0.02,
+            'diff_scale': 2,
+            'max_watches': 2
+        },
+        'assets': {
+            'enabled': True,  # 调试模式下自动关闭，直接使用原始文件
+            'dist_dir': 'static/dist',
+            'max_age': 31536000,  # 带哈希文件名的资源缓存时间
+            'min_compress_size': 256
+        },
+        'logging': {
+            'level': 'INFO',
+            'dir': 'logs',
+            'filename': 'localai.log',  # 当前日志文件，归档为 localai_YYYYMMDD[.N].log
+            'format': 'text',  # text 或 json（每行一个 JSON，含请求 ID）
+            'console': True,
+            'max_bytes': 20 * 1024 * 1024,  # 单个日志文件大小上限，超过后当天内再轮转
+            'retention_days': 14,  # 归档保留天数
+            'max_message_length': 4000  # 单条日志最大字符数，超出部分截断
+        },
+        'health': {
+            'interval': 15,  # Ollama 可达性、磁盘和负载检查间隔（秒）
+            'timeout': 3,
+            'generate_interval': 300,  # 最小生成往返探测间隔，会占用一次推理并保持模型加载，0 表示禁用
+            'generate_timeout': 60,
+            'generate_model': '',  # 为空时使用 ollama.default_model
+            'disk_min_free_mb': 500,
+            'saturation_threshold': 0.9,  # 负载达到上限的比例后 /ready 返回 503
+            'log_queue_limit': 10000,  # 待写入日志条数上限
+            'stale_after': 60,  # 检查结果超过该时间未更新视为未就绪
+            'min_refresh_interval': 2  # 手动刷新的最小间隔
+        },
+        'compression': {
+            'enabled': True,
+            'min_size': 1024,  # 小于该字节数的响应不压缩
+            'gzip_level': 6,
+            'brotli_quality': 4
+        },
+        'metrics': {
+            'interval': 1.0,  # 采样间隔（秒）
+            'slow_interval': 30.0,  # 磁盘容量、进程数刷新间隔
+            'history_seconds': 3600,  # 历史保留时长
+            'process_interval': 2.0,  # 有查询时的进程扫描间隔
+            'process_ttl': 5.0,  # 进程列表缓存时间
+            'process_idle': 60.0  # 超过该时间无查询则停止扫描
         }
     }
     
@@ -54,6 +187,65 @@ def validate_config(config: Dict[str, Any]) -> Dict[str, Any]:
     
     return config
 
+class ThinkTagFilter:
+    """流式过滤模型输出中的 <think>...</think> 推理内容"""
+    
+    START_TAG = '<think>'
+    END_TAG = '</think>'
+    
+    def __init__(self):
+        self.in_think_block = False
+        self.buffer = ""
+    
+    @staticmethod
+    def _partial_tag_len(text: str, tag: str) -> int:
+        """返回文本末尾可能是标签开头的字符数"""
+        for i in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:i]):
+                return i
+        return 0
+    
+    def feed(self, chunk: str) -> str:
+        """输入新片段，返回可以安全输出的内容"""
+        self.buffer += chunk
+        output = []
+        
+        while True:
+            if self.in_think_block:
+                # 在 think 块内，寻找结束标签
+                end_idx = self.buffer.find(self.END_TAG)
+                if end_idx != -1:
+                    self.buffer = self.buffer[end_idx + len(self.END_TAG):]
+                    self.in_think_block = False
+                else:
+                    # 丢弃 think 内容，只保留可能被截断的结束标签
+                    keep = self._partial_tag_len(self.buffer, self.END_TAG)
+                    self.buffer = self.buffer[len(self.buffer) - keep:] if keep else ""
+                    break
+            else:
+                start_idx = self.buffer.find(self.START_TAG)
+                if start_idx != -1:
+                    # 找到开始标签，先输出之前的内容
+                    if start_idx > 0:
+                        output.append(self.buffer[:start_idx])
+                    self.buffer = self.buffer[start_idx + len(self.START_TAG):]
+                    self.in_think_block = True
+                else:
+                    # 保留可能不完整的 <think 开始标签
+                    safe_len = len(self.buffer) - self._partial_tag_len(self.buffer, self.START_TAG)
+                    if safe_len > 0:
+                        output.append(self.buffer[:safe_len])
+                        self.buffer = self.buffer[safe_len:]
+                    break
+        
+        return ''.join(output)
+    
+    def flush(self) -> str:
+        """流结束时输出剩余缓冲区（不在 think 块内时）"""
+        remaining = "" if self.in_think_block else self.buffer
+        self.buffer = ""
+        return remaining
+
 def format_size(size_bytes: int) -> str:
     """格式化文件大小"""
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Generator
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff'}
+
+# 任务 ID 只允许十六进制字符，防止路径穿越
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{8,32}$')
+
+
+class VisionBatchRunner:
+    """批量视觉分析：预处理在进程池中进行并与推理重叠，结果按完成顺序输出"""
+
+    def __init__(self, config: Dict[str, Any], vision_processor):
+        vision_config = config.get('vision', {})
+        self.vision_processor = vision_processor
+        self.default_concurrency = vision_config.get('batch_concurrency', 2)
+        self.max_concurrency = vision_config.get('batch_max_concurrency', 8)
+        self.max_items = vision_config.get('batch_max_items', 1000)
+        self.jobs_dir = vision_config.get('batch_jobs_dir', os.path.join('cache', 'vision_jobs'))
+
+    @staticmethod
+    def new_job_id() -> str:
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def is_valid_job_id(job_id: str) -> bool:
+        return bool(job_id) and bool(JOB_ID_PATTERN.match(job_id))
+
+    def collect_uploads(self, files) -> List[Dict[str, Any]]:
+        """从上传的文件构建任务项，以内容哈希作为续传键"""
+        items = []
+        for upload in files[:self.max_items]:
+            data = upload.read()
+            if not data:
+                continue
+            items.append({
+                'name': upload.filename or f'image_{len(items)}',
+                'key': hashlib.sha256(data).hexdigest(),
+                'data': data
+            })
+        return items
+
+    def collect_directory(self, directory: str, recursive: bool = False) -> List[Dict[str, Any]]:
+        """扫描本地目录中的图片，以相对路径、大小和修改时间作为续传键"""
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if not os.path.isdir(directory):
+            raise ValueError(f"目录不存在: {directory}")
+
+        items = []
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                name = os.path.relpath(path, directory)
+                items.append({
+                    'name': name,
+                    'key': f"{name}:{stat.st_size}:{int(stat.st_mtime)}",
+                    'path': path
+                })
+                if len(items) >= self.max_items:
+                    return items
+            if not recursive:
+                break
+        return items
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.jsonl")
+
+    def load_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务日志，返回任务头和已完成的结果"""
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return None
+
+        header, results = None, {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程中断时最后一行可能不完整
+                    continue
+                if record.get('type') == 'job':
+                    header = record
+                elif record.get('type') == 'result' and record.get('status') == 'ok':
+                    results[record['key']] = record
+        return {'header': header, 'results': results}
+
+    def job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务进度"""
+        job = self.load_job(job_id)
+        if job is None:
+            return None
+        header = job['header'] or {}
+        return {
+            'job_id': job_id,
+            'prompt': header.get('prompt'),
+            'total': header.get('total'),
+            'completed': len(job['results']),
+            'created_at': header.get('created_at')
+        }
+
+    def resume_error(self, job_id: str, prompt: str) -> Optional[str]:
+        """续传已有任务时检查提示词：已完成的结果只对原提示词有效，不同时返回错误信息"""
+        status = self.job_status(job_id)
+        if status is not None and status['prompt'] is not None and status['prompt'] != prompt:
+            return f"任务 {job_id} 的提示词与本次请求不同，已完成的结果不能复用，请使用新的任务ID"
+        return None
+
+    def run(self, items: List[Dict[str, Any]], prompt: str, job_id: str,
+            concurrency: Optional[int] = None) -> Generator[Dict[str, Any], None, None]:
+        """执行批量分析，逐条产出 NDJSON 记录"""
+        concurrency = max(1, min(concurrency or self.default_concurrency, self.max_concurrency))
+
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        previous = self.load_job(job_id)
+        completed = previous['results'] if previous else {}
+        if previous and previous['header'] and previous['header'].get('prompt') != prompt:
+            yield {'type': 'error', 'job_id': job_id, 'error': self.resume_error(job_id, prompt)}
+            return
+
+        journal = open(self._job_path(job_id), 'a', encoding='utf-8')
+        try:
+            if previous is None:
+                self._write(journal, {
+                    'type': 'job',
+                    'job_id': job_id,
+                    'prompt': prompt,
+                    'total': len(items),
+                    'created_at': time.time()
+                })
+
+            pending = [(index, item) for index, item in enumerate(items) if item['key'] not in completed]
+            yield {
+                'type': 'job',
+                'job_id': job_id,
+                'total': len(items),
+                'resumed': len(items) - len(pending),
+                'concurrency': concurrency
+            }
+
+            # 续传时先回放已完成的结果
+            for index, item in enumerate(items):
+                record = completed.get(item['key'])
+                if record is not None:
+                    yield dict(record, index=index, resumed=True)
+
+            if not pending:
+                yield {'type': 'done', 'job_id': job_id, 'total': len(items), 'failed': 0}
+                return
+
+            # 整个批次只检查一次模型
+            model_error = self.vision_processor._check_vision_model()
+            if model_error:
+                yield {'type': 'error', 'job_id': job_id, 'error': model_error['analysis']}
+                return
+
+            failed = 0
+            for record in self._pipeline(pending, prompt, concurrency):
+                if record['status'] == 'ok':
+                    self._write(journal, record)
+                else:
+                    failed += 1
+                yield record
+
+            yield {'type': 'done', 'job_id': job_id, 'total': len(items), 'failed': failed}
+        finally:
+            journal.close()
+
+    def _pipeline(self, pending, prompt: str, concurrency: int) -> Generator[Dict[str, Any], None, None]:
+        """生产者读取文件并提交预处理，推理线程池消费，结果经队列按完成顺序返回"""
+        preprocessor = self.vision_processor.preprocessor
+        results: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        # 限制同时在内存中的图片数量
+        window = threading.BoundedSemaphore(concurrency * 2)
+        stop_event = threading.Event()
+        inference_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='vision-batch')
+
+        def infer(index, item, data, future, submitted_at):
+            record = {'type': 'result', 'index': index, 'name': item['name'], 'key': item['key']}
+            try:
+                prepared = preprocessor.result(future, data)
+                ready_at = time.perf_counter()
+                result = self.vision_processor.analyze_prepared(prepared, prompt)
+                finished_at = time.perf_counter()
+                record.update({
+                    'status': 'ok' if result.get('success') else 'error',
+                    'analysis': result['analysis'],
+                    'cache': result.get('cache', {'hit': False}),
+                    'timing': {
+                        'preprocess_ms': round(prepared['elapsed_ms'], 1),
+                        'wait_ms': round((ready_at - submitted_at) * 1000 - prepared['elapsed_ms'], 1),
+                        'inference_ms': round((finished_at - ready_at) * 1000, 1),
+                        'total_ms': round((finished_at - submitted_at) * 1000, 1)
+                    }
+                })
+            except Exception as e:
+                logger.error(f"批量分析 {item['name']} 失败: {str(e)}")
+                record.update({'status': 'error', 'error': str(e)})
+            finally:
+                window.release()
+                results.put(record)
+
+        def produce():
+            for index, item in pending:
+                while not window.acquire(timeout=0.5):
+                    if stop_event.is_set():
+                        return
+                if stop_event.is_set():
+                    window.release()
+                    return
+                try:
+                    data = item['data'] if 'data' in item else _read_file(item['path'])
+                    future = preprocessor.submit(data)
+                    inference_pool.submit(infer, index, item, data, future, time.perf_counter())
+                except Exception as e:
+                    window.release()
+                    results.put({'type': 'result', 'index': index, 'name': item['name'],
+                                 'key': item['key'], 'status': 'error', 'error': str(e)})
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            for _ in range(len(pending)):
+                yield results.get()
+        finally:
+            # 客户端断开时停止提交新任务
+            stop_event.set()
+            inference_pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _write(journal, record: Dict[str, Any]):
+        journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        journal.flush()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
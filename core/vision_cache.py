@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from .image_pipeline import hamming_distance
+
+logger = logging.getLogger(__name__)
+
+
+class VisionCache:
+    """视觉分析结果缓存：内存 LRU + 磁盘持久化，支持感知哈希近似匹配"""
+
+    def __init__(self, config: Dict[str, Any]):
+        vision_config = config.get('vision', {})
+        self.enabled = vision_config.get('cache_enabled', True)
+        self.max_entries = vision_config.get('cache_size', 256)
+        self.path = vision_config.get('cache_path', os.path.join('cache', 'vision_cache.json'))
+        # 感知哈希的汉明距离阈值，0 表示只做精确匹配
+        self.similarity_threshold = vision_config.get('cache_similarity_threshold', 0)
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        if self.enabled:
+            self._load()
+
+    @staticmethod
+    def make_key(image_hash: str, prompt: str, model: str) -> str:
+        """由图片内容哈希、提示词和模型生成缓存键"""
+        raw = json.dumps([image_hash, prompt, model], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, image_hash: str, prompt: str, model: str,
+            phash: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """查找缓存，返回条目副本及命中信息"""
+        if not self.enabled:
+            return None
+
+        key = self.make_key(image_hash, prompt, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            match = {'match': 'exact', 'distance': 0}
+
+            if entry is None and phash is not None and self.similarity_threshold > 0:
+                entry, distance = self._find_similar(prompt, model, phash)
+                if entry is not None:
+                    key = entry['key']
+                    match = {'match': 'similar', 'distance': distance}
+
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(key)
+            entry['hits'] += 1
+            result = dict(entry)
+
+        result['cache'] = {
+            'hit': True,
+            'match': match['match'],
+            'distance': match['distance'],
+            'cached_at': result['created_at'],
+            'hits': result['hits']
+        }
+        return result
+
+    def _find_similar(self, prompt: str, model: str, phash: int):
+        """在相同提示词和模型的条目中查找最接近的感知哈希（调用方持有锁）"""
+        best, best_distance = None, None
+        for entry in self._entries.values():
+            if entry['phash'] is None or entry['prompt'] != prompt or entry['model'] != model:
+                continue
+            distance = hamming_distance(entry['phash'], phash)
+            if distance <= self.similarity_threshold and (best is None or distance < best_distance):
+                best, best_distance = entry, distance
+        return best, best_distance
+
+    def put(self, image_hash: str, prompt: str, model: str, phash: Optional[int],
+            analysis: str, description: str):
+        """写入缓存并持久化"""
+        if not self.enabled:
+            return
+
+        key = self.make_key(image_hash, prompt, model)
+        with self._lock:
+            self._entries[key] = {
+                'key': key,
+                'image_hash': image_hash,
+                'prompt': prompt,
+                'model': model,
+                'phash': phash,
+                'analysis': analysis,
+                'description': description,
+                'created_at': time.time(),
+                'hits': 0
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        self._save()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+        self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': sum(entry['hits'] for entry in self._entries.values())
+            }
+
+    def _load(self):
+        """从磁盘加载缓存"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            for entry in entries[-self.max_entries:]:
+                self._entries[entry['key']] = entry
+            logger.info(f"已加载 {len(self._entries)} 条视觉分析缓存")
+        except Exception as e:
+            logger.warning(f"加载视觉分析缓存失败: {str(e)}")
+
+    def _save(self):
+        """原子写入磁盘，避免进程中断时留下损坏的文件"""
+        with self._lock:
+            entries = list(self._entries.values())
+        with self._save_lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"保存视觉分析缓存失败: {str(e)}")
@@ -1,142 +1,404 @@
 import base64
-from io import BytesIO
-from PIL import Image
 import requests
 import logging
-from typing import Dict, Any
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Any, Optional, Generator
+
+from .image_pipeline import ImagePreprocessor, ImageTooLargeError, read_image_size
+from .vision_cache import VisionCache
+from .vision_tiling import TiledAnalyzer
+from .utils import ThinkTagFilter
+from .ollama_client import OllamaPool
+from .singleflight import SingleFlight, digest
 
 logger = logging.getLogger(__name__)
 
 class VisionProcessor:
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], pool: OllamaPool = None):
+        self.config = config
+        self.pool = pool or OllamaPool(config)
+        self.vision_model = config['ollama'].get('vision_model', 'qwen3-vl:8b')
+        self.preprocessor = ImagePreprocessor(config)
+        self.cache = VisionCache(config)
+        self.tiler = TiledAnalyzer(config, self)
+        # 多个调用方同时提交同一张图片和提示词时只分析一次
+        self.flights = SingleFlight('vision')
+    
+    def apply_config(self, config: Dict[str, Any]):
+        """应用重新加载的配置；预处理进程池和缓存的设置需重启生效"""
         self.config = config
-        self.ollama_url = config['ollama']['base_url']
         self.vision_model = config['ollama'].get('vision_model', 'qwen3-vl:8b')
+        self.tiler.apply_config(config)
     
     def get_available_models(self) -> list:
-        """获取可用的模型列表"""
-        try:
-            response = requests.get(f"{self.ollama_url}/api/tags")
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                return [model['name'] for model in models]
-        except requests.exceptions.ConnectionError:
+        """获取可用的模型列表（各后端已安装模型的并集）"""
+        models = self.pool.list_models()
+        if models is None:
             logger.warning("无法连接到Ollama服务")
-        return []
+            return []
+        return models
+    
+    def _check_vision_model(self) -> Optional[Dict[str, str]]:
+        """检查视觉模型是否已安装，未安装时返回错误结果"""
+        available_models = self.get_available_models()
+        if available_models and self.vision_model not in available_models:
+            logger.warning(f"视觉模型 {self.vision_model} 不可用，已安装模型: {available_models}")
+            return {
+                'analysis': f"错误: 视觉模型 '{self.vision_model}' 未安装。\n\n已安装的模型: {', '.join(available_models)}\n\n请运行 install_models.bat 安装视觉模型（如 qwen3-vl:8b 或 llava:7b）。",
+                'description': '模型未安装',
+                'success': False
+            }
+        return None
+    
+    def _build_payload(self, prepared: Dict[str, Any], prompt: str, stream: bool) -> Dict[str, Any]:
+        """构建 /api/generate 请求体"""
+        return {
+            'model': self.vision_model,
+            'prompt': prompt,
+            'images': [base64.b64encode(prepared['data']).decode('utf-8')],
+            'stream': stream,
+            'options': {
+                'temperature': 0.2,
+                'num_predict': 512
+            }
+        }
+    
+    def analyze_image(self, image_file, prompt: str = "描述这张图片",
+                      resolution: str = 'auto') -> Dict[str, Any]:
+        """分析图片
+        
+        resolution: auto 根据图片尺寸和提问自动选择，single 单次缩略分析，tiled 切片分析
+        """
+        image_data = image_file if isinstance(image_file, bytes) else image_file.read()
+        key = digest('analyze_image', self.vision_model, hashlib.sha256(image_data).hexdigest(), prompt, resolution)
+        return self.flights.do(key, lambda: self._analyze_image(image_data, prompt, resolution))
     
-    def analyze_image(self, image_file, prompt: str = "描述这张图片") -> Dict[str, str]:
-        """分析图片"""
+    def _analyze_image(self, image_data: bytes, prompt: str, resolution: str) -> Dict[str, Any]:
         try:
+            width, height = read_image_size(image_data)
+            mode = self.tiler.choose_mode(width, height, prompt, resolution)
+            
+            # 先提交预处理任务，与模型检查并行执行
+            if mode == 'tiled':
+                prepare_future = self.tiler.submit(image_data)
+            else:
+                prepare_future = self.preprocessor.submit(image_data)
+            
             # 检查模型是否存在
-            available_models = self.get_available_models()
-            if available_models and self.vision_model not in available_models:
-                logger.warning(f"视觉模型 {self.vision_model} 不可用，已安装模型: {available_models}")
-                return {
-                    'analysis': f"错误: 视觉模型 '{self.vision_model}' 未安装。\n\n已安装的模型: {', '.join(available_models)}\n\n请运行 install_models.bat 安装视觉模型（如 qwen3-vl:8b 或 llava:7b）。",
-                    'description': '模型未安装'
-                }
+            model_error = self._check_vision_model()
+            if model_error:
+                return model_error
             
-            # 读取图片
-            image = Image.open(image_file)
-            
-            # 调整图片大小（避免太大）
-            max_size = (1024, 1024)
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # 转换为base64
-            buffered = BytesIO()
-            image.save(buffered, format="JPEG", quality=85)
-            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            # 准备请求
-            payload = {
-                'model': self.vision_model,
-                'prompt': prompt,
-                'images': [img_base64],
-                'stream': False,
-                'options': {
-                    'temperature': 0.2,
-                    'num_predict': 512
-                }
-            }
+            if mode == 'tiled':
+                logger.info(f"使用切片模式分析 {width}x{height} 图片")
+                return self.tiler.analyze_tiled(self.tiler.collect(prepare_future, image_data), prompt)
             
-            # 发送请求
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json=payload,
-                timeout=60
-            )
+            # 等待预处理结果（解码、缩放、编码在进程池中完成）
+            prepared = self.preprocessor.result(prepare_future, image_data)
             
-            if response.status_code == 200:
-                data = response.json()
-                analysis = data.get('response', '')
-                
-                # 生成基本描述
-                description = self._generate_description(image, analysis)
-                
-                return {
-                    'analysis': analysis,
-                    'description': description
-                }
-            elif response.status_code == 404:
-                logger.error(f"视觉模型 {self.vision_model} 不存在")
-                return {
-                    'analysis': f"错误: 视觉模型 '{self.vision_model}' 未找到。\n\n请确保已通过 Ollama 安装该模型：\nollama pull {self.vision_model}\n\n或运行 install_models.bat 安装视觉模型。",
-                    'description': '模型未找到'
-                }
-            else:
-                logger.error(f"视觉分析API错误: {response.status_code}")
-                try:
-                    error_detail = response.json()
-                    error_msg = error_detail.get('error', str(error_detail))
-                    logger.error(f"错误详情: {error_msg}")
-                    
-                    # 检查是否是模型加载失败
-                    if 'unable to load model' in error_msg.lower():
-                        return {
-                            'analysis': f"错误: 视觉模型 '{self.vision_model}' 加载失败。\n\n可能的原因：\n1. 模型文件损坏\n2. 模型下载不完整\n\n解决方案：\n1. 删除并重新下载模型：\n   ollama rm {self.vision_model}\n   ollama pull {self.vision_model}\n\n2. 或者尝试其他视觉模型：\n   ollama pull llava:7b",
-                            'description': '模型加载失败'
-                        }
-                    
-                    return {
-                        'analysis': f"错误: API返回状态码 {response.status_code}\n详情: {error_msg}",
-                        'description': '分析失败'
-                    }
-                except:
-                    return {
-                        'analysis': f"错误: API返回状态码 {response.status_code}",
-                        'description': '分析失败'
-                    }
+            result = self.analyze_prepared(prepared, prompt)
+            result['resolution'] = {'mode': 'single'}
+            return result
                 
+        except ImageTooLargeError as e:
+            logger.warning(f"拒绝处理过大的图片: {str(e)}")
+            return {
+                'analysis': f"错误: {str(e)}。\n\n请缩小图片后重试。",
+                'description': '图片过大',
+                'success': False
+            }
         except requests.exceptions.ConnectionError:
             logger.error("无法连接到Ollama服务")
             return {
                 'analysis': "错误: 无法连接到本地AI服务。\n\n请确保 Ollama 正在运行：\n1. 检查任务管理器中是否有 ollama 进程\n2. 手动运行: ollama serve\n3. 或重启 start.bat",
-                'description': '连接失败'
+                'description': '连接失败',
+                'success': False
+            }
+        except requests.exceptions.Timeout:
+            logger.error("请求超时")
+            return {
+                'analysis': "错误: 请求超时。模型可能正在加载，请稍后重试。",
+                'description': '请求超时',
+                'success': False
+            }
+        except Exception as e:
+            logger.error(f"图片分析失败: {str(e)}")
+            return {
+                'analysis': f"错误: {str(e)}",
+                'description': '处理失败',
+                'success': False
+            }
+    
+    def analyze_pil_image(self, image, prompt: str = "描述这张图片",
+                          resolution: str = 'auto') -> Dict[str, Any]:
+        """分析内存中的 PIL 图片（如截图），全程不经过 PNG/base64 中间编码
+        
+        返回结果附带 preprocess_ms 和 inference_ms 分阶段耗时。
+        """
+        timing = {}
+        try:
+            model_error = self._check_vision_model()
+            if model_error:
+                return model_error
+            
+            mode = self.tiler.choose_mode(image.width, image.height, prompt, resolution)
+            start_time = time.perf_counter()
+            if mode == 'tiled':
+                logger.info(f"使用切片模式分析 {image.width}x{image.height} 图片")
+                tiled = self.tiler.tile_pil(image)
+                timing['preprocess_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+                start_time = time.perf_counter()
+                result = self.tiler.analyze_tiled(tiled, prompt)
+            else:
+                prepared = self.preprocessor.prepare_pil(image)
+                timing['preprocess_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+                start_time = time.perf_counter()
+                result = self.analyze_prepared(prepared, prompt)
+                result['resolution'] = {'mode': 'single'}
+            timing['inference_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+            result['timing'] = timing
+            return result
+        
+        except ImageTooLargeError as e:
+            logger.warning(f"拒绝处理过大的图片: {str(e)}")
+            return {
+                'analysis': f"错误: {str(e)}",
+                'description': '图片过大',
+                'success': False
+            }
+        except requests.exceptions.ConnectionError:
+            logger.error("无法连接到Ollama服务")
+            return {
+                'analysis': "错误: 无法连接到本地AI服务。\n\n请确保 Ollama 正在运行。",
+                'description': '连接失败',
+                'success': False
             }
         except requests.exceptions.Timeout:
             logger.error("请求超时")
             return {
                 'analysis': "错误: 请求超时。模型可能正在加载，请稍后重试。",
-                'description': '请求超时'
+                'description': '请求超时',
+                'success': False
             }
         except Exception as e:
             logger.error(f"图片分析失败: {str(e)}")
             return {
                 'analysis': f"错误: {str(e)}",
-                'description': '处理失败'
+                'description': '处理失败',
+                'success': False
+            }
+    
+    def analyze_prepared(self, prepared: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        """分析已预处理的图片（查缓存、调用视觉模型、写缓存）"""
+        # 相同图片、提示词和模型直接返回缓存结果
+        cached = self.cache.get(prepared['sha256'], prompt, self.vision_model, prepared['phash'])
+        if cached is not None:
+            logger.info(f"视觉分析命中缓存 ({cached['cache']['match']})")
+            return {
+                'analysis': cached['analysis'],
+                'description': cached['description'],
+                'cache': cached['cache'],
+                'success': True
             }
+        
+        # 准备请求
+        payload = self._build_payload(prepared, prompt, stream=False)
+        
+        # 发送请求（后端池按线程复用连接）
+        response = self.pool.post(
+            '/api/generate',
+            model=self.vision_model,
+            json=payload,
+            timeout=60
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            analysis = data.get('response', '')
+            
+            # 生成基本描述
+            description = self._generate_description(prepared, analysis)
+            self.cache.put(prepared['sha256'], prompt, self.vision_model,
+                           prepared['phash'], analysis, description)
+            
+            return {
+                'analysis': analysis,
+                'description': description,
+                'cache': {'hit': False},
+                'success': True
+            }
+        elif response.status_code == 404:
+            logger.error(f"视觉模型 {self.vision_model} 不存在")
+            return {
+                'analysis': f"错误: 视觉模型 '{self.vision_model}' 未找到。\n\n请确保已通过 Ollama 安装该模型：\nollama pull {self.vision_model}\n\n或运行 install_models.bat 安装视觉模型。",
+                'description': '模型未找到',
+                'success': False
+            }
+        else:
+            logger.error(f"视觉分析API错误: {response.status_code}")
+            try:
+                error_detail = response.json()
+                error_msg = error_detail.get('error', str(error_detail))
+                logger.error(f"错误详情: {error_msg}")
+                
+                # 检查是否是模型加载失败
+                if 'unable to load model' in error_msg.lower():
+                    return {
+                        'analysis': f"错误: 视觉模型 '{self.vision_model}' 加载失败。\n\n可能的原因：\n1. 模型文件损坏\n2. 模型下载不完整\n\n解决方案：\n1. 删除并重新下载模型：\n   ollama rm {self.vision_model}\n   ollama pull {self.vision_model}\n\n2. 或者尝试其他视觉模型：\n   ollama pull llava:7b",
+                        'description': '模型加载失败',
+                        'success': False
+                    }
+                
+                return {
+                    'analysis': f"错误: API返回状态码 {response.status_code}\n详情: {error_msg}",
+                    'description': '分析失败',
+                    'success': False
+                }
+            except:
+                return {
+                    'analysis': f"错误: API返回状态码 {response.status_code}",
+                    'description': '分析失败',
+                    'success': False
+                }
+    
+    def analyze_image_stream(self, image_data: bytes, prompt: str = "描述这张图片",
+                             cancel_event: Optional[threading.Event] = None,
+                             meta: Optional[Dict[str, Any]] = None,
+                             resolution: str = 'auto') -> Generator[str, None, None]:
+        """流式分析图片，输出经过 think 过滤的文本片段
+        
+        meta 用于回传图片描述和缓存命中信息；cancel_event 被设置时中止生成。
+        """
+        if meta is None:
+            meta = {}
+        meta['cache'] = {'hit': False}
+        
+        try:
+            width, height = read_image_size(image_data)
+            mode = self.tiler.choose_mode(width, height, prompt, resolution)
+            meta['resolution'] = {'mode': mode}
+            if mode == 'tiled':
+                prepare_future = self.tiler.submit(image_data)
+            else:
+                prepare_future = self.preprocessor.submit(image_data)
+            
+            model_error = self._check_vision_model()
+            if model_error:
+                meta['description'] = model_error['description']
+                yield model_error['analysis']
+                return
+            
+            # 切片模式需要等所有区域识别完成后合并，整体一次输出
+            if mode == 'tiled':
+                result = self.tiler.analyze_tiled(self.tiler.collect(prepare_future, image_data), prompt)
+                meta['description'] = result['description']
+                meta['cache'] = result.get('cache', {'hit': False})
+                meta['resolution'] = result.get('resolution', meta['resolution'])
+                yield result['analysis']
+                return
+            
+            prepared = self.preprocessor.result(prepare_future, image_data)
+            
+            cached = self.cache.get(prepared['sha256'], prompt, self.vision_model, prepared['phash'])
+            if cached is not None:
+                logger.info(f"视觉分析命中缓存 ({cached['cache']['match']})")
+                meta['description'] = cached['description']
+                meta['cache'] = cached['cache']
+                yield cached['analysis']
+                return
+            
+            response = self.pool.post(
+                '/api/generate',
+                model=self.vision_model,
+                json=self._build_payload(prepared, prompt, stream=True),
+                stream=True,
+                timeout=60
+            )
+            
+            if response.status_code == 404:
+                logger.error(f"视觉模型 {self.vision_model} 不存在")
+                meta['description'] = '模型未找到'
+                yield f"错误: 视觉模型 '{self.vision_model}' 未找到。\n\n请确保已通过 Ollama 安装该模型：\nollama pull {self.vision_model}"
+                return
+            if response.status_code != 200:
+                logger.error(f"视觉分析API错误: {response.status_code}")
+                meta['description'] = '分析失败'
+                yield f"错误: API返回状态码 {response.status_code}"
+                return
+            
+            think_filter = ThinkTagFilter()
+            analysis = ""
+            cancelled = False
+            try:
+                for line in response.iter_lines():
+                    if cancel_event is not None and cancel_event.is_set():
+                        cancelled = True
+                        break
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line.decode('utf-8'))
+                    except json.JSONDecodeError:
+                        continue
+                    chunk = data.get('response', '')
+                    if chunk:
+                        output = think_filter.feed(chunk)
+                        if output:
+                            analysis += output
+                            yield output
+                    if data.get('done', False):
+                        break
+            finally:
+                # 取消时关闭连接，Ollama 会随之停止生成
+                response.close()
+            
+            if cancelled:
+                logger.info("视觉分析已取消")
+                meta['cancelled'] = True
+                meta['description'] = '已取消'
+                return
+            
+            remaining = think_filter.flush()
+            if remaining:
+                analysis += remaining
+                yield remaining
+            
+            description = self._generate_description(prepared, analysis)
+            meta['description'] = description
+            self.cache.put(prepared['sha256'], prompt, self.vision_model,
+                           prepared['phash'], analysis, description)
+        
+        except ImageTooLargeError as e:
+            logger.warning(f"拒绝处理过大的图片: {str(e)}")
+            meta['description'] = '图片过大'
+            yield f"错误: {str(e)}。\n\n请缩小图片后重试。"
+        except requests.exceptions.ConnectionError:
+            logger.error("无法连接到Ollama服务")
+            meta['description'] = '连接失败'
+            yield "错误: 无法连接到本地AI服务。\n\n请确保 Ollama 正在运行。"
+        except requests.exceptions.Timeout:
+            logger.error("请求超时")
+            meta['description'] = '请求超时'
+            yield "错误: 请求超时。模型可能正在加载，请稍后重试。"
+        except Exception as e:
+            logger.error(f"流式图片分析失败: {str(e)}")
+            meta['description'] = '处理失败'
+            yield f"错误: {str(e)}"
     
-    def _generate_description(self, image: Image.Image, analysis: str) -> str:
+    def _generate_description(self, prepared: Dict[str, Any], analysis: str) -> str:
         """生成图片描述"""
-        width, height = image.size
-        format_name = image.format if image.format else '未知'
+        width, height = prepared['width'], prepared['height']
+        format_name = prepared['format'] if prepared['format'] else '未知'
         
         description = f"""
         图片信息:
         - 尺寸: {width} x {height} 像素
+        - 原始尺寸: {prepared['original_width']} x {prepared['original_height']} 像素
         - 格式: {format_name}
-        - 模式: {image.mode}
+        - 模式: {prepared['mode']}
         
         分析结果:
         {analysis}
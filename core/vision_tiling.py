@@ -0,0 +1,184 @@
+import re
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+import requests
+
+from .utils import ThinkTagFilter
+
+logger = logging.getLogger(__name__)
+
+# 需要看清细节（文字、代码、报错等）的提问
+TEXT_INTENT_PATTERN = re.compile(
+    r'文字|文本|读|识别|转录|代码|报错|错误|日志|写了|写的|内容是|多少|数字|表格|'
+    r'\b(text|read|ocr|transcribe|code|error|log|number|table)\b',
+    re.IGNORECASE
+)
+
+# 切片提示词与用户问题无关，同一截图的后续提问可以复用切片结果
+TILE_PROMPT = (
+    "这是一张大尺寸截图中的一个局部区域（第{row}行，第{col}列，共{rows}行{cols}列）。"
+    "请完整转录该区域中所有可见的文字（保持原有换行），并简要说明界面元素。"
+    "如果区域内没有有效内容，请回答“空白”。"
+)
+
+OVERVIEW_PROMPT = "这是一张截图的整体缩略图。请简要描述整体布局：有哪些窗口、面板或主要区域，各自大致位于什么位置。"
+
+MERGE_PROMPT = """你将根据一张高分辨率截图的分块识别结果回答用户的问题。
+截图被切分为 {rows} 行 {cols} 列的区域，相邻区域有少量重叠，重叠部分的文字可能重复出现，请去重。
+
+整体布局：
+{overview}
+
+各区域内容：
+{findings}
+
+用户的问题：{question}
+
+请综合以上信息直接回答用户的问题。"""
+
+
+def has_text_intent(prompt: str) -> bool:
+    """判断提问是否需要阅读细节"""
+    return bool(TEXT_INTENT_PATTERN.search(prompt or ''))
+
+
+class TiledAnalyzer:
+    """大尺寸截图的切片分析：切片并发识别后由文本模型合并为一个回答"""
+
+    def __init__(self, config: Dict[str, Any], vision_processor):
+        self.vision_processor = vision_processor
+        self.apply_config(config)
+
+    def apply_config(self, config: Dict[str, Any]):
+        """应用重新加载的配置（合并模型和切片参数）"""
+        vision_config = config.get('vision', {})
+        self.merge_model = config['ollama'].get('default_model', 'qwen3:8b')
+        self.tile_size = vision_config.get('tile_size', 1024)
+        self.tile_overlap = vision_config.get('tile_overlap', 64)
+        self.max_tiles = vision_config.get('max_tiles', 9)
+        self.tile_concurrency = vision_config.get('tile_concurrency', 3)
+        # 长边超过该值且提问需要阅读细节时使用切片模式
+        self.tile_min_side = vision_config.get('tile_min_side', 1600)
+
+    def choose_mode(self, width: int, height: int, prompt: str, resolution: str = 'auto') -> str:
+        """选择单次缩略分析（single）或切片分析（tiled）"""
+        if resolution in ('single', 'tiled'):
+            return resolution
+        if max(width, height) >= self.tile_min_side and has_text_intent(prompt):
+            return 'tiled'
+        # 超大图（如多显示器截图）即使是一般描述，缩到单张后也损失过多
+        if max(width, height) >= self.tile_min_side * 2.5:
+            return 'tiled'
+        return 'single'
+
+    def submit(self, image_data: bytes):
+        """提交切片预处理任务"""
+        return self.vision_processor.preprocessor.submit_tiles(
+            image_data, self.tile_size, self.tile_overlap, self.max_tiles)
+
+    def collect(self, future, image_data: bytes) -> Dict[str, Any]:
+        """等待切片预处理结果"""
+        return self.vision_processor.preprocessor.tiles_result(
+            future, image_data, self.tile_size, self.tile_overlap, self.max_tiles)
+
+    def tile_pil(self, image) -> Dict[str, Any]:
+        """切分内存中的图片"""
+        return self.vision_processor.preprocessor.tile_pil(
+            image, self.tile_size, self.tile_overlap, self.max_tiles)
+
+    def analyze_tiled(self, tiled: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        """对已切片的图片执行并发识别与合并"""
+        rows, cols = tiled['rows'], tiled['cols']
+        jobs = [(tiled['overview'], OVERVIEW_PROMPT)]
+        for tile in tiled['tiles']:
+            jobs.append((tile, TILE_PROMPT.format(row=tile['row'] + 1, col=tile['col'] + 1,
+                                                  rows=rows, cols=cols)))
+
+        with ThreadPoolExecutor(max_workers=self.tile_concurrency,
+                                thread_name_prefix='vision-tile') as executor:
+            # 并发的切片请求由后端池分配到各 Ollama 实例
+            results = list(executor.map(
+                lambda job: self.vision_processor.analyze_prepared(job[0], job[1]),
+                jobs
+            ))
+
+        failed = [result for result in results if not result.get('success')]
+        if failed:
+            # 切片失败通常意味着模型或服务问题，直接返回第一条错误
+            return failed[0]
+
+        overview, tile_results = results[0], results[1:]
+        findings = []
+        for tile, result in zip(tiled['tiles'], tile_results):
+            text = result['analysis'].strip()
+            if text and text != '空白':
+                findings.append(f"[第{tile['row'] + 1}行第{tile['col'] + 1}列] {text}")
+
+        merged = self._merge(prompt, rows, cols, overview['analysis'], findings)
+        cached_tiles = sum(1 for result in results if result['cache'].get('hit'))
+
+        return {
+            'analysis': merged,
+            'description': self._describe(tiled, len(results), cached_tiles),
+            # 即使所有切片都命中缓存，合并仍调用了文本模型，整体不算命中；切片命中数单独报告
+            'cache': {
+                'hit': False,
+                'match': 'tiles',
+                'tiles_cached': cached_tiles,
+                'tiles': len(results)
+            },
+            'resolution': {
+                'mode': 'tiled',
+                'rows': rows,
+                'cols': cols,
+                'scale': round(tiled['scale'], 3)
+            },
+            'success': True
+        }
+
+    def _merge(self, question: str, rows: int, cols: int, overview: str, findings: List[str]) -> str:
+        """使用文本模型合并各切片结果，失败时退回直接拼接"""
+        fallback = f"{overview.strip()}\n\n" + "\n\n".join(findings)
+        prompt = MERGE_PROMPT.format(
+            rows=rows, cols=cols,
+            overview=overview.strip() or '（无）',
+            findings="\n\n".join(findings) or '（无可识别内容）',
+            question=question
+        )
+
+        try:
+            response = self.vision_processor.pool.post(
+                '/api/generate',
+                model=self.merge_model,
+                json={
+                    'model': self.merge_model,
+                    'prompt': prompt,
+                    'stream': False,
+                    'options': {'temperature': 0.2}
+                },
+                timeout=120
+            )
+            if response.status_code != 200:
+                logger.warning(f"切片结果合并失败，状态码 {response.status_code}")
+                return fallback
+
+            think_filter = ThinkTagFilter()
+            merged = think_filter.feed(response.json().get('response', '')) + think_filter.flush()
+            return merged.strip() or fallback
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            logger.warning(f"切片结果合并失败: {str(e)}")
+            return fallback
+
+    @staticmethod
+    def _describe(tiled: Dict[str, Any], passes: int, cached: int) -> str:
+        return f"""
+        图片信息:
+        - 原始尺寸: {tiled['original_width']} x {tiled['original_height']} 像素
+        - 格式: {tiled['format'] or '未知'}
+        - 分析模式: 切片 ({tiled['rows']} x {tiled['cols']}，缩放 {tiled['scale']:.2f})
+        - 视觉模型调用: {passes - cached} 次（{cached} 个区域命中缓存），另有 1 次合并调用
+        """
+
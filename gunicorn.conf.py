@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# LocalAI-Desktop 生产模式 gunicorn 配置：gunicorn -c gunicorn.conf.py webui:app
+
+import os
+import glob
+import json
+import multiprocessing
+
+from core.utils import validate_config
+
+try:
+    with open('config.json', 'r', encoding='utf-8') as f:
+        _config = validate_config(json.load(f))
+except (OSError, ValueError):
+    _config = validate_config({'ollama': {'base_url': 'http://localhost:11434'}})
+
+_webui = _config['webui']
+
+bind = os.environ.get('LOCALAI_BIND', f"{_webui['host']}:{_webui['port']}")
+workers = int(os.environ.get('LOCALAI_WORKERS', 0)) or _webui['workers'] or min(multiprocessing.cpu_count(), 4)
+# Flask-SocketIO 使用 threading 模式，WebSocket 连接各占用一个线程
+worker_class = 'gthread'
+threads = int(os.environ.get('LOCALAI_THREADS', 0)) or _webui['threads']
+# 流式对话和 SSE 连接可能持续较长时间
+timeout = 300
+graceful_timeout = 30
+keepalive = 5
+# 不预加载应用，各工作进程独立初始化后台线程（指标采样、目录监视等）
+preload_app = False
+
+# 工作进程据此启用消息队列和仅 WebSocket 传输
+os.environ['LOCALAI_WORKERS'] = str(workers)
+
+
+def on_starting(server):
+    """清理上次运行遗留的消息总线节点登记"""
+    for path in glob.glob(os.path.join(_webui['message_queue_dir'], '*.peer')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
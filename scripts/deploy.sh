@@ -160,6 +160,10 @@ install_dependencies() {
     fi
     
     echo -e "${GREEN}[OK] 依赖安装完成${NC}"
+    
+    # 预先构建静态资源（带哈希文件名和 gzip/brotli 压缩版本），启动时也会自动检查
+    echo "[信息] 构建静态资源..."
+    python -m core.assets > /dev/null || echo -e "${YELLOW}[警告] 静态资源构建失败，将使用原始文件${NC}"
 }
 
 # 创建配置文件
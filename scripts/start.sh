@@ -10,6 +10,27 @@ YELLOW='\033[1;33m'
 BLUE='\033[0;34m'
 NC='\033[0m' # No Color
 
+# 用法: ./start.sh [--prod [--workers N]]
+#   --prod       生产模式：gunicorn 多工作进程，Socket.IO 经本机消息队列转发
+#   --workers N  工作进程数（默认读取 config.json 中的 webui.workers，0 表示按 CPU 核数）
+MODE="dev"
+while [[ $# -gt 0 ]]; do
+    case "$1" in
+        --prod)
+            MODE="prod"
+            shift
+            ;;
+        --workers)
+            export LOCALAI_WORKERS="$2"
+            shift 2
+            ;;
+        *)
+            echo "未知参数: $1"
+            exit 1
+            ;;
+    esac
+done
+
 # 获取脚本所在目录，然后切换到项目根目录
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 cd "$SCRIPT_DIR/.."
@@ -161,7 +182,16 @@ start_webui() {
     # 后台打开浏览器
     open_browser "$URL" &
     
-    # 启动 Python 应用
+    if [[ "$MODE" == "prod" ]]; then
+        if ! python -c "import gunicorn" 2>/dev/null; then
+            echo -e "${RED}[错误] 未安装 gunicorn，请运行: pip install -r requirements.txt${NC}"
+            exit 1
+        fi
+        echo -e "${BLUE}[信息] 生产模式: gunicorn 多工作进程${NC}"
+        exec gunicorn -c gunicorn.conf.py webui:app
+    fi
+    
+    # 启动 Python 应用（开发服务器）
     python webui.py
 }
 
@@ -1,6 +1,7 @@
 class LocalAIClient {
     constructor() {
         this.socket = null;
+        this.configPromise = null;
         this.currentUser = 'user_' + Date.now();
         this.initialize();
     }
@@ -31,20 +32,49 @@ class LocalAIClient {
     }
 
     initSocket() {
-        this.socket = io();
+        // 生产模式（多进程）下服务端要求只使用 WebSocket
+        this.socket = window.SOCKET_TRANSPORTS ? io({ transports: window.SOCKET_TRANSPORTS }) : io();
         
         this.socket.on('connect', () => {
             console.log('已连接到服务器');
             this.updateStatus('已连接到服务器');
+            // 系统指标由服务端定时推送，无需轮询
+            this.socket.emit('system_metrics_subscribe');
+        });
+        
+        this.socket.on('system_metrics', (data) => {
+            this.renderSystemInfo(data);
+        });
+
+        // 服务端配置文件变化后丢弃缓存，下次使用时重新获取
+        this.socket.on('config_updated', (data) => {
+            console.log('配置已更新:', data.changed);
+            this.configPromise = null;
         });
         
         this.socket.on('chat_chunk', (data) => {
             this.appendMessageChunk(data.chunk);
+            if (data.done && data.model && this.currentAIResponseContent) {
+                // 自动选择模型时在提示中显示实际使用的模型
+                this.currentAIResponseContent.title = `模型: ${data.model}`;
+            }
             if (data.done) {
                 this.enableInput();
             }
         });
         
+        this.socket.on('vision_chunk', (data) => {
+            this.handleVisionChunk(data);
+        });
+        
+        this.socket.on('command_output', (data) => {
+            this.handleCommandOutput(data);
+        });
+        
+        this.socket.on('screen_watch_event', (data) => {
+            this.handleScreenWatchEvent(data);
+        });
+        
         this.socket.on('error', (data) => {
             this.showError(data.message);
         });
@@ -98,6 +128,16 @@ class LocalAIClient {
             analyzeBtn.addEventListener('click', () => this.analyzeImage());
         }
 
+        const screenAnalyzeBtn = document.getElementById('screen-analyze-btn');
+        if (screenAnalyzeBtn) {
+            screenAnalyzeBtn.addEventListener('click', () => this.analyzeScreen());
+        }
+
+        const screenWatchBtn = document.getElementById('screen-watch-btn');
+        if (screenWatchBtn) {
+            screenWatchBtn.addEventListener('click', () => this.toggleScreenWatch());
+        }
+
         // 拖放上传
         const dropArea = document.getElementById('drop-area');
         if (dropArea) {
@@ -137,7 +177,7 @@ class LocalAIClient {
                 if (app === 'screenshot') {
                     this.takeScreenshot();
                 } else {
-                    this.executeCommand(app);
+                    this.executeCommandRequest(app);
                 }
             });
         });
@@ -347,61 +387,191 @@ class LocalAIClient {
         
         previewDiv.appendChild(imgElement);
         
-        // 保存文件引用
+        // 保存文件引用（原始文件以二进制方式上传分析）
+        this.visionFile = file;
         previewDiv.dataset.fileName = file.name;
         previewDiv.dataset.fileType = file.type;
-        previewDiv.dataset.fileData = canvas.toDataURL('image/jpeg', 0.8);
     }
 
-    async analyzeImage() {
-        const previewDiv = document.getElementById('image-preview');
-        const imageData = previewDiv.dataset.fileData;
+    analyzeImage() {
+        // 分析进行中时按钮用于取消
+        if (this.currentVisionRequest) {
+            this.cancelImageAnalysis();
+            return;
+        }
+        
+        const file = this.visionFile;
         const prompt = document.getElementById('analysis-prompt').value;
+        const resolution = document.getElementById('analysis-resolution').value;
         
-        if (!imageData || imageData === 'data:,') {
+        if (!file) {
             this.showError('请先上传图片');
             return;
         }
         
+        const requestId = 'vision_' + Date.now();
+        this.currentVisionRequest = requestId;
+        this.currentVisionText = '';
+        
         const analyzeBtn = document.getElementById('analyze-btn');
-        const originalText = analyzeBtn.innerHTML;
-        analyzeBtn.innerHTML = '<span class="loading"></span> 分析中...';
-        analyzeBtn.disabled = true;
+        this.analyzeBtnText = analyzeBtn.innerHTML;
+        analyzeBtn.innerHTML = '<i class="fas fa-stop"></i> 停止分析';
+        
+        const resultDiv = document.getElementById('result-content');
+        resultDiv.innerHTML = `
+            <div class="result-section">
+                <h4><i class="fas fa-align-left"></i> 详细分析</h4>
+                <p id="vision-stream"><span class="loading"></span> 分析中...</p>
+            </div>
+        `;
+        
+        // 直接发送原始文件（二进制附件），无需转换为 data URL
+        this.socket.emit('vision_message', {
+            request_id: requestId,
+            image: file,
+            prompt: prompt,
+            resolution: resolution
+        });
+    }
+
+    async analyzeScreen() {
+        const btn = document.getElementById('screen-analyze-btn');
+        const originalText = btn.innerHTML;
+        btn.innerHTML = '<span class="loading"></span> 分析中...';
+        btn.disabled = true;
         
         try {
-            // 将base64转换为Blob
-            const response = await fetch(imageData);
-            const blob = await response.blob();
-            
-            const formData = new FormData();
-            formData.append('image', blob, 'image.jpg');
-            formData.append('prompt', prompt);
-            
-            const result = await fetch('/api/vision', {
+            // 截图、预处理和分析全部在服务端完成，图片不经过浏览器
+            const response = await fetch('/api/system/screenshot/analyze', {
                 method: 'POST',
-                body: formData
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    prompt: document.getElementById('analysis-prompt').value,
+                    resolution: document.getElementById('analysis-resolution').value
+                })
             });
-            
-            const data = await result.json();
+            const data = await response.json();
             
             if (data.error) {
                 this.showError(data.error);
             } else {
+                const timing = data.timing;
+                data.description += `\n耗时: 截图 ${timing.capture_ms}ms / 预处理 ${timing.preprocess_ms || 0}ms / 分析 ${timing.inference_ms || 0}ms / 总计 ${timing.total_ms}ms`;
                 this.displayAnalysisResult(data);
             }
         } catch (error) {
-            this.showError('分析失败: ' + error.message);
+            this.showError('屏幕分析失败: ' + error.message);
         } finally {
-            analyzeBtn.innerHTML = originalText;
-            analyzeBtn.disabled = false;
+            btn.innerHTML = originalText;
+            btn.disabled = false;
+        }
+    }
+
+    cancelImageAnalysis() {
+        if (!this.currentVisionRequest) return;
+        this.socket.emit('vision_cancel', { request_id: this.currentVisionRequest });
+    }
+
+    handleVisionChunk(data) {
+        if (data.request_id !== this.currentVisionRequest) return;
+        
+        if (!data.done) {
+            this.currentVisionText += data.chunk;
+            const streamDiv = document.getElementById('vision-stream');
+            if (streamDiv) {
+                streamDiv.textContent = this.currentVisionText;
+            }
+            return;
+        }
+        
+        this.currentVisionRequest = null;
+        const analyzeBtn = document.getElementById('analyze-btn');
+        analyzeBtn.innerHTML = this.analyzeBtnText;
+        
+        if (data.error) {
+            this.showError('分析失败: ' + data.error);
+        } else if (data.cancelled) {
+            this.showMessage('已停止分析', 'info');
+        } else {
+            this.displayAnalysisResult({
+                analysis: data.full_response,
+                description: data.description,
+                cache: data.cache,
+                resolution: data.resolution
+            });
+        }
+    }
+
+    toggleScreenWatch() {
+        if (this.screenWatchId) {
+            this.socket.emit('screen_watch_stop', { watch_id: this.screenWatchId });
+            return;
+        }
+        
+        this.socket.emit('screen_watch_start', {
+            prompt: document.getElementById('analysis-prompt').value
+        });
+        document.getElementById('result-content').innerHTML = '<div id="watch-status">正在启动屏幕监视...</div>';
+    }
+
+    handleScreenWatchEvent(data) {
+        const btn = document.getElementById('screen-watch-btn');
+        const statusDiv = document.getElementById('watch-status');
+        
+        switch (data.type) {
+            case 'accepted':
+                this.screenWatchId = data.watch_id;
+                btn.innerHTML = '<i class="fas fa-stop"></i> 停止监视';
+                break;
+            case 'started':
+                if (statusDiv) statusDiv.textContent = `监视中，每 ${data.interval} 秒检查一次画面变化`;
+                break;
+            case 'change':
+                if (statusDiv) statusDiv.textContent = `检测到画面变化（${(data.ratio * 100).toFixed(1)}%），等待画面稳定...`;
+                break;
+            case 'analysis': {
+                if (statusDiv) statusDiv.textContent = '监视中';
+                const section = document.createElement('div');
+                section.className = 'result-section';
+                const scope = data.cropped ? `区域 ${data.box.join(',')}` : '整个画面';
+                section.innerHTML = `
+                    <h4><i class="fas fa-eye"></i> ${new Date().toLocaleTimeString()} · ${scope}</h4>
+                    <p>${this.escapeHtml(data.analysis)}</p>
+                `;
+                if (statusDiv) {
+                    statusDiv.after(section);
+                } else {
+                    document.getElementById('result-content').prepend(section);
+                }
+                break;
+            }
+            case 'error':
+                this.showError('屏幕监视: ' + data.error);
+                break;
+            case 'stopped':
+                if (data.watch_id !== this.screenWatchId) return;
+                this.screenWatchId = null;
+                btn.innerHTML = '<i class="fas fa-eye"></i> 监视屏幕';
+                if (statusDiv) statusDiv.textContent = `监视已停止（截图 ${data.stats.frames} 次，分析 ${data.stats.analyses} 次）`;
+                break;
         }
     }
 
     displayAnalysisResult(data) {
         const resultDiv = document.getElementById('result-content');
+        const tiled = data.resolution && data.resolution.mode === 'tiled';
+        const cacheBadge = data.cache && data.cache.hit
+            ? `<span class="cache-badge" title="${new Date(data.cache.cached_at * 1000).toLocaleString()}">
+                   <i class="fas fa-bolt"></i> ${data.cache.match === 'similar' ? '相似图片缓存' : '缓存结果'}
+               </span>`
+            : '';
+        const tileBadge = tiled
+            ? `<span class="cache-badge"><i class="fas fa-th"></i> 切片 ${data.resolution.rows}×${data.resolution.cols}${
+                   data.cache && data.cache.tiles_cached ? `（${data.cache.tiles_cached}/${data.cache.tiles} 个区域命中缓存）` : ''}</span>`
+            : '';
         resultDiv.innerHTML = `
             <div class="result-section">
-                <h4><i class="fas fa-align-left"></i> 详细分析</h4>
+                <h4><i class="fas fa-align-left"></i> 详细分析 ${tileBadge}${cacheBadge}</h4>
                 <p>${this.escapeHtml(data.analysis)}</p>
             </div>
             <div class="result-section">
@@ -411,9 +581,72 @@ class LocalAIClient {
         `;
     }
 
-    async executeCommand(command) {
+    executeCommand(command) {
         if (!command) return;
         
+        const resultDiv = document.getElementById('command-result');
+        resultDiv.innerHTML = `
+            <span id="command-status"><span class="loading"></span> 执行中...</span>
+            <button class="btn-secondary" id="command-cancel-btn">
+                <i class="fas fa-stop"></i> 停止
+            </button>
+            <pre id="command-output"></pre>
+        `;
+        document.getElementById('command-cancel-btn').addEventListener('click', () => {
+            if (this.currentCommandRun) {
+                this.socket.emit('command_cancel', { run_id: this.currentCommandRun });
+            }
+        });
+        
+        // 白名单命令通过 WebSocket 逐行返回输出
+        this.currentCommand = { command, requestId: Date.now().toString(36) + Math.random().toString(36).slice(2, 8) };
+        this.currentCommandRun = null;
+        this.socket.emit('command_execute', { command, request_id: this.currentCommand.requestId });
+    }
+
+    handleCommandOutput(data) {
+        if (!this.currentCommand || data.request_id !== this.currentCommand.requestId) return;
+        
+        const outputPre = document.getElementById('command-output');
+        const statusSpan = document.getElementById('command-status');
+        
+        if (data.type === 'accepted') {
+            this.currentCommandRun = data.run_id;
+        } else if (data.type === 'line') {
+            const line = document.createElement('span');
+            if (data.stream === 'stderr') line.style.color = '#e74c3c';
+            line.textContent = data.line + '\n';
+            outputPre.appendChild(line);
+            outputPre.scrollTop = outputPre.scrollHeight;
+        } else if (data.type === 'exit') {
+            const command = this.currentCommand.command;
+            this.currentCommand = null;
+            this.currentCommandRun = null;
+            const cancelBtn = document.getElementById('command-cancel-btn');
+            if (cancelBtn) cancelBtn.remove();
+            
+            if (data.status === 'rejected') {
+                // 非白名单命令（如启动应用程序）走普通接口
+                this.executeCommandRequest(command);
+                return;
+            }
+            
+            const messages = {
+                completed: `命令执行完成（返回码 ${data.return_code}，${data.duration_ms}ms）`,
+                cancelled: '命令已取消',
+                timeout: '命令执行超时',
+                cpu_limit: '命令超过 CPU 时间限制',
+                output_limit: '命令输出超过大小限制，已终止',
+                failed: `命令执行失败: ${data.error || ''}`
+            };
+            const ok = data.status === 'completed';
+            statusSpan.innerHTML = `<span style="color: ${ok ? '#2ecc71' : '#e74c3c'};">
+                <i class="fas fa-${ok ? 'check' : 'times'}-circle"></i> ${this.escapeHtml(messages[data.status] || data.status)}
+            </span>`;
+        }
+    }
+
+    async executeCommandRequest(command) {
         const resultDiv = document.getElementById('command-result');
         resultDiv.innerHTML = '<span class="loading"></span> 执行中...';
         
@@ -449,22 +682,20 @@ class LocalAIClient {
 
     async takeScreenshot() {
         try {
+            // 截图以二进制图片返回，避免 base64 JSON 膨胀
             const response = await fetch('/api/system/screenshot');
-            const data = await response.json();
             
-            if (data.error) {
+            if (!response.ok) {
+                const data = await response.json();
                 this.showError(data.error);
-            } else {
-                // 在聊天中显示截图
-                this.appendMessage(`<img src="${data.screenshot}" style="max-width: 300px; border-radius: 8px;">`, 'user');
-                
-                // 同时发送给AI分析
-                const img = new Image();
-                img.onload = () => {
-                    // 这里可以添加截图分析功能
-                };
-                img.src = data.screenshot;
+                return;
             }
+            
+            const blob = await response.blob();
+            const url = URL.createObjectURL(blob);
+            
+            // 在聊天中显示截图
+            this.appendMessage(`<img src="${url}" style="max-width: 300px; border-radius: 8px;">`, 'user');
         } catch (error) {
             this.showError('截图失败: ' + error.message);
         }
@@ -483,29 +714,52 @@ class LocalAIClient {
                 return;
             }
             
-            // 格式化显示
-            const formatBytes = (bytes) => {
-                const gb = (bytes / (1024 ** 3)).toFixed(2);
-                return gb + ' GB';
-            };
-            
-            infoDiv.innerHTML = `
-                <div class="info-item">
-                    <i class="fas fa-microchip"></i> CPU: ${data.cpu.percent.toFixed(1)}% 使用率 (${data.cpu.cores}核)
-                </div>
-                <div class="info-item">
-                    <i class="fas fa-memory"></i> 内存: ${formatBytes(data.memory.used)}/${formatBytes(data.memory.total)} (${data.memory.percent.toFixed(1)}%)
-                </div>
+            this.renderSystemInfo(data);
+        } catch (error) {
+            infoDiv.innerHTML = `<span style="color: #e74c3c;">获取失败: ${error.message}</span>`;
+        }
+    }
+
+    renderSystemInfo(data) {
+        const infoDiv = document.getElementById('system-info');
+        
+        // 格式化显示
+        const formatBytes = (bytes) => {
+            const gb = (bytes / (1024 ** 3)).toFixed(2);
+            return gb + ' GB';
+        };
+        const formatRate = (bytes) => {
+            if (bytes >= 1024 ** 2) return (bytes / (1024 ** 2)).toFixed(1) + ' MB/s';
+            return (bytes / 1024).toFixed(1) + ' KB/s';
+        };
+        
+        let ioItems = '';
+        if (data.disk_io && data.network) {
+            ioItems = `
                 <div class="info-item">
-                    <i class="fas fa-hdd"></i> 磁盘: ${formatBytes(data.disk.used)}/${formatBytes(data.disk.total)} (${data.disk.percent.toFixed(1)}%)
+                    <i class="fas fa-exchange-alt"></i> 磁盘读写: ${formatRate(data.disk_io.read_bytes_per_sec)} / ${formatRate(data.disk_io.write_bytes_per_sec)}
                 </div>
                 <div class="info-item">
-                    <i class="fas fa-tasks"></i> 进程: ${data.system.processes} 个
+                    <i class="fas fa-network-wired"></i> 网络收发: ${formatRate(data.network.recv_bytes_per_sec)} / ${formatRate(data.network.sent_bytes_per_sec)}
                 </div>
             `;
-        } catch (error) {
-            infoDiv.innerHTML = `<span style="color: #e74c3c;">获取失败: ${error.message}</span>`;
         }
+        
+        infoDiv.innerHTML = `
+            <div class="info-item">
+                <i class="fas fa-microchip"></i> CPU: ${data.cpu.percent.toFixed(1)}% 使用率 (${data.cpu.cores}核)
+            </div>
+            <div class="info-item">
+                <i class="fas fa-memory"></i> 内存: ${formatBytes(data.memory.used)}/${formatBytes(data.memory.total)} (${data.memory.percent.toFixed(1)}%)
+            </div>
+            <div class="info-item">
+                <i class="fas fa-hdd"></i> 磁盘: ${formatBytes(data.disk.used || 0)}/${formatBytes(data.disk.total || 0)} (${(data.disk.percent || 0).toFixed(1)}%)
+            </div>
+            <div class="info-item">
+                <i class="fas fa-tasks"></i> 进程: ${data.system.processes} 个
+            </div>
+            ${ioItems}
+        `;
     }
 
     async refreshModels() {
@@ -518,12 +772,13 @@ class LocalAIClient {
             
             await this.loadAvailableModels();
             
-            // 重新设置默认模型
-            const response = await fetch('/config.json');
-            const config = await response.json();
+            // 重新设置默认模型（手动刷新时重新获取配置）
+            this.configPromise = null;
+            const config = await this.getConfig();
             const modelSelect = document.getElementById('model-select');
-            if (config.ollama.default_model && modelSelect.querySelector(`option[value="${config.ollama.default_model}"]`)) {
-                modelSelect.value = config.ollama.default_model;
+            const defaultModel = this.defaultModelChoice(config);
+            if (defaultModel && modelSelect.querySelector(`option[value="${defaultModel}"]`)) {
+                modelSelect.value = defaultModel;
             }
             
             this.showMessage('模型列表已刷新！', 'success');
@@ -542,7 +797,8 @@ class LocalAIClient {
         testBtn.innerHTML = '<span class="loading"></span> 测试中...';
         
         try {
-            const response = await fetch('/health');
+            // 连接测试需要最新结果，其他地方读取服务端缓存的检查结果
+            const response = await fetch('/health?refresh=1');
             const data = await response.json();
             
             if (data.ollama_connected) {
@@ -577,6 +833,14 @@ class LocalAIClient {
         }
     }
 
+    defaultModelChoice(config) {
+        // 启用模型路由时默认自动选择
+        if (config.router && config.router.enabled) {
+            return 'auto';
+        }
+        return config.ollama.default_model;
+    }
+
     async loadAvailableModels() {
         console.log('[DEBUG] 开始加载模型列表...');
         try {
@@ -599,6 +863,14 @@ class LocalAIClient {
             modelSelect.innerHTML = ''; // 清空现有选项
             
             if (data.models && data.models.length > 0) {
+                // 启用模型路由时提供“自动选择”，由服务端按问题类型和延迟目标选择模型
+                if (data.auto) {
+                    const option = document.createElement('option');
+                    option.value = 'auto';
+                    option.textContent = '自动选择';
+                    modelSelect.appendChild(option);
+                }
+                
                 // 为每个模型创建选项
                 data.models.forEach(modelName => {
                     const option = document.createElement('option');
@@ -656,10 +928,25 @@ class LocalAIClient {
         return modelMap[modelName] || modelName;
     }
 
+    getConfig() {
+        // 同一份配置只请求一次；no-cache 让浏览器用 ETag 向服务端确认
+        if (!this.configPromise) {
+            this.configPromise = fetch('/config.json', { cache: 'no-cache' })
+                .then(response => {
+                    if (!response.ok) throw new Error('HTTP ' + response.status);
+                    return response.json();
+                })
+                .catch(error => {
+                    this.configPromise = null;
+                    throw error;
+                });
+        }
+        return this.configPromise;
+    }
+
     async loadSettings() {
         try {
-            const response = await fetch('/config.json');
-            const config = await response.json();
+            const config = await this.getConfig();
             
             // 加载设置到表单
             document.getElementById('ollama-url').value = config.ollama.base_url;
@@ -678,8 +965,9 @@ class LocalAIClient {
             
             // 设置默认模型
             const modelSelect = document.getElementById('model-select');
-            if (config.ollama.default_model) {
-                modelSelect.value = config.ollama.default_model;
+            const defaultModel = this.defaultModelChoice(config);
+            if (defaultModel) {
+                modelSelect.value = defaultModel;
             }
             
             // 同步系统控制开关
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import time
+
+# 启动耗时统计：导入、模块初始化、首个请求
+_STARTUP_BEGIN = time.perf_counter()
+
 import os
 import sys
 import json
 import logging
 import threading
+import contextvars
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from flask_socketio import SocketIO, emit
+from flask import Flask, g, render_template, request, jsonify, send_from_directory, send_file, url_for, Response, stream_with_context
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import base64
 from io import BytesIO
@@ -20,25 +26,33 @@ from core.chat_manager import ChatManager
 from core.vision_processor import VisionProcessor
 from core.system_control import SystemController
 from core.agent import AIAgent
-from core.utils import setup_logging, validate_config
+from core.vision_batch import VisionBatchRunner
+from core.screen_analysis import ScreenAnalyzer
+from core.capture import parse_region
+from core.screen_watch import ScreenWatchManager
+from core.config_service import ConfigService
+from core.session_store import SessionStore, lean_message
+from core.assets import AssetManager
+from core.compression import ResponseCompressor
+from core.utils import setup_logging
+from core.logging_setup import set_request_id, get_request_id, queue_size
+from core.health import HealthMonitor
+from core.ollama_client import OllamaPool
+from core.model_router import ModelRouter, AUTO
+from core.memory import ConversationMemory
+from core.documents import DocumentIndex
+from core.singleflight import SingleFlight, digest, stats as singleflight_stats
+
+_IMPORTS_DONE = time.perf_counter()
 
-# 设置日志
+# 设置日志（先使用默认设置，以便记录配置加载错误）
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# 加载配置
-try:
-    with open('config.json', 'r', encoding='utf-8') as f:
-        config = json.load(f)
-except FileNotFoundError:
-    logger.error("配置文件 config.json 未找到")
-    config = {
-        'webui': {'host': '127.0.0.1', 'port': 7860, 'debug': False},
-        'ollama': {'base_url': 'http://localhost:11434'}
-    }
-
-# 验证配置
-config = validate_config(config)
+# 加载并验证配置，文件变化时自动重新加载
+config_service = ConfigService('config.json')
+config = config_service.config
+setup_logging(config)
 
 # 创建Flask应用
 app = Flask(__name__, 
@@ -50,83 +64,319 @@ app.config['MAX_CONTENT_LENGTH'] = config['system']['max_file_size']
 # 启用CORS
 CORS(app)
 
+# 生产模式下由 gunicorn 启动多个工作进程（见 gunicorn.conf.py），
+# Socket.IO 消息需经消息队列转发给连接在其他进程上的客户端
+WORKERS = int(os.environ.get('LOCALAI_WORKERS', '1'))
+socketio_options = {}
+if WORKERS > 1:
+    message_queue = config['webui'].get('message_queue', 'local')
+    if message_queue == 'local':
+        from core.socket_bus import LocalSocketManager
+        socketio_options['client_manager'] = LocalSocketManager(config['webui']['message_queue_dir'])
+    elif message_queue:
+        socketio_options['message_queue'] = message_queue
+
 # 初始化SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# 视觉分析通过 Socket.IO 直接上传二进制图片，需放宽单条消息大小限制
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading',
+                    max_http_buffer_size=config['system']['max_file_size'] + 64 * 1024,
+                    **socketio_options)
+
+# 构建静态资源（带哈希文件名、预压缩），模板中通过 asset_url 引用
+asset_manager = AssetManager(config, app.static_folder)
+asset_manager.start()
+
+@app.context_processor
+def inject_asset_url():
+    def asset_url(filename):
+        fingerprinted = asset_manager.url_path(filename)
+        if fingerprinted is None:
+            return url_for('static', filename=filename)
+        return url_for('serve_asset', filename=fingerprinted)
+    return {'asset_url': asset_url}
+
+# JSON 等文本响应按 Accept-Encoding 压缩
+response_compressor = ResponseCompressor(config)
+
+@app.before_request
+def bind_request_id():
+    """每个请求使用客户端传入或新生成的请求 ID，写入该请求期间的所有日志"""
+    set_request_id(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def compress_response(response):
+    response.headers['X-Request-ID'] = get_request_id()
+    return response_compressor.process(response, request.headers.get('Accept-Encoding', ''))
+
+# Ollama 后端池（可配置多个实例），各模块共用
+ollama_pool = OllamaPool(config)
+ollama_pool.start()
+
+# 长期对话记忆（检索相关的早期片段代替完整历史）
+conversation_memory = ConversationMemory(config, ollama_pool)
+
+# 本地文档索引（后台扫描、监视配置的目录），对话时自动附加相关片段
+document_index = DocumentIndex(config, ollama_pool)
+document_index.start()
+
+# 合并同一用户重复提交的同一轮对话
+chat_turns = SingleFlight('chat_turn')
+
+# 对话模型路由（客户端选择“自动”时使用），从各模块上报的生成统计中学习模型速度
+model_router = ModelRouter(config, ollama_pool)
 
 # 初始化核心模块
-chat_manager = ChatManager(config)
-vision_processor = VisionProcessor(config)
+chat_manager = ChatManager(config, ollama_pool, document_index)
+vision_processor = VisionProcessor(config, ollama_pool)
 system_controller = SystemController(config)
 
+vision_batch_runner = VisionBatchRunner(config, vision_processor)
+screen_analyzer = ScreenAnalyzer(system_controller, vision_processor)
+screen_watch_manager = ScreenWatchManager(config, system_controller, vision_processor)
+
+# 后台采样系统指标，并推送给订阅的客户端
+# 每个工作进程只推送给连接在本进程上的客户端（ignore_queue），避免多进程时重复推送
+system_controller.metrics_sampler.subscribe(
+    lambda info: socketio.emit('system_metrics', info, room='system_metrics', ignore_queue=True))
+system_controller.metrics_sampler.start()
+
+# 加载应用索引并监视应用目录变化
+system_controller.app_catalog.start()
+
 # 初始化 AI Agent
-agent = AIAgent(config, system_controller, vision_processor)
+agent = AIAgent(config, system_controller, vision_processor, ollama_pool, document_index)
+
+def apply_config(new_config, changed):
+    """配置文件变化后替换全局配置并通知各模块；进行中的流式请求不受影响"""
+    global config
+    config = new_config
+    ollama_pool.apply_config(new_config)
+    model_router.apply_config(new_config)
+    conversation_memory.apply_config(new_config)
+    document_index.apply_config(new_config)
+    chat_manager.apply_config(new_config)
+    vision_processor.apply_config(new_config)
+    system_controller.apply_config(new_config)
+    agent.apply_config(new_config)
+    health_monitor.apply_config(new_config)
+    if 'logging' in changed:
+        setup_logging(new_config)
+    if 'webui' in changed:
+        logger.warning("webui 配置（地址/端口）需重启后生效")
+    socketio.emit('config_updated', {'version': config_service.version, 'etag': config_service.etag,
+                                     'changed': changed}, ignore_queue=True)
+
+config_service.subscribe(apply_config)
+config_service.start()
+
+# 对话历史（SQLite，多个工作进程共享）
+session_store = SessionStore(config)
+
+# 进行中的流式视觉分析 (session_id, request_id) -> 取消事件
+vision_tasks = {}
+vision_tasks_lock = threading.Lock()
+
+startup_report = {
+    'import_ms': round((_IMPORTS_DONE - _STARTUP_BEGIN) * 1000, 1),
+    'init_ms': round((time.perf_counter() - _IMPORTS_DONE) * 1000, 1),
+    'first_request_ms': None
+}
+logger.info(f"启动耗时: 导入 {startup_report['import_ms']}ms, 初始化 {startup_report['init_ms']}ms")
+
+# 处理中的 HTTP 请求数，用于负载饱和判断
+inflight_requests = 0
+inflight_lock = threading.Lock()
+
+@app.before_request
+def count_request():
+    global inflight_requests
+    with inflight_lock:
+        inflight_requests += 1
+    g.counted = True
+
+@app.teardown_request
+def release_request(exc):
+    global inflight_requests
+    if g.pop('counted', False):
+        with inflight_lock:
+            inflight_requests -= 1
 
-# 存储对话历史
-conversations = {}
+# 后台健康检查，/health 和 /ready 只读取缓存结果
+health_monitor = HealthMonitor(config, ollama_pool)
+health_monitor.add_gauge('http_requests', lambda: (inflight_requests, config['webui'].get('threads', 32)))
+health_monitor.add_gauge('commands', system_controller.command_runner.load)
+health_monitor.add_gauge('log_queue', lambda: (queue_size(), config['health'].get('log_queue_limit', 10000)))
+health_monitor.start()
+
+@app.before_request
+def record_first_request():
+    if startup_report['first_request_ms'] is None:
+        startup_report['first_request_ms'] = round((time.perf_counter() - _STARTUP_BEGIN) * 1000, 1)
+        logger.info(f"首个请求距进程启动 {startup_report['first_request_ms']}ms")
 
 @app.route('/')
 def index():
-    """主页面"""
+    """主页面（模型列表由前端通过 /api/models 异步加载，不等待 Ollama）"""
     return render_template('index.html', 
-                         models=chat_manager.get_available_models())
+                         # 多进程时客户端只使用 WebSocket，连接始终落在同一工作进程上
+                         socket_transports=['websocket'] if WORKERS > 1 else None)
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """带哈希文件名的静态资源：按 Accept-Encoding 返回预压缩版本，长期缓存"""
+    resolved = asset_manager.resolve(filename, request.headers.get('Accept-Encoding', ''))
+    if resolved is None:
+        return jsonify({'error': '资源不存在'}), 404
+    path, encoding, mimetype = resolved
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={asset_manager.max_age}, immutable'
+    return response
 
 @app.route('/config.json')
 def get_config():
-    """返回配置文件内容"""
+    """返回当前生效的配置（预先序列化，支持 ETag/304）"""
+    response = Response(config_service.payload, mimetype='application/json')
+    response.set_etag(config_service.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/system/startup')
+def get_startup_report():
+    """启动耗时（导入、初始化、首个请求）"""
+    return jsonify(dict(startup_report, pid=os.getpid()))
+
+@app.route('/api/ollama/backends')
+def get_ollama_backends():
+    """各 Ollama 后端的状态、已加载模型和请求统计"""
+    return jsonify({'backends': ollama_pool.stats()})
+
+@app.route('/api/singleflight/stats')
+def get_singleflight_stats():
+    """各合并组的调用次数、合并率和进行中的调用数（每个工作进程独立统计）"""
+    return jsonify({'groups': singleflight_stats(), 'pid': os.getpid()})
+
+@app.route('/api/memory/stats')
+def get_memory_stats():
+    """对话记忆的检索耗时、嵌入队列和节省的提示词 token 数"""
+    return jsonify(conversation_memory.stats())
+
+@app.route('/api/documents/stats')
+def get_documents_stats():
+    """文档索引的文件数、块数、索引吞吐和检索耗时"""
+    return jsonify(document_index.stats())
+
+@app.route('/api/documents/search')
+def search_documents():
+    """检索本地文档片段: ?q=问题&limit=5"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '检索内容不能为空'}), 400
+    if not document_index.enabled:
+        return jsonify({'error': '未启用本地文档索引'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', document_index.top_k)), 50))
+    except ValueError:
+        return jsonify({'error': 'limit 必须是整数'}), 400
     try:
-        with open('config.json', 'r', encoding='utf-8') as f:
-            return jsonify(json.load(f))
+        return jsonify({'results': document_index.search(query, limit)})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        logger.error(f"文档检索失败: {str(e)}")
+        return jsonify({'error': f'文档检索失败: {str(e)}'}), 503
+
+@app.route('/api/documents/reindex', methods=['POST'])
+def reindex_documents():
+    """立即重新扫描文档目录（只索引有变化的文件）；由其他工作进程维护索引时转发给该进程"""
+    if not document_index.enabled:
+        return jsonify({'error': '未启用本地文档索引'}), 400
+    try:
+        forwarded = document_index.rescan()
+    except Exception as e:
+        return jsonify({'error': f'转发重新扫描请求失败: {str(e)}'}), 503
+    return jsonify({'success': True, 'forwarded': forwarded})
+
+@app.route('/api/router/stats')
+def get_router_stats():
+    """模型路由学习到的各模型速度和最近的路由决策"""
+    return jsonify(model_router.stats())
 
 @app.route('/api/models')
 def get_models():
     """获取可用模型列表"""
     models = chat_manager.get_available_models()
-    return jsonify({'models': models})
+    return jsonify({'models': models, 'auto': model_router.enabled})
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """文本对话API"""
+    """文本对话API
+
+    请求中带 cursor（上次返回的游标，首次为 0）时只返回游标之后的新消息，
+    否则按原方式返回最近 10 条历史
+    """
     data = request.json
     user_id = data.get('user_id', 'default')
     message = data.get('message', '')
-    model = data.get('model', config['ollama']['default_model'])
     use_agent = data.get('use_agent', True)  # 默认启用 Agent 模式
+    if data.get('request_id'):
+        # 请求体中的 ID 优先，否则保留 before_request 中取自 X-Request-ID 的 ID
+        set_request_id(data['request_id'])
     
     if not message:
         return jsonify({'error': '消息不能为空'}), 400
     
-    # 初始化用户对话历史
-    if user_id not in conversations:
-        conversations[user_id] = []
+    cursor = data.get('cursor')
+    if cursor is not None:
+        try:
+            cursor = int(cursor)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'cursor 必须是整数'}), 400
     
-    # 添加用户消息到历史
-    conversations[user_id].append({'role': 'user', 'content': message})
+    use_tools = use_agent and config['system'].get('allow_system_control', False)
+    # 明确指定的模型直接使用，"auto" 或未指定时由路由器选择
+    requested = data.get('model') or AUTO
     
-    try:
+    def turn():
+        # 添加用户消息到历史
+        session_store.append(user_id, {'role': 'user', 'content': message})
+        history = session_store.get(user_id)
+        # 长对话只发送最近的消息和检索到的相关早期片段
+        messages, memory = conversation_memory.build_prompt(user_id, history)
+        start = len(messages)
+        model, route = model_router.route(messages, requested, use_tools)
+        
         # 判断是否使用 Agent 模式
-        if use_agent and config['system'].get('allow_system_control', False):
+        if use_tools:
             # 使用 Agent 模式，支持工具调用
             response = agent.chat_with_tools(
-                messages=conversations[user_id],
+                messages=messages,
                 model=model
             )
         else:
             # 普通对话模式
             response = chat_manager.chat(
-                messages=conversations[user_id],
+                messages=messages,
                 model=model,
                 stream=False
             )
         
-        # 添加AI回复到历史
-        conversations[user_id].append({'role': 'assistant', 'content': response})
+        # 保存工具调用记录和AI回复
+        messages.append({'role': 'assistant', 'content': response})
+        session_store.extend(user_id, messages[start:])
+        conversation_memory.remember(user_id, len(history) - 1, message, response)
+        return {'response': response, 'model': model, 'route': route, 'memory': memory}
+    
+    try:
+        # 同一用户重复提交同一条消息（双击、重试）时共享进行中的这一轮对话
+        result = chat_turns.do(digest('api', user_id, message, requested, use_tools), turn)
         
-        return jsonify({
-            'response': response,
-            'history': conversations[user_id][-10:]  # 返回最近10条
-        })
+        if cursor is not None:
+            delta, cursor = session_store.since(user_id, cursor)
+            limit = config['webui']['chat_tool_preview']
+            return jsonify(dict(result, messages=[lean_message(m, limit) for m in delta], cursor=cursor))
+        
+        return jsonify(dict(result, history=session_store.get(user_id, 10)))  # 返回最近10条
     except Exception as e:
         logger.error(f"聊天错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -135,23 +385,98 @@ def chat():
 def vision_analysis():
     """图像理解API"""
     try:
-        if 'image' not in request.files:
+        # 支持 multipart 表单或直接以 image/* 请求体上传二进制图片
+        if 'image' in request.files:
+            image_file = request.files['image']
+            prompt = request.form.get('prompt', '描述这张图片')
+            resolution = request.form.get('resolution', 'auto')
+        elif request.mimetype.startswith('image/'):
+            image_file = request.get_data()
+            prompt = request.args.get('prompt', '描述这张图片')
+            resolution = request.args.get('resolution', 'auto')
+        else:
             return jsonify({'error': '没有上传图片'}), 400
         
-        image_file = request.files['image']
-        prompt = request.form.get('prompt', '描述这张图片')
+        if not image_file:
+            return jsonify({'error': '没有上传图片'}), 400
         
         # 处理图像
-        result = vision_processor.analyze_image(image_file, prompt)
+        result = vision_processor.analyze_image(image_file, prompt, resolution)
         
         return jsonify({
             'analysis': result['analysis'],
-            'description': result['description']
+            'description': result['description'],
+            'cache': result.get('cache', {'hit': False}),
+            'resolution': result.get('resolution', {'mode': 'single'})
         })
     except Exception as e:
         logger.error(f"视觉分析错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/vision/batch', methods=['POST'])
+def vision_batch():
+    """批量图像理解API，以 NDJSON 按完成顺序流式返回结果"""
+    try:
+        if request.files:
+            params = request.form
+            items = vision_batch_runner.collect_uploads(request.files.getlist('images'))
+        else:
+            params = request.json or {}
+            directory = params.get('directory', '')
+            if not directory:
+                return jsonify({'error': '请上传图片或指定目录'}), 400
+            # 读取本地目录属于系统控制能力
+            if not config['system'].get('allow_system_control', False):
+                return jsonify({'error': '系统控制功能已禁用，无法读取本地目录'}), 403
+            items = vision_batch_runner.collect_directory(directory, bool(params.get('recursive', False)))
+        
+        if not items:
+            return jsonify({'error': '没有找到可分析的图片'}), 400
+        
+        job_id = params.get('job_id') or vision_batch_runner.new_job_id()
+        if not vision_batch_runner.is_valid_job_id(job_id):
+            return jsonify({'error': '无效的任务ID'}), 400
+        
+        prompt = params.get('prompt', '')
+        if not prompt:
+            status = vision_batch_runner.job_status(job_id)
+            prompt = (status and status['prompt']) or '描述这张图片'
+        resume_error = vision_batch_runner.resume_error(job_id, prompt)
+        if resume_error:
+            return jsonify({'error': resume_error}), 400
+        # 表单和 JSON 中的并发数都可能是字符串，开始流式输出前校验
+        concurrency = params.get('concurrency')
+        if concurrency in (None, ''):
+            concurrency = None
+        else:
+            try:
+                concurrency = int(concurrency)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'concurrency 必须是整数'}), 400
+        
+        def generate():
+            for record in vision_batch_runner.run(items, prompt, job_id, concurrency):
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+        
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson',
+                        headers={'X-Job-ID': job_id})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"批量视觉分析错误: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/vision/batch/<job_id>', methods=['GET'])
+def vision_batch_status(job_id):
+    """查询批量任务进度"""
+    if not vision_batch_runner.is_valid_job_id(job_id):
+        return jsonify({'error': '无效的任务ID'}), 400
+    status = vision_batch_runner.job_status(job_id)
+    if status is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(status)
+
 @app.route('/api/system/info', methods=['GET'])
 def get_system_info():
     """获取系统信息"""
@@ -162,6 +487,26 @@ def get_system_info():
         logger.error(f"获取系统信息错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/system/processes', methods=['GET'])
+def get_top_processes():
+    """占用最高的进程：sort=cpu/memory/io，limit 为数量"""
+    sort_by = request.args.get('sort', 'cpu')
+    if sort_by not in ('cpu', 'memory', 'io'):
+        return jsonify({'error': f'不支持的排序方式: {sort_by}'}), 400
+    
+    result = system_controller.get_top_processes(sort_by, request.args.get('limit', 10, type=int))
+    if 'error' in result:
+        return jsonify(result), 500
+    return jsonify(result)
+
+@app.route('/api/system/history', methods=['GET'])
+def get_system_history():
+    """系统指标历史：seconds 为时间范围，points 为最多返回的点数，per_core=1 时附带每核 CPU"""
+    seconds = min(request.args.get('seconds', 300, type=float), config['metrics']['history_seconds'])
+    points = max(1, min(request.args.get('points', 120, type=int), 1000))
+    per_core = request.args.get('per_core') in ('1', 'true')
+    return jsonify(system_controller.metrics_sampler.history(seconds, points, per_core))
+
 @app.route('/api/system/command', methods=['POST'])
 def system_command():
     """系统命令API"""
@@ -181,27 +526,142 @@ def system_command():
         logger.error(f"系统命令错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _capture_target(params) -> dict:
+    """从请求参数解析截图范围：monitor=编号、region=x,y,宽,高 或 window=active"""
+    region = params.get('region')
+    monitor = params.get('monitor')
+    return {
+        'monitor': int(monitor) if monitor not in (None, '') else None,
+        'region': parse_region(region) if region else None,
+        'active_window': params.get('window') == 'active'
+    }
+
+def _sse(events):
+    """将事件序列编码为 Server-Sent Events"""
+    for event in events:
+        if event['type'] == 'keepalive':
+            yield ': keepalive\n\n'
+        else:
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.route('/api/system/command/stream', methods=['POST'])
+def system_command_stream():
+    """流式执行白名单命令（SSE），响应头 X-Run-ID 可用于取消或断线后续读"""
+    command = (request.json or {}).get('command', '')
+    if not command:
+        return jsonify({'error': '命令不能为空'}), 400
+    
+    try:
+        run = system_controller.start_command(command)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 429
+    
+    response = Response(stream_with_context(_sse(run.events())), mimetype='text/event-stream')
+    response.headers['X-Run-ID'] = run.run_id
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/system/command/<run_id>/events', methods=['GET'])
+def system_command_events(run_id):
+    """续读命令输出，since 为起始行号"""
+    run = system_controller.command_runner.get(run_id)
+    if run is None:
+        return jsonify({'error': '命令不存在'}), 404
+    events = run.events(since=request.args.get('since', 0, type=int))
+    return Response(stream_with_context(_sse(events)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/system/command/<run_id>/cancel', methods=['POST'])
+def system_command_cancel(run_id):
+    """取消正在执行的命令"""
+    return jsonify({'cancelled': system_controller.command_runner.cancel(run_id)})
+
 @app.route('/api/system/screenshot', methods=['GET'])
 def take_screenshot():
-    """屏幕截图API"""
+    """屏幕截图API
+    
+    默认直接返回图片二进制（带 ETag，屏幕未变化时返回 304）；
+    ?encoding=base64 返回旧版 JSON 格式。可通过 format/quality/max_dimension/grayscale 覆盖配置，
+    通过 monitor/region/window=active 指定截图范围。
+    """
     try:
-        screenshot_data = system_controller.take_screenshot()
+        grayscale = request.args.get('grayscale')
+        screenshot = system_controller.capture_screenshot(
+            fmt=request.args.get('format'),
+            quality=request.args.get('quality', type=int),
+            max_dimension=request.args.get('max_dimension', type=int),
+            grayscale=None if grayscale is None else grayscale.lower() in ('1', 'true', 'yes'),
+            **_capture_target(request.args)
+        )
         
-        # 返回base64编码的图片
-        return jsonify({
-            'screenshot': f"data:image/png;base64,{screenshot_data}",
-            'timestamp': datetime.now().isoformat()
-        })
+        if request.args.get('encoding') == 'base64':
+            screenshot_data = base64.b64encode(screenshot['data']).decode('utf-8')
+            return jsonify({
+                'screenshot': f"data:{screenshot['mimetype']};base64,{screenshot_data}",
+                'width': screenshot['width'],
+                'height': screenshot['height'],
+                'timestamp': datetime.now().isoformat()
+            })
+        
+        response = Response(screenshot['data'], mimetype=screenshot['mimetype'])
+        response.set_etag(screenshot['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Screenshot-Size'] = f"{screenshot['width']}x{screenshot['height']}"
+        response.headers['X-Screenshot-Timestamp'] = datetime.now().isoformat()
+        return response.make_conditional(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"截图错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/system/screenshot/analyze', methods=['POST'])
+def analyze_screenshot():
+    """服务端截图并分析，返回分析结果和各阶段耗时"""
+    data = request.json or {}
+    prompt = data.get('prompt') or '描述屏幕上的内容'
+    resolution = data.get('resolution', 'auto')
+    
+    try:
+        target = _capture_target(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        result = screen_analyzer.analyze(prompt, resolution, **target)
+        if not result.get('success'):
+            # 截图失败只有 error；分析失败保留 analysis 中的错误说明
+            return jsonify({'error': result['error']} if 'error' in result else result), 500
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"截图分析错误: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/capture', methods=['GET'])
+def capture_info():
+    """截图后端信息：当前后端、显示器列表和截图耗时，?compare=1 时对比所有可用后端"""
+    try:
+        info = system_controller.screen_capture.stats()
+        info['monitors'] = system_controller.screen_capture.monitors()
+        if request.args.get('compare') in ('1', 'true'):
+            info['compare'] = system_controller.screen_capture.compare_backends(
+                repeat=max(1, min(request.args.get('repeat', 5, type=int), 20)))
+        return jsonify(info)
+    except Exception as e:
+        logger.error(f"获取截图后端信息错误: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/system/apps', methods=['GET'])
 def get_applications():
-    """获取可用应用程序列表"""
+    """获取可用应用程序列表，?q= 按名称/拼音搜索"""
     try:
-        apps = system_controller.get_available_apps()
-        return jsonify({'applications': apps})
+        query = request.args.get('q', '').strip()
+        apps = system_controller.get_available_apps(query or None,
+                                                    limit=min(request.args.get('limit', 20, type=int), 100))
+        return jsonify({'applications': apps, 'ready': system_controller.app_catalog.ready.is_set()})
     except Exception as e:
         logger.error(f"获取应用程序错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -234,93 +694,222 @@ def handle_chat_message(data):
     """WebSocket聊天消息"""
     user_id = data.get('user_id', 'default')
     message = data.get('message', '')
-    model = data.get('model', config['ollama']['default_model'])
     use_agent = data.get('use_agent', True)  # 默认启用 Agent 模式
+    set_request_id(data.get('request_id'))
     
     if not message:
         emit('error', {'message': '消息不能为空'})
         return
     
-    # 初始化用户对话历史
-    if user_id not in conversations:
-        conversations[user_id] = []
+    # 获取当前会话ID
+    from flask import request
+    session_id = request.sid
+    use_tools = use_agent and config['system'].get('allow_system_control', False)
+    # 明确指定的模型直接使用，"auto" 或未指定时由路由器选择
+    requested = data.get('model') or AUTO
+    # 同一用户重复提交同一条消息（双击、多个标签页）时加入进行中的这一轮对话，
+    # 先收到已生成的部分，不重复写入历史和调用模型
+    key = digest('socket', user_id, message, requested, use_tools)
     
+    def stream_response():
+        try:
+            for event in chat_turns.stream(key, lambda: chat_turn_events(user_id, message, requested, use_tools)):
+                socketio.emit('chat_chunk', event, room=session_id)
+        except Exception as e:
+            logger.error(f"流式对话错误: {str(e)}")
+            socketio.emit('error', {'message': str(e)}, room=session_id)
+    
+    # 在新线程中处理流式响应（复制上下文以沿用请求 ID）
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(stream_response,))
+    thread.start()
+
+def chat_turn_events(user_id, message, requested, use_tools):
+    """一轮流式对话：写入用户消息、选择模型、生成并保存回复，依次产出发给客户端的 chat_chunk 事件"""
     # 添加用户消息
-    conversations[user_id].append({'role': 'user', 'content': message})
+    session_store.append(user_id, {'role': 'user', 'content': message})
+    history = session_store.get(user_id)
+    # 长对话只发送最近的消息和检索到的相关早期片段
+    messages, memory = conversation_memory.build_prompt(user_id, history)
+    start = len(messages)
+    model, route = model_router.route(messages, requested, use_tools)
+    
+    if use_tools:
+        # Agent 模式：支持工具调用，会把工具调用和回复追加到 messages
+        chunks = agent.chat_with_tools_stream(messages=messages, model=model)
+    else:
+        # 普通流式响应
+        chunks = chat_manager.chat_stream(messages=messages, model=model)
+    
+    full_response = ""
+    for chunk in chunks:
+        full_response += chunk
+        yield {'chunk': chunk, 'done': False}
+    
+    if use_tools:
+        session_store.extend(user_id, messages[start:])
+    else:
+        # 添加AI回复到历史
+        session_store.append(user_id, {'role': 'assistant', 'content': full_response})
+    conversation_memory.remember(user_id, len(history) - 1, message, full_response)
+    
+    # 发送结束标志
+    yield {'chunk': '', 'done': True, 'full_response': full_response, 'model': model, 'route': route,
+           'memory': memory}
+
+@socketio.on('vision_message')
+def handle_vision_message(data):
+    """WebSocket流式视觉分析（图片以二进制附件上传）"""
+    image = data.get('image')
+    prompt = data.get('prompt') or '描述这张图片'
+    request_id = data.get('request_id', '')
+    resolution = data.get('resolution', 'auto')
+    set_request_id(request_id)
+    
+    # 兼容 data URL 形式的图片
+    if isinstance(image, str) and image.startswith('data:'):
+        image = base64.b64decode(image.split(',', 1)[-1])
+    
+    if not image:
+        emit('vision_chunk', {'request_id': request_id, 'chunk': '', 'done': True, 'error': '没有上传图片'})
+        return
     
-    # 获取当前会话ID
-    from flask import request
     session_id = request.sid
+    cancel_event = threading.Event()
+    with vision_tasks_lock:
+        vision_tasks[(session_id, request_id)] = cancel_event
     
-    try:
-        # 判断是否使用 Agent 模式
-        if use_agent and config['system'].get('allow_system_control', False):
-            # Agent 模式：流式输出
-            def agent_response():
-                try:
-                    full_response = ""
-                    for chunk in agent.chat_with_tools_stream(
-                        messages=conversations[user_id],
-                        model=model
-                    ):
-                        full_response += chunk
-                        socketio.emit('chat_chunk', {
-                            'chunk': chunk,
-                            'done': False
-                        }, room=session_id)
-                    
-                    # 发送结束标志
-                    socketio.emit('chat_chunk', {
-                        'chunk': '',
-                        'done': True,
-                        'full_response': full_response
-                    }, room=session_id)
-                except Exception as e:
-                    logger.error(f"Agent 流式处理错误: {str(e)}")
-                    socketio.emit('error', {'message': str(e)}, room=session_id)
-            
-            # 在新线程中处理
-            thread = threading.Thread(target=agent_response)
-            thread.start()
-        else:
-            # 普通流式响应
-            def stream_response():
-                full_response = ""
-                for chunk in chat_manager.chat_stream(
-                    messages=conversations[user_id],
-                    model=model
-                ):
-                    full_response += chunk
-                    socketio.emit('chat_chunk', {
-                        'chunk': chunk,
-                        'done': False
-                    }, room=session_id)
-                
-                # 添加AI回复到历史
-                conversations[user_id].append({'role': 'assistant', 'content': full_response})
-                
-                socketio.emit('chat_chunk', {
-                    'chunk': '',
-                    'done': True,
-                    'full_response': full_response
+    def stream_analysis():
+        meta = {}
+        full_response = ""
+        try:
+            for chunk in vision_processor.analyze_image_stream(image, prompt, cancel_event, meta, resolution):
+                full_response += chunk
+                socketio.emit('vision_chunk', {
+                    'request_id': request_id,
+                    'chunk': chunk,
+                    'done': False
                 }, room=session_id)
             
-            # 在新线程中处理流式响应
-            thread = threading.Thread(target=stream_response)
-            thread.start()
-        
-    except Exception as e:
-        logger.error(f"WebSocket聊天错误: {str(e)}")
-        emit('error', {'message': str(e)})
+            socketio.emit('vision_chunk', {
+                'request_id': request_id,
+                'chunk': '',
+                'done': True,
+                'full_response': full_response,
+                'description': meta.get('description', ''),
+                'cache': meta.get('cache', {'hit': False}),
+                'resolution': meta.get('resolution', {'mode': 'single'}),
+                'cancelled': meta.get('cancelled', False)
+            }, room=session_id)
+        except Exception as e:
+            logger.error(f"流式视觉分析错误: {str(e)}")
+            socketio.emit('vision_chunk', {
+                'request_id': request_id,
+                'chunk': '',
+                'done': True,
+                'error': str(e)
+            }, room=session_id)
+        finally:
+            with vision_tasks_lock:
+                vision_tasks.pop((session_id, request_id), None)
+    
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(stream_analysis,))
+    thread.start()
+
+@socketio.on('vision_cancel')
+def handle_vision_cancel(data):
+    """取消流式视觉分析"""
+    with vision_tasks_lock:
+        cancel_event = vision_tasks.get((request.sid, data.get('request_id', '')))
+    if cancel_event:
+        cancel_event.set()
+
+@socketio.on('command_execute')
+def handle_command_execute(data):
+    """流式执行命令，输出通过 command_output 逐行推送"""
+    data = data or {}
+    command = data.get('command', '')
+    request_id = data.get('request_id', '')
+    session_id = request.sid
+    
+    def push(event):
+        event['request_id'] = request_id
+        socketio.emit('command_output', event, room=session_id)
+    
+    try:
+        run = system_controller.start_command(command, push)
+        emit('command_output', {'type': 'accepted', 'run_id': run.run_id, 'request_id': request_id})
+    except (PermissionError, RuntimeError) as e:
+        emit('command_output', {'type': 'exit', 'status': 'rejected', 'error': str(e), 'request_id': request_id})
+
+@socketio.on('command_cancel')
+def handle_command_cancel(data):
+    """取消命令"""
+    system_controller.command_runner.cancel((data or {}).get('run_id', ''))
+
+@socketio.on('screen_watch_start')
+def handle_screen_watch_start(data):
+    """开始屏幕监视，变化事件和分析结果通过 screen_watch_event 推送"""
+    data = data or {}
+    if not config['system'].get('allow_system_control', False):
+        emit('screen_watch_event', {'type': 'error', 'error': '系统控制已禁用'})
+        return
+    
+    session_id = request.sid
+    
+    def push(event):
+        socketio.emit('screen_watch_event', event, room=session_id)
+    
+    try:
+        options = dict(data, **_capture_target(data))
+        watch_id = screen_watch_manager.start(session_id, options, push)
+        emit('screen_watch_event', {'type': 'accepted', 'watch_id': watch_id})
+    except (TypeError, ValueError, RuntimeError) as e:
+        emit('screen_watch_event', {'type': 'error', 'error': str(e)})
+
+@socketio.on('screen_watch_stop')
+def handle_screen_watch_stop(data):
+    """停止屏幕监视"""
+    screen_watch_manager.stop((data or {}).get('watch_id', ''), owner=request.sid)
+
+@app.route('/api/system/watch', methods=['GET'])
+def screen_watch_status():
+    """进行中的屏幕监视及统计"""
+    return jsonify({'watches': screen_watch_manager.status()})
+
+@socketio.on('system_metrics_subscribe')
+def handle_system_metrics_subscribe():
+    """订阅系统指标推送"""
+    join_room('system_metrics')
+    latest = system_controller.metrics_sampler.latest()
+    if latest is not None:
+        emit('system_metrics', latest)
+
+@socketio.on('system_metrics_unsubscribe')
+def handle_system_metrics_unsubscribe():
+    leave_room('system_metrics')
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    """客户端断开时取消其进行中的视觉分析和屏幕监视"""
+    with vision_tasks_lock:
+        for (session_id, _), cancel_event in vision_tasks.items():
+            if session_id == request.sid:
+                cancel_event.set()
+    screen_watch_manager.stop_owner(request.sid)
 
 @app.route('/health')
 def health_check():
-    """健康检查端点"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'ollama_connected': chat_manager.check_ollama_connection()
-    })
+    """健康检查端点：返回后台探测的最近结果（age_seconds 为结果时长），
+    带 refresh=1 时立即重新检查 Ollama"""
+    if request.args.get('refresh') == '1':
+        return jsonify(health_monitor.refresh())
+    return jsonify(health_monitor.report())
+
+@app.route('/ready')
+def readiness_check():
+    """就绪检查端点（供负载均衡使用）：未就绪时返回 503"""
+    ready, reasons = health_monitor.readiness()
+    return jsonify({'ready': ready, 'reasons': reasons}), 200 if ready else 503
 
 def main():
     """主函数"""